@@ -2,27 +2,105 @@
 
 from cfg_builder import CFGBuilder
 from rv32_instruction import RV32Instructions
+from instr_type import IS_INSTR, IS_BRANCH, IS_JUMP, IS_RET
+from bb import BasicBlock
 
 class AsmCFGBuilder(CFGBuilder):
-    def __init__(self, lines):
-        super().__init__(lines)
+    def __init__(self, lines, bb_enabled=False, first_line=0):
+        super().__init__(lines, bb_enabled, first_line)
 
     def parse_instructions(self):
         # Parse assembly instructions using RV32Instruction
-        pass
+        self.instructions = []
+        self.labels = {} # label ==> id of the instruction it points to, built in the same pass
 
-    def identify_leaders(self):
+        pending_labels = [] # labels on their own lines, waiting for the next instruction
+        for idx, line in enumerate(self.lines, self.first_line):
+            instr = RV32Instructions(idx, line.strip())
+
+            if instr.label is not None:
+                pending_labels.append(instr.label)
+
+            if instr.mask & IS_INSTR:
+                for label in pending_labels:
+                    self.labels[label] = len(self.instructions)
+                pending_labels = []
+                self.instructions.append(instr)
+
+        # labels at the very end point past the last instruction
+        for label in pending_labels:
+            self.labels[label] = len(self.instructions)
+
+    def identify_leaders(self, bb_enabled=None):
         # Identify leaders in assembly code
-        pass
+        if bb_enabled is None:
+            bb_enabled = self.bb_enabled
+
+        total_instrs = len(self.instructions)
+        if not bb_enabled:
+            self.leaders = set(range(total_instrs)) # every instruction is a block leader if basic block is disabled
+            return
+
+        self.leaders = {0} if total_instrs else set()
+
+        # every labeled instruction is a leader
+        self.leaders.update(idx for idx in self.labels.values() if idx < total_instrs)
+
+        # so is every instruction following a branch, jump or return
+        for idx, instr in enumerate(self.instructions):
+            if instr.mask & (IS_BRANCH | IS_JUMP | IS_RET) and idx + 1 < total_instrs:
+                self.leaders.add(idx + 1)
 
     def build_basic_blocks(self):
         # Build basic blocks for assembly code
-        pass
+        current_block = None
+        for idx, instr in enumerate(self.instructions):
+            if idx in self.leaders:
+                current_block = BasicBlock(len(self.basic_blocks))
+                self.basic_blocks.append(current_block)
+                self.cfg.V.append(current_block)
+                self.blk_2_instr_id.append(idx)
+
+            current_block.instructions.append(instr)
+            self.instr_2_blk_id.append(current_block.id)
+
+        # upward exposed uses, so values defined before their use in a block are not live on entry
+        for block in self.basic_blocks:
+            block.compute_defs_uses()
+
+    def add_edge(self, src_id, dest_id):
+        if dest_id in self.basic_blocks[src_id].succ:
+            return # a branch to the very next block
+        self.basic_blocks[src_id].succ.add(dest_id)
+        self.basic_blocks[dest_id].pred.add(src_id)
+        self.cfg.E.append((src_id, dest_id))
 
     def build_cfg_edges(self):
         # Build CFG edges for assembly code
-        pass
+        total_instrs = len(self.instructions)
+
+        for blk_id, block in enumerate(self.basic_blocks):
+            last_instr = block.instructions[-1]
+            last_idx = self.blk_2_instr_id[blk_id] + len(block.instructions) - 1
+
+            # Edge to the branch or jump target; a label outside this code (e.g. a tail call) leaves the CFG
+            target = last_instr.branch_target()
+            if target is not None:
+                target_idx = self.labels.get(target)
+                if target_idx is not None and target_idx < total_instrs:
+                    self.add_edge(blk_id, self.instr_2_blk_id[target_idx])
+
+            # Fall through, unless control never reaches the next instruction
+            if last_instr.mask & (IS_JUMP | IS_RET):
+                continue
+            if last_idx + 1 < total_instrs:
+                self.add_edge(blk_id, self.instr_2_blk_id[last_idx + 1])
 
     def merge_basic_blocks(self):
         # Merge basic blocks for assembly code
-        pass
+        if self.bb_enabled:
+            return # blocks were built merged in the first place
+
+        self.merge_blocks_in_place()
+        for block in self.basic_blocks:
+            block.compute_defs_uses()
@@ -16,6 +16,9 @@ class BasicBlock:
         self.live_in = set()
         self.live_out = set()
 
+        # for spill costs, None until estimated or profiled
+        self.frequency = None
+
     def add_instruction(self, instr: InstrType):
         self.instructions.append(instr)
         # todo> how to handle the removal of block-local variables?
@@ -0,0 +1,85 @@
+import re
+
+pat_profile_sep = re.compile(r'[\s,:]+')
+
+
+class BlockProfile:
+    '''
+        Measured execution counts of basic blocks, used as block frequencies for spill costs.
+
+        A profile file holds one "key count" pair per line, separated by whitespace, ',' or ':'. Lines starting with
+        '#' are comments. A key of the form v<id> (as printed by CFGAnalyzer.print_liveness) names a basic block, a
+        plain integer names a 1-based source line. Counts of repeated keys are summed, so dumps of several runs can
+        simply be concatenated.
+    '''
+    def __init__(self):
+        self.blocks = {}  # block id ==> count
+        self.lines = {}  # 1-based source line ==> count
+
+    @classmethod
+    def load(cls, source):
+        '''
+            Load a profile from a path or an open file. The file is streamed line by line.
+        '''
+        if isinstance(source, str):
+            with open(source, 'r') as f:
+                return cls.load(f)
+
+        profile = cls()
+        for line_num, line in enumerate(source, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+
+            parts = pat_profile_sep.split(line)
+            if len(parts) != 2:
+                raise ValueError(f'Malformed profile entry on line {line_num}: {line}')
+            key, count = parts
+            try:
+                count = int(count)
+            except ValueError:
+                count = float(count) # 2.5, 1E3, ...; integral values are kept as ints
+                if count.is_integer():
+                    count = int(count)
+
+            if key.startswith('v'):
+                blk_id = int(key[1:])
+                profile.blocks[blk_id] = profile.blocks.get(blk_id, 0) + count
+            else:
+                src_line = int(key)
+                profile.lines[src_line] = profile.lines.get(src_line, 0) + count
+
+        return profile
+
+    def block_count(self, block):
+        if block.id in self.blocks:
+            return self.blocks[block.id]
+
+        # a block executes as a whole, so any of its profiled lines gives its count
+        counts = [self.lines[instr.line_num + 1] for instr in block.instructions if instr.line_num + 1 in self.lines]
+        return max(counts) if counts else None
+
+    def apply_to_blocks(self, basic_blocks, default=None):
+        '''
+            Set the frequency of every profiled BasicBlock. Blocks missing from the profile get the default frequency
+            unless it is None, in which case they are left unchanged.
+        '''
+        for block in basic_blocks:
+            count = self.block_count(block)
+            if count is None:
+                count = default
+            if count is not None:
+                block.frequency = count
+
+    def apply_to_il(self, il, default=None):
+        '''
+            Set the frequency of the 'bb' instructions of an IntermediateLanguage. Blocks are numbered in order as by
+            IntermediateLanguage.blocks(); only block ids are meaningful for IL.
+        '''
+        for blk_id, block in enumerate(il.blocks()):
+            if block[0].opcode != 'bb':
+                continue
+
+            count = self.blocks.get(blk_id, default)
+            if count is not None:
+                block[0].frequency = count
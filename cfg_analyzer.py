@@ -1,14 +1,30 @@
-import networkx as nx
-import matplotlib.pyplot as plt
 from clike_cfg_builder import ClikeCFGBuilder
+from compact_cfg import CompactCFG
+from loop_analysis import LoopForest
+from register_allocation import Graph, color_graph, decide_spills
 
 class CFGAnalyzer:
-    def __init__(self, cfg_builder):
+    def __init__(self, cfg_builder, compact=False):
         self.cfg_builder = cfg_builder
         self.basic_blocks = cfg_builder.basic_blocks
+        # either backend offers the successors/predecessors view API
         self.cfg = cfg_builder.cfg
+        if compact:
+            # the CSR arrays replace the builder's CFG, whose edge list and per-block pred/succ sets are released:
+            # the builder stays usable through the view API (cfg.successors(), cfg.predecessors(), cfg.edges()),
+            # which is all merge_basic_blocks and the analyses walk, but block.pred and block.succ are None
+            self.cfg = cfg_builder.cfg = CompactCFG.from_cfg(cfg_builder.cfg)
+            for block in self.basic_blocks:
+                block.pred = block.succ = None
 
     def perform_liveness_analysis(self):
+        if isinstance(self.cfg, CompactCFG):
+            self.cfg.solve_liveness()
+            for blk_id, block in enumerate(self.basic_blocks):
+                block.live_in = self.cfg.register_set(self.cfg.live_in[blk_id])
+                block.live_out = self.cfg.register_set(self.cfg.live_out[blk_id])
+            return
+
         # Initialize live_in and live_out sets
         for block in self.basic_blocks:
             block.live_in = set()
@@ -24,7 +40,7 @@ class CFGAnalyzer:
 
                 # LIVEout[n] = union over successors s of LIVEin[s]
                 block.live_out = set()
-                for succ_id in block.succ:
+                for succ_id in self.cfg.successors(block.id):
                     succ_block = self.basic_blocks[succ_id]
                     block.live_out |= succ_block.live_in
 
@@ -34,6 +50,101 @@ class CFGAnalyzer:
                 if old_live_in != block.live_in or old_live_out != block.live_out:
                     changed = True
 
+    def registers(self):
+        regs = set()
+        for block in self.basic_blocks:
+            for instr in block.instructions:
+                regs |= instr.defs
+                regs |= instr.uses
+        return regs
+
+    def build_interference_graph(self):
+        '''
+            Build the register interference graph of the whole CFG. Requires perform_liveness_analysis() to be run
+            first.
+
+            Each block is walked backward from its live_out set; every register defined by an instruction interferes
+            with all registers live after that instruction.
+        '''
+        graph = Graph()
+
+        for block in self.basic_blocks:
+            live = set(block.live_out)
+            for instr in reversed(block.instructions):
+                # values live across a call interfere with the registers it clobbers
+                for reg in instr.clobbers:
+                    graph.add_node(reg)
+                    for other in live - instr.defs:
+                        if other != reg:
+                            graph.add_edge(reg, other)
+
+                for reg in instr.defs:
+                    graph.add_node(reg)
+                    for other in live:
+                        if other != reg:
+                            graph.add_edge(reg, other)
+
+                live -= instr.defs
+                live |= instr.uses
+                for reg in instr.uses:
+                    graph.add_node(reg)
+
+        # registers live on entry are all defined by the caller, before the first instruction
+        if self.basic_blocks:
+            entry_live = sorted(self.basic_blocks[0].live_in)
+            for i, reg in enumerate(entry_live):
+                for other in entry_live[i + 1:]:
+                    graph.add_edge(reg, other)
+
+        return graph
+
+    def estimate_block_frequencies(self, base=10):
+        '''
+            Assign static frequencies of base ** loop-nesting depth to all blocks without a frequency yet.
+        '''
+        loop_forest = LoopForest(self.cfg)
+        for block, frequency in zip(self.basic_blocks, loop_forest.static_frequencies(base)):
+            if block.frequency is None:
+                block.frequency = frequency
+        return loop_forest
+
+    def estimate_spill_costs(self):
+        '''
+            Estimated cost of spilling each register: its definitions and uses weighted by their block frequencies.
+        '''
+        if any(block.frequency is None for block in self.basic_blocks):
+            self.estimate_block_frequencies()
+
+        cost = {}
+        for block in self.basic_blocks:
+            for instr in block.instructions:
+                for reg in instr.defs | instr.uses:
+                    cost[reg] = cost.get(reg, 0) + block.frequency
+        return cost
+
+    def allocate(self, colors, precolored=None, allowed=None, color=color_graph, spill=decide_spills):
+        '''
+            Color the interference graph, spilling the cheapest registers when no coloring exists.
+            Registers in precolored keep their color and are never spilled, allowed limits the colors of a register.
+            color is the graph coloring function, see register_allocation.color_graph, and spill the function
+            deciding the spills, see register_allocation.decide_spills.
+            Returns the interference graph without the spilled registers, the coloring and the spilled registers.
+        '''
+        precolored = precolored or {}
+        graph = self.build_interference_graph()
+        registers = self.registers() - precolored.keys()
+        coloring = color(graph, registers, colors, precolored, allowed)
+        spilled = set()
+
+        if coloring is None:
+            cost = self.estimate_spill_costs()
+            spilled = spill(self, graph, colors, cost, registers, precolored, allowed)
+            for reg in spilled:
+                graph.remove_node(reg)
+            coloring = color(graph, registers - spilled, colors, precolored, allowed)
+
+        return graph, coloring, spilled
+
     def print_liveness(self):
         for idx, block in enumerate(self.basic_blocks):
             print(f'Basic Block v{idx}:')
@@ -47,50 +158,14 @@ class CFGAnalyzer:
             print()
 
     def plot_cfg(self):
-        G = nx.DiGraph()
-        # Add nodes
-        for idx, block in enumerate(self.cfg.V):
-            node_label = f'v{idx}'
-            # Optionally, add instructions to the node label
-            instr_texts = [instr.text.strip() for instr in block.instructions]
-            instr_summary = '\n'.join(instr_texts)
-            G.add_node(node_label, label=node_label, instr=instr_summary)
-        # Add edges
-        for edge in self.cfg.E:
-            src_id, dest_id = edge
-            src_label = f'v{src_id}'
-            dest_label = f'v{dest_id}'
-            G.add_edge(src_label, dest_label)
-        # Use the graphviz 'dot' layout for vertical arrangement
-        try:
-            pos = nx.nx_pydot.graphviz_layout(G, prog='dot')
-        except:
-            # If pygraphviz is not installed, fall back to spring_layout
-            print("PyGraphviz is not installed. Please install it to get a better layout.")
-            pos = nx.spring_layout(G)
-        # Draw nodes
-        nx.draw_networkx_nodes(G, pos, node_color='lightblue', node_size=200)
-        # Draw edges
-        nx.draw_networkx_edges(G, pos, arrowstyle='->', arrowsize=20)
-        # Draw labels
-        labels = {node: node for node in G.nodes()}
-        nx.draw_networkx_labels(G, pos, labels, font_size=10)
-        # Optionally, display instruction summaries
-        node_instrs = nx.get_node_attributes(G, 'instr')
-        for node, (x, y) in pos.items():
-            instrs = node_instrs[node]
-            plt.text(x, y - 30, instrs, fontsize=8, ha='center', va='top')
-        plt.axis('off')
-        plt.show()
-
+        # matplotlib and networkx are only loaded when plotting
+        from visualization import plot_cfg
+        plot_cfg(self.basic_blocks, self.cfg.edges())
 
 if __name__ == '__main__':
+    # Build CFG for C-like code, streaming the source file
     with open('./data/foo.c', 'r') as f:
-        c_instructions = f.readlines()
-
-    # Build CFG for C-like code
-    cfg_builder = ClikeCFGBuilder(c_instructions)
-    cfg_builder.merge_basic_blocks()
+        cfg_builder = ClikeCFGBuilder(f, bb_enabled=True)
     # Analyze CFG
     cfg_analyzer = CFGAnalyzer(cfg_builder)
     cfg_analyzer.perform_liveness_analysis()
@@ -1,10 +1,9 @@
 from abc import ABC, abstractmethod
 
-import matplotlib.pyplot as plt
-import networkx as nx
 from rv32_instruction import RV32Instructions
 from clike_instruction import CStyleInstruction
 from bb import BasicBlock
+from instr_type import IS_RET
 
 class CFG:
     '''
@@ -16,12 +15,28 @@ class CFG:
         self.V = []  # List of basic blocks
         self.E = []  # List of edges (tuples of block IDs)
 
+    # view API shared with compact_cfg.CompactCFG
+    def __len__(self):
+        return len(self.V)
+
+    def successors(self, blk_id):
+        return self.V[blk_id].succ
+
+    def predecessors(self, blk_id):
+        return self.V[blk_id].pred
+
+    def edges(self):
+        return iter(self.E)
+
 class CFGBuilder(ABC):
-    def __init__(self, lines):
-        self.lines = lines
+    def __init__(self, lines, bb_enabled=False, first_line=0):
+        self.lines = lines # any iterable of source lines, e.g. an open file; consumed once while parsing
+        self.first_line = first_line # line number of lines[0], for functions cut out of a bigger file
+        self.bb_enabled = bb_enabled # build merged basic blocks directly instead of one block per instruction
         self.instructions = []
         self.ctrl_boaders = {} # dict of control blocks, inclusive format: blk_start_instr_id ==> blk_end_instr_id
         self.instr_2_blk_id = [] # get block id of given instruction id
+        self.blk_2_instr_id = [] # get leader instruction id of given block id
         self.basic_blocks = []
         self.cfg = CFG()
         self.build_cfg()
@@ -48,7 +63,53 @@ class CFGBuilder(ABC):
 
     def build_cfg(self):
         self.parse_instructions()
+        self.lines = None # the raw text is not needed past parsing
         self.identify_leaders()
         self.build_basic_blocks()
         self.build_cfg_edges()
 
+    def merge_blocks_in_place(self):
+        '''
+            Merge per-instruction blocks in place, following the leaders of real basic blocks.
+            Edges between merged blocks are kept, pred/succ are remapped; no CFG rebuild is needed.
+        '''
+        self.identify_leaders(bb_enabled=True)
+        self.bb_enabled = True
+
+        merged_blocks = []
+        merged_leaders = []
+        blk_id_map = [] # old block id ==> merged block id
+        for blk_id, block in enumerate(self.basic_blocks):
+            leader_idx = self.blk_2_instr_id[blk_id]
+            if leader_idx in self.leaders:
+                block.id = len(merged_blocks)
+                block.pred = set()
+                block.succ = set()
+                merged_blocks.append(block)
+                merged_leaders.append(leader_idx)
+            else:
+                merged_block = merged_blocks[-1]
+                merged_block.instructions.extend(block.instructions)
+                merged_block.uses |= block.uses
+                merged_block.defs |= block.defs
+                merged_block.is_end_blk |= block.is_end_blk
+            blk_id_map.append(len(merged_blocks) - 1)
+
+        # keep the edges between merged blocks, except out of blocks starting with a return statement
+        merged_edges = []
+        for src_id, dest_id in self.cfg.edges(): # either CFG backend, see cfg_analyzer.CFGAnalyzer
+            merged_src_id = blk_id_map[src_id]
+            merged_dest_id = blk_id_map[dest_id]
+            if merged_src_id == merged_dest_id or merged_blocks[merged_src_id].instructions[0].mask & IS_RET:
+                continue
+
+            merged_blocks[merged_src_id].succ.add(merged_dest_id)
+            merged_blocks[merged_dest_id].pred.add(merged_src_id)
+            merged_edges.append((merged_src_id, merged_dest_id))
+
+        self.basic_blocks = merged_blocks
+        self.blk_2_instr_id = merged_leaders
+        self.instr_2_blk_id = [blk_id_map[blk_id] for blk_id in self.instr_2_blk_id]
+        self.cfg = CFG()
+        self.cfg.V = merged_blocks
+        self.cfg.E = merged_edges
@@ -0,0 +1,93 @@
+import hashlib
+import os
+import pickle
+
+CACHE_VERSION = b'cfg-cache-2'  # bump whenever the pickled classes change
+
+
+class CFGCache:
+    '''
+        On-disk, content-addressed cache of analyzed functions.
+
+        Entries are keyed by a hash of a function's source lines and hold the pickled analysis result (the CFG with
+        its blocks, block defs/uses and live_in/live_out sets). A function that only moved within its file is still
+        a hit; its line numbers are rebased on load. The least recently used entries are evicted once the cache
+        grows past max_bytes. Entries are pickles, so only point this at a directory you trust.
+    '''
+    def __init__(self, directory, max_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self.total_bytes = sum(entry.stat().st_size for entry in self.entries())
+
+    @staticmethod
+    def key(lines):
+        digest = hashlib.sha256(CACHE_VERSION)
+        for line in lines:
+            digest.update(line.rstrip('\n').encode())
+            digest.update(b'\n')
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.pkl')
+
+    def entries(self):
+        return [entry for entry in os.scandir(self.directory) if entry.name.endswith('.pkl')]
+
+    def get(self, key, first_line=0):
+        '''
+            The cached (name, CFGAnalyzer) of a function starting at first_line, or None.
+        '''
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                cached_first_line, result = pickle.load(f)
+            os.utime(path) # mark as recently used
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ValueError):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        shift = first_line - cached_first_line
+        if shift:
+            _, cfg_analyzer = result
+            cfg_analyzer.cfg_builder.first_line = first_line
+            for instr in cfg_analyzer.cfg_builder.instructions:
+                instr.line_num += shift
+        return result
+
+    def put(self, key, first_line, result):
+        path = self.path(key)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump((first_line, result), f, protocol=pickle.HIGHEST_PROTOCOL)
+            size = os.path.getsize(tmp_path)
+            try:
+                old_size = os.path.getsize(path) # an entry being overwritten
+            except OSError:
+                old_size = 0
+            os.replace(tmp_path, path) # atomic, concurrent builds never see half-written entries
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        self.total_bytes += size - old_size
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        entries = sorted(self.entries(), key=lambda entry: entry.stat().st_mtime)
+        self.total_bytes = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if self.total_bytes <= self.max_bytes:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+            except OSError:
+                continue
+            self.total_bytes -= size
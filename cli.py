@@ -0,0 +1,300 @@
+'''
+    Batch driver: allocate registers for C-like, RV32 assembly or IL inputs and write one JSON line per function.
+
+        python cli.py data/*.c -r 4
+        python cli.py data/foo.il -r t0,t1,t2,s1 --emit-asm
+        cat function.json | python cli.py --format il -r 3 --jobs 1
+'''
+import argparse
+import glob
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+
+import exact_coloring
+import graph_decomposition
+import register_allocation
+from cfg_analyzer import CFGAnalyzer
+from clike_cfg_builder import ClikeCFGBuilder
+from clike_instruction import pat_func_sign
+from pressure import cfg_pressure, il_pressure
+from register_allocation import Dec, Use, Instruction, IntermediateLanguage
+from rv32_backend import DEFAULT_REGISTERS, allocate_rv32
+from translation_unit import split_asm_functions, split_functions
+
+# engine name ==> (graph coloring function, spill deciding function), with the signatures of
+# register_allocation.color_graph and register_allocation.decide_spills
+ENGINES = {
+    'chaitin': (register_allocation.color_graph, register_allocation.decide_spills),
+    'decomposed': (graph_decomposition.color_decomposed, graph_decomposition.decide_spills_decomposed),
+    'exact': (exact_coloring.color_exact, exact_coloring.decide_spills_exact),
+}
+
+FORMATS = ('c', 'asm', 'il')
+C_SUFFIXES = ('.c', '.h')
+IL_SUFFIXES = ('.json',)
+
+
+def parse_registers(value, fmt):
+    '''
+        A register count or a comma separated list of register names. A count takes the first registers of
+        rv32_backend.DEFAULT_REGISTERS for assembly and names r0, r1, ... otherwise.
+    '''
+    if value is None:
+        return list(DEFAULT_REGISTERS) if fmt == 'asm' else [f'r{i}' for i in range(8)]
+    if value.isdigit():
+        count = int(value)
+        if fmt == 'asm':
+            if count > len(DEFAULT_REGISTERS):
+                raise ValueError(f'at most {len(DEFAULT_REGISTERS)} allocatable RV32 registers')
+            return list(DEFAULT_REGISTERS[:count])
+        return [f'r{i}' for i in range(count)]
+    return [reg.strip() for reg in value.split(',') if reg.strip()]
+
+
+def detect_format(path, lines):
+    if path.endswith(C_SUFFIXES):
+        return 'c'
+    if path.endswith(IL_SUFFIXES):
+        return 'il'
+    # sniff stdin and unknown suffixes
+    text = ''.join(lines).lstrip()
+    if text.startswith(('{', '[')):
+        return 'il'
+    if any(pat_func_sign.match(line) for line in lines):
+        return 'c'
+    return 'asm'
+
+
+def expand_inputs(inputs):
+    '''
+        Paths of the inputs, with globs expanded; '-' is stdin.
+    '''
+    paths = []
+    for pattern in inputs or ['-']:
+        if pattern != '-' and glob.has_magic(pattern):
+            matches = sorted(glob.glob(pattern, recursive=True))
+            if not matches:
+                raise FileNotFoundError(f'no input matches {pattern}')
+            paths.extend(matches)
+        else:
+            paths.append(pattern)
+    return paths
+
+
+def read_functions(path, fmt):
+    '''
+        Yields (format, name, first_line, payload) for every function of an input file, '-' being stdin.
+    '''
+    if path == '-':
+        lines = sys.stdin.readlines()
+    else:
+        with open(path, 'r') as f:
+            lines = f.readlines()
+    return split_input(path, lines, fmt)
+
+
+def split_input(path, lines, fmt):
+    '''
+        Yields (format, name, first_line, payload) for every function of the source lines of an input. payload is the
+        list of source lines, or the parsed JSON object of an IL function.
+    '''
+    if fmt == 'auto':
+        fmt = detect_format(path, lines)
+
+    if fmt == 'c':
+        for name, first_line, function_lines in split_functions(lines):
+            yield fmt, name, first_line, function_lines
+    elif fmt == 'il':
+        yield from il_functions(json.loads(''.join(lines)))
+    else:
+        for name, first_line, function_lines in split_asm_functions(lines):
+            yield fmt, name or os.path.basename(path), first_line, function_lines
+
+
+def il_functions(data):
+    # a single IL function or a list of them
+    for i, function in enumerate(data if isinstance(data, list) else [data]):
+        yield 'il', function.get('name', f'function{i}'), 0, function
+
+
+def il_from_json(function):
+    '''
+        An IntermediateLanguage from its JSON form:
+            {"name": "f", "instructions": [{"opcode": "bb", "frequency": 10},
+                                           {"opcode": "b = a + 2", "dec": ["b"], "use": ["a"]}, ...],
+             "successors": {"0": [1, 2], ...}, "precolored": {"r0": "r0"}}
+        Dead flags and live-in sets are computed, so they are not part of the input.
+    '''
+    instructions = [Instruction(
+        instruction['opcode'],
+        [Dec(reg, False) for reg in instruction.get('dec', [])],
+        [Use(reg, False) for reg in instruction.get('use', [])],
+        instruction.get('frequency', 1),
+        tuple(instruction.get('clobbers', ()))
+    ) for instruction in function['instructions']]
+    successors = function.get('successors')
+    if successors is not None:
+        successors = {int(blk_id): list(succ) for blk_id, succ in successors.items()}
+    return IntermediateLanguage(instructions), successors, dict(function.get('precolored', {}))
+
+
+def allocate_il(function, colors, color, spill, timings, cleanup_stats=False):
+    phase = Phases(timings)
+    il, successors, precolored = il_from_json(function)
+    phase('parse')
+    register_allocation.compute_liveness(il, successors)
+    phase('liveness')
+    # the graph savings cost two more graph constructions, so they are only measured on request
+    cleanup = {} if cleanup_stats else None
+    removed = register_allocation.cleanup_il(il, precolored, report=cleanup)
+    cleanup = cleanup or {'removed': removed}
+    phase('cleanup')
+    cost = register_allocation.estimate_spill_costs(il)
+    max_live = il_pressure(il).max_live
+    spilled = register_allocation.prespill(il, len(colors), precolored=precolored)
+    phase('pressure')
+
+    graph = register_allocation.build_graph(il)
+    register_allocation.coalesce_nodes(il, graph, precolored)
+    phase('graph')
+    coloring = color(graph, il.registers() - precolored.keys(), colors, precolored)
+    phase('color')
+
+    if coloring is None:
+        # one round of Chaitin's spilling, as in register_allocation.run
+        round_spilled = spill(il, graph, colors, cost, precolored=precolored)
+        spilled |= round_spilled
+        register_allocation.insert_spill_code(il, round_spilled)
+        graph = register_allocation.build_graph(il)
+        register_allocation.coalesce_nodes(il, graph, precolored)
+        phase('spill')
+        coloring = color(graph, il.registers() - precolored.keys(), colors, precolored)
+        phase('color')
+
+    return {'coloring': coloring, 'spilled': sorted(spilled), 'spill_cost': sum(cost[reg] for reg in spilled),
+            'max_live': max_live, 'cleanup': cleanup}
+
+
+def allocate_c(first_line, lines, colors, color, spill, timings):
+    phase = Phases(timings)
+    cfg_builder = ClikeCFGBuilder(lines, bb_enabled=True, first_line=first_line)
+    phase('cfg')
+    cfg_analyzer = CFGAnalyzer(cfg_builder)
+    cfg_analyzer.perform_liveness_analysis()
+    phase('liveness')
+    max_live = cfg_pressure(cfg_analyzer).max_live
+    _, coloring, spilled = cfg_analyzer.allocate(colors, color=color, spill=spill)
+    phase('color')
+    cost = cfg_analyzer.estimate_spill_costs() if spilled else {}
+    return {'coloring': coloring, 'spilled': sorted(spilled), 'spill_cost': sum(cost[reg] for reg in spilled),
+            'max_live': max_live}
+
+
+def allocate_asm(lines, colors, color, spill, timings, emit_asm):
+    allocation = allocate_rv32(lines, colors, color=color, spill=spill, timings=timings)
+    result = {
+        'coloring': allocation.coloring,
+        'spilled': sorted(allocation.spilled),
+        'spill_cost': allocation.spill_cost,
+        'frame_size': allocation.frame_size,
+        'rounds': allocation.rounds,
+        'removed': allocation.removed,
+    }
+    if emit_asm:
+        result['assembly'] = allocation.lines
+    return result
+
+
+class Phases:
+    '''
+        Adds the seconds since the previous call (or creation) to timings[name].
+    '''
+    def __init__(self, timings):
+        self.timings = timings
+        self.last = perf_counter()
+
+    def __call__(self, name):
+        now = perf_counter()
+        self.timings[name] = self.timings.get(name, 0.0) + now - self.last
+        self.last = now
+
+
+def allocate_function(job):
+    '''
+        Run the pipeline for one function and return its JSON record. Runs in worker processes.
+    '''
+    path, (fmt, name, first_line, payload), registers, engine, emit_asm, cleanup_stats = job
+    record = {'input': path, 'function': name, 'format': fmt, 'engine': engine}
+    timings = {}
+    start = perf_counter()
+    try:
+        colors = parse_registers(registers, fmt)
+        record['registers'] = colors
+        color, spill = ENGINES[engine]
+        if fmt == 'c':
+            record.update(allocate_c(first_line, payload, colors, color, spill, timings))
+        elif fmt == 'il':
+            record.update(allocate_il(payload, colors, color, spill, timings, cleanup_stats))
+        else:
+            record.update(allocate_asm(payload, colors, color, spill, timings, emit_asm))
+        if record['coloring'] is None:
+            record['error'] = f'no coloring with {len(colors)} registers after spilling'
+    except Exception as error:  # a bad function does not stop the others
+        record['error'] = f'{type(error).__name__}: {error}'
+    timings['total'] = perf_counter() - start
+    record['timings'] = {phase: round(seconds, 6) for phase, seconds in timings.items()}
+    return record
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(description='Graph coloring register allocation for C-like, RV32 or IL inputs. '
+                                                 'Writes one JSON line per function.')
+    parser.add_argument('inputs', nargs='*', help="input files or globs, '-' or nothing for stdin")
+    parser.add_argument('-f', '--format', choices=('auto',) + FORMATS, default='auto',
+                        help='input format, by default from the file suffix (.c/.h, .json for IL) or the content')
+    parser.add_argument('-r', '--registers',
+                        help='register count or comma separated register names (default: 8, or the RV32 '
+                             'temporaries and callee-saved registers for assembly)')
+    parser.add_argument('-e', '--engine', choices=sorted(ENGINES), default='chaitin', help='graph coloring engine')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='worker processes, 0 for all cores (default: 1)')
+    parser.add_argument('-o', '--output', default='-', help="output file, '-' for stdout")
+    parser.add_argument('--emit-asm', action='store_true', help='include the rewritten assembly of RV32 inputs')
+    parser.add_argument('--cleanup-stats', action='store_true',
+                        help='include the interference graph nodes and edges the IL cleanup saved')
+    return parser
+
+
+def main(argv=None):
+    args = make_parser().parse_args(argv)
+    jobs = args.jobs or os.cpu_count() or 1
+
+    jobs_args = ((path, function, args.registers, args.engine, args.emit_asm, args.cleanup_stats)
+                 for path in expand_inputs(args.inputs)
+                 for function in read_functions(path, args.format))
+
+    output = sys.stdout if args.output == '-' else open(args.output, 'w')
+    failed = False
+    executor = None
+    try:
+        if jobs == 1:
+            records = map(allocate_function, jobs_args)
+        else:
+            executor = ProcessPoolExecutor(max_workers=jobs)
+            records = executor.map(allocate_function, jobs_args, chunksize=4)
+        for record in records:
+            failed = failed or 'error' in record
+            output.write(json.dumps(record, sort_keys=True) + '\n')
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if output is not sys.stdout:
+            output.close()
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,13 +4,13 @@ from instr_type import InstrType, IS_BLK, IS_INSTR, IS_BLK_E, IS_RET, IS_BRANCH
 from bb import BasicBlock
 
 class ClikeCFGBuilder(CFGBuilder):
-    def __init__(self, lines):
-        super().__init__(lines)
+    def __init__(self, lines, bb_enabled=False, first_line=0):
+        super().__init__(lines, bb_enabled, first_line)
 
     def parse_instructions(self):
         self.instructions = []
 
-        for idx, line in enumerate(self.lines):
+        for idx, line in enumerate(self.lines, self.first_line):
             stripped_line = line.strip()
             instr = CStyleInstruction(idx, stripped_line)
 
@@ -22,7 +22,10 @@ class ClikeCFGBuilder(CFGBuilder):
             if instr.mask & IS_INSTR:
                 self.instructions.append(instr)
 
-    def identify_leaders(self, bb_enabled=False):
+    def identify_leaders(self, bb_enabled=None):
+        if bb_enabled is None:
+            bb_enabled = self.bb_enabled
+
         self.leaders = set()
         self.leaders.add(0)  # First instruction is always a leader
 
@@ -51,6 +54,7 @@ class ClikeCFGBuilder(CFGBuilder):
 
     def build_basic_blocks(self):
         sorted_leaders = sorted(self.leaders)
+        self.blk_2_instr_id = sorted_leaders
         leader_to_block = {}
         for i, leader in enumerate(sorted_leaders):
             block = BasicBlock(i)
@@ -85,7 +89,7 @@ class ClikeCFGBuilder(CFGBuilder):
 
         for blk_id, block in enumerate(self.basic_blocks):
             blk_leader = block.instructions[0]
-            blk_leader_idx = self.instructions.index(blk_leader)
+            blk_leader_idx = self.blk_2_instr_id[blk_id]
             next_blk_id = blk_id + 1 if blk_id + 1 < total_blocks else None
 
             # handle branch block
@@ -133,12 +137,12 @@ class ClikeCFGBuilder(CFGBuilder):
     def cleanup(self):
         self.ctrl_boaders = {} # dict of control blocks, inclusive format: blk_start_instr_id ==> blk_end_instr_id
         self.instr_2_blk_id = [] # get block id of given instruction id
+        self.blk_2_instr_id = [] # get leader instruction id of given block id
         self.basic_blocks = []
         self.cfg = CFG()
 
     def merge_basic_blocks(self):
-        # pseudo merge, we actually rebuild the entire cfg for easy impl.
-        self.cleanup()
-        self.identify_leaders(bb_enabled=True)
-        self.build_basic_blocks()
-        self.build_cfg_edges()
+        if self.bb_enabled:
+            return # blocks were built merged in the first place
+
+        self.merge_blocks_in_place()
@@ -1,100 +1,132 @@
+from functools import lru_cache
 from instr_type import InstrType, IS_BLK, IS_INSTR, IS_BLK_E, IS_RET, IS_BRANCH
 import re
 
-pat_func_sign = r'^\s*([a-zA-Z_][a-zA-Z0-9_]*\s+\*?\s*)([a-zA-Z_][a-zA-Z0-9_]*)\s*\(([^)]*)\)'
-pat_func_args = re.compile(r'\b(?:unsigned\s+)?\w+\s*[\*]*\s*(\w+)')
+pat_func_sign = re.compile(r'^\s*([a-zA-Z_][a-zA-Z0-9_]*\s+\*?\s*)([a-zA-Z_][a-zA-Z0-9_]*)\s*\(([^)]*)\)')
+
+# One token per match: identifiers, numbers, multi-character operators first, then any other single character
+pat_token = re.compile(r'[a-zA-Z_][a-zA-Z0-9_]*|[0-9][a-zA-Z0-9_.]*|'
+                       r'<<=|>>=|\+\+|--|->|&&|\|\||<<|>>|[-+*/%&|^<>!=]=|\S')
+
+KEYWORDS = frozenset({
+    'int', 'unsigned', 'signed', 'char', 'short', 'long', 'float', 'double', 'void', 'const', 'static',
+    'return', 'while', 'if', 'else', 'for', 'do', 'break', 'continue', 'sizeof',
+})
+ASSIGN_OPS = frozenset({'=', '+=', '-=', '*=', '/=', '%=', '&=', '|=', '^=', '<<=', '>>='})
+NO_VARIABLES = frozenset()
+
+
+def token_variables(tokens):
+    return frozenset(filter(str.isidentifier, tokens)).difference(KEYWORDS)
+
+
+def token_func_args(tokens):
+    # the last identifier of every parameter declaring at least a type and a name
+    params = []
+    param = []
+    depth = 0
+    for token in tokens:
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth -= 1
+            if depth == 0:
+                params.append(param)
+                break
+        elif depth == 1 and token == ',':
+            params.append(param)
+            param = []
+        elif depth == 1 and token.isidentifier():
+            param.append(token)
+    return frozenset(param[-1] for param in params if len(param) >= 2)
+
+
+def is_func_sign(tokens):
+    # return type, optional pointer, function name and opening parenthesis
+    if len(tokens) > 2 and tokens[1] == '*':
+        tokens = tokens[:1] + tokens[2:]
+    return (len(tokens) > 2 and tokens[0].isidentifier() and tokens[1].isidentifier() and tokens[2] == '('
+            and tokens[1] not in KEYWORDS)
+
+
+@lru_cache(maxsize=4096)
+def scan_line(line):
+    '''
+        Tokenize a stripped line once and classify it.
+        Returns (mask, operation, operands, defs, uses); generated sources repeat lines a lot, hence the cache.
+    '''
+    if not line: # skip empty lines
+        return 0, None, [], NO_VARIABLES, NO_VARIABLES
+
+    if line == '}':
+        return IS_BLK_E, 'block_end', [], NO_VARIABLES, NO_VARIABLES
+
+    tokens = pat_token.findall(line)
+
+    # Handle block indicators
+    # todo> make this able to handle general valid C/C++ blocks of code
+    if tokens[-1] == '{':
+        mask = IS_BLK | IS_INSTR
+        tokens.pop()
+    else:
+        mask = IS_INSTR
+
+    # Remove semicolons at the end
+    if tokens and tokens[-1] == ';':
+        tokens.pop()
+
+    first = tokens[0] if tokens else None
+
+    # Handle control flow statements
+    if first == 'while' or first == 'if':
+        condition = line[line.find('(')+1:line.rfind(')')].strip()
+        return mask | IS_BRANCH, first, [condition], NO_VARIABLES, token_variables(tokens)
+
+    if first == 'return':
+        return mask | IS_RET, 'return', [' '.join(tokens[1:])], NO_VARIABLES, token_variables(tokens)
+
+    if '++' in tokens or '--' in tokens:
+        # ++ and -- read and write their operand
+        var = ' '.join(token for token in tokens if token != '++' and token != '--')
+        variables = token_variables(tokens)
+        return mask, 'assign', [var, ' '.join(tokens)], variables, variables
+
+    assign_at = None
+    if '=' in tokens:
+        assign_at = tokens.index('=')
+    elif not ASSIGN_OPS.isdisjoint(tokens):
+        assign_at = next(i for i, token in enumerate(tokens) if token in ASSIGN_OPS)
+
+    if assign_at is not None:
+        target = tokens[:assign_at]
+        expr = tokens[assign_at + 1:]
+        defs = token_variables(target)
+        uses = token_variables(expr)
+        if tokens[assign_at] != '=':
+            uses = uses | defs # compound assignments read their target too
+        return mask, 'assign', [' '.join(target), ' '.join(expr)], defs, uses
+
+    if is_func_sign(tokens):
+        return mask, 'func', line[line.find('(')+1:line.find(')')], NO_VARIABLES, token_func_args(tokens)
+
+    return mask, 'expression', [' '.join(tokens)], NO_VARIABLES, token_variables(tokens)
+
 
 class CStyleInstruction(InstrType):
     def __init__(self, line_num, text):
         super().__init__(line_num, text)
         self.operation = None
         self.operands = []
-        self.parse_instruction()
-        self.analyze_defs_uses()
+        self.analyze_defs_uses(self.parse_instruction())
 
     def parse_instruction(self):
-        line = self.text.strip()
-
-        if not line: # skip empty lines
-            return
-
-        # Handle block indicators
-        # todo> make this able to handle general valid C/C++ blocks of code
-        if line.endswith('{'):
-            self.mask |= IS_BLK | IS_INSTR
-            line = line[:-1].strip()
-        elif line == '}':
-            self.mask |= IS_BLK_E
-            self.operation = 'block_end'
-            return
-        else:
-            self.mask |= IS_INSTR
-
-        # Remove semicolons at the end
-        if line.endswith(';'):
-            line = line[:-1].strip()
-
-        # Handle control flow statements
-        if line.startswith('while'):
-            condition = line[line.find('(')+1:line.rfind(')')].strip()
-            self.operation = 'while'
-            self.operands = [condition]
-            self.mask |= IS_BRANCH
-        elif line.startswith('if'):
-            condition = line[line.find('(')+1:line.rfind(')')].strip()
-            self.operation = 'if'
-            self.operands = [condition]
-            self.mask |= IS_BRANCH
-        elif line.startswith('return'):
-            expr = line[6:].strip()
-            self.operation = 'return'
-            self.operands = [expr]
-            self.mask |= IS_RET
-        elif '++' in line:
-            expr = line
-            var = line.replace('++', '').strip()
-            self.operands = [var, expr]
-            self.operation = 'assign'
-        elif '=' in line:
-            var, expr = line.split('=', 1)
-            var = var.strip()
-            expr = expr.strip()
-            self.operation = 'assign'
-            self.operands = [var, expr]
-        elif re.match(pat_func_sign, line):
-            self.operation = 'func'
-            self.operands = re.match(pat_func_sign, line).group(3)
-        else:
-            self.operation = 'expression'
-            self.operands = [line]
-
-    def analyze_defs_uses(self):
-
-        if self.operation == 'assign':
-            var = self.operands[0]
-            expr = self.operands[1]
-            self.defs.update(self.extract_variables(var))
-            self.uses.update(self.extract_variables(expr))
-        elif self.operation in {'return', 'expression'}:
-            expr = self.operands[0]
-            self.uses.update(self.extract_variables(expr))
-        elif self.operation in {'while', 'if'}:
-            condition = self.operands[0]
-            self.uses.update(self.extract_variables(condition))
-        elif self.operation == 'func':
-            args = self.extract_func_args(self.operands)
-            self.uses.update(args)
-
-    def extract_func_args(self, arguments):
-        # Regular expression pattern to find variable names
-        # Looks for optional pointers (*) followed by word characters (alphanumeric + '_')
-
-        # Find all matches in the input string
-        variables = pat_func_args.findall(arguments)
-        return variables
-
-    def extract_variables(self, expr):
-        tokens = re.findall(r'\b[a-zA-Z_][a-zA-Z0-9_]*\b', expr)
-        keywords = {'int', 'return', 'while', 'if'}
-        variables = set(token for token in tokens if token not in keywords)
-        return variables
+        scanned = scan_line(self.text)
+        self.mask, self.operation, operands, _, _ = scanned
+        self.operands = operands.copy() if isinstance(operands, list) else operands
+        return scanned
+
+    def analyze_defs_uses(self, scanned=None):
+        # defs and uses come out of the same scan as the operation, repeated (from the cache) when not given
+        _, _, _, defs, uses = scanned or scan_line(self.text)
+        self.defs.update(defs)
+        self.uses.update(uses)
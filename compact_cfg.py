@@ -0,0 +1,105 @@
+from array import array
+
+
+def csr(num_blocks, adjacency):
+    '''
+        Pack per-block adjacency lists into CSR form: the neighbors of block b are
+        targets[offsets[b]:offsets[b + 1]].
+    '''
+    offsets = array('l', [0]) * (num_blocks + 1)
+    targets = array('l')
+    for blk_id, neighbors in enumerate(adjacency):
+        targets.extend(sorted(neighbors))
+        offsets[blk_id + 1] = len(targets)
+    return offsets, targets
+
+
+class CompactCFG:
+    '''
+        Compact CFG backend. Blocks are numbered densely and each edge is stored once per direction in flat
+        CSR arrays instead of as tuples plus pred/succ sets. Registers are numbered densely as well, so
+        per-block defs/uses and liveness results are bit sets held in plain ints.
+
+        Offers the same view API as CFG: len(), successors(blk_id), predecessors(blk_id) and edges().
+    '''
+    def __init__(self, num_blocks, successors, predecessors, defs, uses, registers):
+        self.num_blocks = num_blocks
+        self.succ_offsets, self.succ_targets = csr(num_blocks, successors)
+        self.pred_offsets, self.pred_targets = csr(num_blocks, predecessors)
+        self._succ_view = memoryview(self.succ_targets)
+        self._pred_view = memoryview(self.pred_targets)
+
+        self.registers = list(registers)  # bit index ==> register name
+        self.reg_ids = {reg: i for i, reg in enumerate(self.registers)}
+        self.defs = [self.mask(regs) for regs in defs]
+        self.uses = [self.mask(regs) for regs in uses]
+        self.live_in = [0] * num_blocks
+        self.live_out = [0] * num_blocks
+
+    @classmethod
+    def from_cfg(cls, cfg):
+        registers = set()
+        for block in cfg.V:
+            registers |= block.defs | block.uses
+        return cls(len(cfg.V),
+                   [block.succ for block in cfg.V],
+                   [block.pred for block in cfg.V],
+                   [block.defs for block in cfg.V],
+                   [block.uses for block in cfg.V],
+                   sorted(registers))
+
+    def __len__(self):
+        return self.num_blocks
+
+    def successors(self, blk_id):
+        return self._succ_view[self.succ_offsets[blk_id]:self.succ_offsets[blk_id + 1]]
+
+    def predecessors(self, blk_id):
+        return self._pred_view[self.pred_offsets[blk_id]:self.pred_offsets[blk_id + 1]]
+
+    def edges(self):
+        for src_id in range(self.num_blocks):
+            for dest_id in self.successors(src_id):
+                yield src_id, dest_id
+
+    def mask(self, regs):
+        bits = 0
+        for reg in regs:
+            bits |= 1 << self.reg_ids[reg]
+        return bits
+
+    def register_set(self, bits):
+        regs = set()
+        while bits:
+            low = bits & -bits
+            regs.add(self.registers[low.bit_length() - 1])
+            bits ^= low
+        return regs
+
+    def solve_liveness(self):
+        '''
+            Worklist liveness over the bit sets; a block is revisited only when the live_in of a successor changed.
+        '''
+        live_in = self.live_in = [0] * self.num_blocks
+        live_out = self.live_out = [0] * self.num_blocks
+        defs = self.defs
+        uses = self.uses
+
+        worklist = list(range(self.num_blocks))
+        queued = [True] * self.num_blocks
+        while worklist:
+            blk_id = worklist.pop()
+            queued[blk_id] = False
+
+            out = 0
+            for succ_id in self.successors(blk_id):
+                out |= live_in[succ_id]
+            live_out[blk_id] = out
+
+            new_in = uses[blk_id] | (out & ~defs[blk_id])
+            if new_in != live_in[blk_id]:
+                live_in[blk_id] = new_in
+                for pred_id in self.predecessors(blk_id):
+                    if not queued[pred_id]:
+                        queued[pred_id] = True
+                        worklist.append(pred_id)
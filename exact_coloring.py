@@ -0,0 +1,200 @@
+'''
+    Exact coloring and minimum cost spilling for small functions, by DSATUR branch and bound.
+
+    color_exact and decide_spills_exact are drop-in replacements of register_allocation.color_graph and decide_spills.
+    The heuristics run first; the search only runs on components they could not color, or whose spills might be
+    cheaper, and only for functions of at most max_nodes registers. When the wall-clock budget of a call runs out, the
+    heuristic result, or the cheapest spill set found so far, is used instead.
+'''
+from time import perf_counter
+
+from register_allocation import allowed_colors, color_graph, components, decide_component_spills, neighborhood_graph
+
+EXACT_MAX_NODES = 64
+EXACT_BUDGET = 0.05  # seconds per call
+
+SPILLED = None  # the assignment of a spilled node
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+def greedy_cliques(neighbors, nodes):
+    '''
+        Partition nodes into cliques, largest degree first.
+    '''
+    cliques = []
+    left = sorted(nodes, key=lambda node: -len(neighbors[node]))
+    while left:
+        clique = [left[0]]
+        for node in left[1:]:
+            if all(member in neighbors[node] for member in clique):
+                clique.append(node)
+        cliques.append(clique)
+        left = [node for node in left if node not in clique]
+    return cliques
+
+
+class BranchAndBound:
+    '''
+        Search over the nodes of one component. Every node gets one of its colors that no neighbor has or, if cost is
+        given and its cost is finite, is spilled. DSATUR order: the node with the fewest colors left goes next, ties
+        broken by the most undecided neighbors. Colors no node has yet are interchangeable when all nodes may take all
+        colors, so only the first of them is tried.
+
+        The lower bound of a partial assignment is its spill cost plus, for each clique of a fixed clique partition,
+        the cheapest undecided members that cannot all get distinct colors.
+    '''
+    def __init__(self, graph, nodes, colors, precolored, allowed, cost, deadline):
+        self.nodes = list(nodes)
+        node_set = set(nodes)
+        self.neighbors = {node: {neighbor for neighbor in graph.neighbors(node) if neighbor in node_set}
+                          for node in nodes}
+        self.domain = {}
+        for node in nodes:
+            fixed = {precolored[neighbor] for neighbor in graph.neighbors(node) if neighbor in precolored}
+            self.domain[node] = [color for color in allowed_colors(node, colors, allowed) if color not in fixed]
+        self.symmetric = all(len(self.domain[node]) == len(colors) for node in nodes)
+        self.cost = cost
+        self.deadline = deadline
+        self.steps = 0
+
+        self.cliques = []
+        for clique in greedy_cliques(self.neighbors, nodes):
+            clique_colors = set()
+            for node in clique:
+                clique_colors.update(self.domain[node])
+            self.cliques.append((clique, len(clique_colors)))
+
+        self.assignment = {}
+        self.best = None
+        self.best_cost = float('inf')
+
+    def infeasible(self):
+        # more nodes in a clique than colors for them, before any search
+        return any(len(clique) > size for clique, size in self.cliques)
+
+    def lower_bound(self):
+        bound = 0
+        for clique, size in self.cliques:
+            colored = 0
+            undecided = []
+            for node in clique:
+                if node not in self.assignment:
+                    undecided.append(self.cost[node])
+                elif self.assignment[node] is not SPILLED:
+                    colored += 1
+            excess = len(undecided) - (size - colored)
+            if excess > 0:
+                bound += sum(sorted(undecided)[:excess])
+        return bound
+
+    def select(self):
+        best = None
+        for node in self.nodes:
+            if node in self.assignment:
+                continue
+            taken = {self.assignment[neighbor] for neighbor in self.neighbors[node] if neighbor in self.assignment}
+            feasible = [color for color in self.domain[node] if color not in taken]
+            undecided = sum(1 for neighbor in self.neighbors[node] if neighbor not in self.assignment)
+            key = (len(feasible), -undecided)
+            if best is None or key < best[0]:
+                best = (key, node, feasible)
+        return (None, None) if best is None else best[1:]
+
+    def search(self, cost):
+        self.steps += 1
+        if self.steps % 256 == 0 and perf_counter() > self.deadline:
+            raise BudgetExceeded()
+        if self.cost is not None and cost + self.lower_bound() >= self.best_cost:
+            return
+
+        node, feasible = self.select()
+        if node is None:
+            self.best = dict(self.assignment)
+            self.best_cost = cost
+            return
+
+        if self.symmetric:
+            used = set(self.assignment.values())
+            unused = [color for color in feasible if color not in used]
+            feasible = [color for color in feasible if color in used] + unused[:1]
+        for color in feasible:
+            self.assignment[node] = color
+            self.search(cost)
+            del self.assignment[node]
+            if self.best_cost == 0:
+                return
+
+        if self.cost is not None and self.cost[node] != float('inf'):
+            self.assignment[node] = SPILLED
+            self.search(cost + self.cost[node])
+            del self.assignment[node]
+
+    def solve(self):
+        '''
+            The cheapest assignment, or None if there is none. Raises BudgetExceeded when the deadline passes.
+        '''
+        if self.cost is None and self.infeasible():
+            return None
+        self.search(0)
+        return self.best
+
+
+def color_exact(g, n, colors, precolored=None, allowed=None, max_nodes=EXACT_MAX_NODES, budget=EXACT_BUDGET):
+    '''
+        Color the nodes n of the graph like register_allocation.color_graph, but return None only if no coloring
+        exists: components the heuristic cannot color are searched exactly, within budget seconds for the whole call.
+    '''
+    precolored = precolored or {}
+    n = list(n)
+    if len(n) > max_nodes:
+        return color_graph(g, n, colors, precolored, allowed)
+
+    deadline = perf_counter() + budget
+    coloring = dict(precolored)
+    for component in components(g, n, precolored):
+        graph = neighborhood_graph(g, component)
+        component_coloring = color_graph(graph, component, colors, precolored, allowed)
+        if component_coloring is None:
+            try:
+                component_coloring = BranchAndBound(graph, component, colors, precolored, allowed, None,
+                                                    deadline).solve()
+            except BudgetExceeded:
+                pass
+        if component_coloring is None:
+            return None
+        coloring.update(component_coloring)
+
+    return coloring
+
+
+def decide_spills_exact(il, graph, colors, cost, nodes=None, precolored=None, allowed=None,
+                        max_nodes=EXACT_MAX_NODES, budget=EXACT_BUDGET):
+    '''
+        The spills of register_allocation.decide_spills, improved to a spill set of minimum total cost that leaves the
+        graph colorable whenever the search of a component finishes within budget seconds for the whole call.
+        Nodes of infinite cost are never spilled by the search.
+    '''
+    precolored = precolored or {}
+    n = set(nodes) if nodes is not None else il.registers()
+    n -= precolored.keys()
+    deadline = perf_counter() + budget
+    spilled = set()
+
+    for component in components(graph, sorted(n), precolored):
+        g = neighborhood_graph(graph, component)
+        heuristic = decide_component_spills(g.subgraph(g.nodes()), component, colors, cost, precolored, allowed)
+        if heuristic and len(n) <= max_nodes:
+            search = BranchAndBound(g, component, colors, precolored, allowed, cost, deadline)
+            search.best_cost = sum(cost[reg] for reg in heuristic)
+            try:
+                search.solve()
+            except BudgetExceeded:
+                pass
+            if search.best is not None:
+                heuristic = {node for node, color in search.best.items() if color is SPILLED}
+        spilled |= heuristic
+
+    return spilled
@@ -0,0 +1,178 @@
+'''
+    Decomposition of interference graphs into parts that are colored and spilled independently.
+
+    register_allocation.color_graph and decide_spills already work one connected component at a time. This module adds
+    the clique minimal separator decomposition of a component into atoms, and colors or spills large components in
+    worker processes.
+'''
+import os
+from concurrent.futures import ProcessPoolExecutor
+from heapq import heappop, heappush
+
+from register_allocation import color_graph, components, decide_spills, neighborhood_graph
+
+PARALLEL_NODES = 256  # smaller components are cheaper to handle in this process than to send to a worker
+
+
+def minimal_elimination_order(graph, nodes):
+    '''
+        MCS-M on the subgraph induced by nodes. Returns a minimal elimination ordering, the higher neighbors (madj) of
+        every node in the minimal triangulation it defines, and the nodes that generate clique minimal separators.
+
+        Nodes are picked by largest weight; picking v raises the weight of every unpicked node u that is reachable
+        from v through unpicked nodes all lighter than u, which adds the fill edge u-v to the triangulation.
+    '''
+    weight = {node: 0 for node in nodes}  # unpicked nodes only
+    madj = {node: set() for node in nodes}
+    picked = []
+    generators = set()
+    previous = -1
+
+    while weight:
+        v = max(weight, key=weight.get)
+        if weight[v] <= previous:
+            generators.add(v)
+        previous = weight.pop(v)
+        picked.append(v)
+
+        # reach[u]: the least possible weight of the heaviest inner node of a path from v to u
+        reach = {}
+        heap = []
+        for u in graph.neighbors(v):
+            if u in weight:
+                reach[u] = -1
+                heappush(heap, (-1, u))
+        while heap:
+            r, y = heappop(heap)
+            if r > reach[y]:
+                continue
+            through = max(r, weight[y])
+            for z in graph.neighbors(y):
+                if z in weight and z != v and through < reach.get(z, through + 1):
+                    reach[z] = through
+                    heappush(heap, (through, z))
+
+        for u, r in reach.items():
+            if r < weight[u]:
+                weight[u] += 1
+                madj[u].add(v)
+
+    return picked[::-1], madj, generators
+
+
+def is_clique(graph, nodes):
+    return all(graph.contains_edge(x, y) for i, x in enumerate(nodes) for y in nodes[i + 1:])
+
+
+def clique_separator_atoms(graph, nodes):
+    '''
+        Decompose the subgraph induced by nodes along its clique minimal separators. Returns the atoms in coloring
+        order: the nodes an atom shares with earlier atoms form a clique, so coloring them first leaves the rest of
+        the atom as free as in the whole graph.
+    '''
+    order, madj, generators = minimal_elimination_order(graph, nodes)
+    remaining = set(nodes)
+    atoms = []
+
+    for x in order:
+        if x not in generators or x not in remaining:
+            continue
+        separator = sorted(madj[x] & remaining)
+        if not is_clique(graph, separator):
+            continue
+
+        # the component of x once the separator is removed
+        component = {x}
+        stack = [x]
+        while stack:
+            for neighbor in graph.neighbors(stack.pop()):
+                if neighbor in remaining and neighbor not in component and neighbor not in separator:
+                    component.add(neighbor)
+                    stack.append(neighbor)
+        if len(component) + len(separator) < len(remaining):
+            atoms.append(sorted(component) + separator)
+            remaining -= component
+
+    atoms.append(sorted(remaining))
+    return atoms[::-1]
+
+
+def color_atoms(graph, nodes, colors, precolored, allowed, color=color_graph):
+    '''
+        Color a connected component one atom at a time, the nodes colored so far acting as precolored. Falls back to
+        coloring the whole component when the separator colors chosen for earlier atoms leave a later one uncolorable.
+    '''
+    coloring = dict(precolored)
+    for atom in clique_separator_atoms(graph, nodes):
+        coloring = color(graph, [node for node in atom if node not in coloring], colors, coloring, allowed)
+        if coloring is None:
+            return color(graph, nodes, colors, precolored, allowed)
+    return coloring
+
+
+def color_part(graph, nodes, colors, precolored, allowed, atoms):
+    if atoms:
+        return color_atoms(graph, nodes, colors, precolored, allowed)
+    return color_graph(graph, nodes, colors, precolored, allowed)
+
+
+def spill_part(graph, nodes, colors, cost, precolored, allowed):
+    return decide_spills(None, graph, colors, cost, nodes, precolored, allowed)
+
+
+def map_parts(function, parts, jobs):
+    '''
+        function(*part) for every part, in order. Parts of at least PARALLEL_NODES nodes run in a process pool of jobs
+        workers (all cores by default) when there are at least two of them.
+    '''
+    large = [i for i, part in enumerate(parts) if len(part[1]) >= PARALLEL_NODES]
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    if jobs == 1 or len(large) < 2:
+        return [function(*part) for part in parts]
+
+    results = [None] * len(parts)
+    with ProcessPoolExecutor(max_workers=min(jobs, len(large))) as executor:
+        futures = {i: executor.submit(function, *parts[i]) for i in large}
+        for i, part in enumerate(parts):
+            if i not in futures:
+                results[i] = function(*part)
+        for i, future in futures.items():
+            results[i] = future.result()
+    return results
+
+
+def color_decomposed(g, n, colors, precolored=None, allowed=None, atoms=True, jobs=None):
+    '''
+        Drop-in replacement of register_allocation.color_graph. Colors every connected component separately, by clique
+        separator atoms unless atoms is False, large components in parallel, and merges the colorings.
+    '''
+    precolored = precolored or {}
+    parts = [(neighborhood_graph(g, component), component, colors, precolored, allowed, atoms)
+             for component in components(g, n, precolored)]
+
+    coloring = dict(precolored)
+    for part_coloring in map_parts(color_part, parts, jobs):
+        if part_coloring is None:
+            return None
+        coloring.update(part_coloring)
+    return coloring
+
+
+def decide_spills_decomposed(il, graph, colors, cost, nodes=None, precolored=None, allowed=None, jobs=None):
+    '''
+        register_allocation.decide_spills with large connected components decided in parallel.
+    '''
+    precolored = precolored or {}
+    n = set(nodes) if nodes is not None else il.registers()
+    n -= precolored.keys()
+
+    parts = []
+    for component in components(graph, sorted(n), precolored):
+        parts.append((neighborhood_graph(graph, component), component, colors,
+                      {reg: cost[reg] for reg in component}, precolored, allowed))
+
+    spilled = set()
+    for part_spilled in map_parts(spill_part, parts, jobs):
+        spilled |= part_spilled
+    return spilled
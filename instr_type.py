@@ -6,6 +6,7 @@ IS_RET      = 0b00010       # return
 IS_BRANCH   = 0b00100       # branch (while loop or if branch)
 IS_BLK      = 0b01000       # Block start
 IS_BLK_E    = 0b10000       # Block end
+IS_JUMP     = 0b100000      # unconditional jump (assembly)
 
 class InstrType(ABC):
 
@@ -14,6 +15,7 @@ class InstrType(ABC):
         self.text = text.strip()
         self.defs = set()
         self.uses = set()
+        self.clobbers = set() # registers overwritten as a side effect, e.g. the caller-saved ones of a call
         self.mask = 0  # Initialize mask
 
     @abstractmethod
@@ -0,0 +1,142 @@
+class Loop:
+    '''
+        A natural loop, identified by its header block. Loops sharing a header are merged into one.
+    '''
+    def __init__(self, header):
+        self.header = header
+        self.blocks = {header}  # ids of all blocks in the loop body, including the header
+        self.parent = None  # innermost enclosing loop
+        self.children = []
+        self.depth = 1  # outermost loops have depth 1
+
+
+def reverse_postorder(cfg, entry=0):
+    order = []
+    visited = {entry}
+    stack = [(entry, iter(cfg.successors(entry)))]
+    while stack:
+        blk_id, succs = stack[-1]
+        for succ_id in succs:
+            if succ_id not in visited:
+                visited.add(succ_id)
+                stack.append((succ_id, iter(cfg.successors(succ_id))))
+                break
+        else:
+            stack.pop()
+            order.append(blk_id)
+    order.reverse()
+    return order
+
+
+def compute_dominators(cfg, entry=0):
+    '''
+        Immediate dominator of every block, using the iterative algorithm of Cooper, Harvey and Kennedy.
+        The entry block is its own immediate dominator, unreachable blocks have None.
+    '''
+    order = reverse_postorder(cfg, entry)
+    position = {blk_id: i for i, blk_id in enumerate(order)}
+    idom = [None] * len(cfg)
+    idom[entry] = entry
+
+    def intersect(a, b):
+        while a != b:
+            while position[a] > position[b]:
+                a = idom[a]
+            while position[b] > position[a]:
+                b = idom[b]
+        return a
+
+    changed = True
+    while changed:
+        changed = False
+        for blk_id in order[1:]:
+            new_idom = None
+            for pred_id in cfg.predecessors(blk_id):
+                if idom[pred_id] is None:
+                    continue
+                new_idom = pred_id if new_idom is None else intersect(pred_id, new_idom)
+            if idom[blk_id] != new_idom:
+                idom[blk_id] = new_idom
+                changed = True
+
+    return idom
+
+
+def dominates(idom, a, b):
+    # walk up the dominator tree from b
+    while idom[b] is not None:
+        if a == b:
+            return True
+        if idom[b] == b:
+            return False
+        b = idom[b]
+    return False
+
+
+def find_natural_loops(cfg, idom):
+    loops = {}  # header block id ==> loop
+
+    for blk_id in range(len(cfg)):
+        if idom[blk_id] is None:
+            continue
+
+        for succ_id in cfg.successors(blk_id):
+            if not dominates(idom, succ_id, blk_id):
+                continue
+
+            # back edge blk_id -> succ_id: the loop body is everything reaching blk_id without passing the header
+            loop = loops.setdefault(succ_id, Loop(succ_id))
+            stack = [blk_id]
+            while stack:
+                body_id = stack.pop()
+                if body_id in loop.blocks:
+                    continue
+                loop.blocks.add(body_id)
+                stack.extend(pred_id for pred_id in cfg.predecessors(body_id) if idom[pred_id] is not None)
+
+    return list(loops.values())
+
+
+def nest_loops(loops):
+    '''
+        Link loops into a loop-nesting forest and return its roots.
+    '''
+    # an enclosing loop is always strictly bigger than the loops nested in it
+    loops = sorted(loops, key=lambda l: len(l.blocks))
+    roots = []
+    for i, loop in enumerate(loops):
+        outer = next((outer for outer in loops[i + 1:] if loop.header in outer.blocks), None)
+        if outer is None:
+            roots.append(loop)
+        else:
+            loop.parent = outer
+            outer.children.append(loop)
+
+    stack = list(roots)
+    while stack:
+        loop = stack.pop()
+        for child in loop.children:
+            child.depth = loop.depth + 1
+            stack.append(child)
+
+    return roots
+
+
+class LoopForest:
+    '''
+        Dominator tree, natural loops and loop-nesting forest of a CFG.
+    '''
+    def __init__(self, cfg, entry=0):
+        self.idom = compute_dominators(cfg, entry)
+        self.loops = find_natural_loops(cfg, self.idom)
+        self.roots = nest_loops(self.loops)
+
+        # loop-nesting depth of every block, 0 outside of any loop
+        self.depth = [0] * len(cfg)
+        for loop in sorted(self.loops, key=lambda l: l.depth):
+            for blk_id in loop.blocks:
+                self.depth[blk_id] = loop.depth
+
+    def static_frequencies(self, base=10):
+        # a block nested in d loops is assumed to execute base ** d times
+        return [base ** depth for depth in self.depth]
@@ -0,0 +1,208 @@
+'''
+    Portfolio allocation: run several allocator configurations on the same intermediate language in parallel and
+    keep the one with the lowest total weighted spill cost.
+
+    A configuration picks
+        spill_metric    which node to spill when simplify is stuck: the lowest 'cost', 'cost/degree' (Chaitin) or
+                        'cost/degree^2'
+        coalescing      'aggressive' (register_allocation.coalesce_nodes), 'conservative' (Briggs: only when the
+                        merged node has fewer than k neighbors of degree k or more) or 'none'
+        optimistic      push stuck nodes and spill only those select cannot color (Briggs), instead of spilling
+                        them right away (Chaitin)
+        color_order     'first' free color in the order of colors, or the 'least-used' one so far
+'''
+import copy
+import multiprocessing
+import os
+from collections import namedtuple
+from itertools import product
+from time import perf_counter
+
+from register_allocation import (allowed_colors, build_graph, coalesce_nodes, estimate_spill_costs,
+                                 insert_spill_code, is_colorable, is_unnecessary_copy)
+
+Configuration = namedtuple('Configuration', ['spill_metric', 'coalescing', 'optimistic', 'color_order'])
+
+SPILL_METRICS = {
+    'cost': 0,
+    'cost/degree': 1,
+    'cost/degree^2': 2,
+}  # metric ==> power of the degree dividing the cost
+
+CONFIGURATIONS = [Configuration(*values) for values in product(
+    SPILL_METRICS, ('aggressive', 'conservative', 'none'), (False, True), ('first', 'least-used'))]
+
+
+class PortfolioResult:
+    '''
+        The winning configuration, its interference graph and coloring, the spilled registers and their cost, and the
+        spill cost of every configuration that finished in time (infinite for those that found no coloring).
+    '''
+    def __init__(self, configuration, graph, coloring, spilled, spill_cost, scores):
+        self.configuration = configuration
+        self.graph = graph
+        self.coloring = coloring
+        self.spilled = spilled
+        self.spill_cost = spill_cost
+        self.scores = scores
+
+
+def coalesce_conservative(il, graph, colors, precolored, allowed=None):
+    '''
+        Coalesce copies like register_allocation.coalesce_nodes, but only where Briggs' test guarantees that the
+        merged node does not make the graph harder to color, and the two registers have a color in common. Returns
+        the allowed colors after the merges: a merged node may take the colors both registers could.
+    '''
+    k = len(colors)
+    allowed = dict(allowed or {})
+
+    def colors_of(reg):
+        return {precolored[reg]} if reg in precolored else set(allowed_colors(reg, colors, allowed))
+
+    def is_safe(instruction):
+        source, target = instruction.dec[0].reg, instruction.use[0].reg
+        if not colors_of(source) & colors_of(target):
+            return False
+        merged = set(graph.neighbors(source)) | set(graph.neighbors(target))
+        return len([node for node in merged if len(graph.neighbors(node)) >= k]) < k
+
+    while True:
+        found = next((instruction for instruction in il.instructions
+                      if is_unnecessary_copy(instruction, graph, precolored) and is_safe(instruction)), None)
+        if found is None:
+            return allowed
+        source, target = found.dec[0].reg, found.use[0].reg
+        if source in precolored:
+            source, target = target, source
+        if (source in allowed or target in allowed) and target not in precolored:
+            allowed[target] = colors_of(source) & colors_of(target)
+        allowed.pop(source, None)
+        graph.rename_node(source, target)
+        il.rewrite_il({source: target})
+
+
+def simplify_select(graph, nodes, colors, cost, precolored, allowed, configuration):
+    '''
+        One round of simplify and select. Returns the coloring and the registers to spill, of which there are none
+        when the coloring is complete.
+    '''
+    power = SPILL_METRICS[configuration.spill_metric]
+    g = copy.copy(graph)
+    n = sorted(nodes)
+    stack = []
+    spilled = set()
+
+    while n:
+        node = next((node for node in n if is_colorable(g, node, colors, precolored, allowed)), None)
+        if node is None:
+            node = min(n, key=lambda reg: cost.get(reg, 0) / max(len(g.neighbors(reg)), 1) ** power)
+            if not configuration.optimistic:
+                spilled.add(node)
+        g.remove_node(node)
+        n.remove(node)
+        if node not in spilled:
+            stack.append(node)
+
+    coloring = dict(precolored)
+    used = dict.fromkeys(colors, 0)
+    for node in reversed(stack):
+        neighbor_colors = {coloring.get(neighbor) for neighbor in graph.neighbors(node)}
+        free = [color for color in allowed_colors(node, colors, allowed) if color not in neighbor_colors]
+        if not free:
+            spilled.add(node)
+            continue
+        color = free[0] if configuration.color_order == 'first' else min(free, key=used.get)
+        coloring[node] = color
+        used[color] += 1
+
+    return coloring, spilled
+
+
+def allocate_configuration(il, colors, precolored, allowed, configuration, cost, max_rounds=4):
+    '''
+        Allocate a copy of il with one configuration. Returns the configuration, the rewritten instructions, the
+        interference graph, the coloring or None, and the spilled registers.
+    '''
+    il = copy.deepcopy(il)
+    spilled = set()
+    round_cost = dict(cost)
+
+    for _ in range(max_rounds):
+        graph = build_graph(il)
+        round_allowed = allowed
+        if configuration.coalescing == 'aggressive':
+            coalesce_nodes(il, graph, precolored)
+        elif configuration.coalescing == 'conservative':
+            round_allowed = coalesce_conservative(il, graph, colors, precolored, allowed)
+
+        coloring, round_spilled = simplify_select(graph, il.registers() - precolored.keys(), colors, round_cost,
+                                                  precolored, round_allowed, configuration)
+        if not round_spilled:
+            return configuration, il.instructions, graph, coloring, spilled
+        if round_spilled <= spilled:
+            break
+        spilled |= round_spilled
+        insert_spill_code(il, round_spilled)
+        # spill code keeps the register names, so spilling a register again does not shorten its live ranges
+        for reg in round_spilled:
+            round_cost[reg] = float('inf')
+
+    return configuration, il.instructions, graph, None, spilled
+
+
+def allocate_job(job):
+    return allocate_configuration(*job)
+
+
+def run_portfolio(il, colors, precolored=None, allowed=None, configurations=CONFIGURATIONS, deadline=1.0,
+                  jobs=None):
+    '''
+        Allocate il with every configuration, in a pool of jobs worker processes (all cores by default, jobs=1 runs
+        them one after another in this process), and keep the one with the lowest total spill cost, estimated by
+        register_allocation.estimate_spill_costs on il as given. Ties go to the earlier configuration.
+
+        Configurations still running deadline seconds after the start are cancelled, and their worker processes
+        terminated; without workers, configurations not started by then are skipped. il is rewritten to the winning
+        allocation, as register_allocation.run does. Returns a PortfolioResult, or None if no configuration finished
+        in time.
+    '''
+    precolored = precolored or {}
+    cost = estimate_spill_costs(il)
+    jobs_args = [(il, colors, precolored, allowed, configuration, cost) for configuration in configurations]
+    end = perf_counter() + deadline
+    results = []
+
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    if jobs == 1:
+        for job in jobs_args:
+            if perf_counter() >= end:
+                break
+            results.append(allocate_job(job))
+    else:
+        pool = multiprocessing.Pool(min(jobs, len(jobs_args)))
+        try:
+            pending = pool.imap_unordered(allocate_job, jobs_args)
+            for _ in jobs_args:
+                results.append(pending.next(timeout=max(end - perf_counter(), 0)))
+        except multiprocessing.TimeoutError:
+            pass
+        finally:
+            pool.terminate()
+            pool.join()
+
+    order = {configuration: i for i, configuration in enumerate(configurations)}
+    scores = {}
+    best = None
+    for result in results:
+        configuration, _, _, coloring, spilled = result
+        scores[configuration] = sum(cost.get(reg, 0) for reg in spilled) if coloring is not None else float('inf')
+        if coloring is not None and (best is None or (scores[configuration], order[configuration]) <
+                                     (scores[best[0]], order[best[0]])):
+            best = result
+
+    if best is None:
+        return None
+    configuration, instructions, graph, coloring, spilled = best
+    il.overwrite_il(instructions)
+    return PortfolioResult(configuration, graph, coloring, spilled, scores[configuration], scores)
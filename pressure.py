@@ -0,0 +1,135 @@
+'''
+    Register pressure: the number of registers needed at every instruction, the larger of the values live before it
+    and the values live across it plus the ones it defines, per block and per function (MaxLive).
+
+    A function whose MaxLive is above the number of registers has that many simultaneously live values, which rarely
+    color; il_pressure lets the allocator spill before its first coloring attempt, and both reports point tools at
+    the blocks where the pressure is.
+'''
+
+
+class PressureReport:
+    '''
+        points[b][i] is the pressure at the i-th instruction of block b, block_max[b] the largest one of block b and
+        max_live the largest one of the function.
+    '''
+    def __init__(self, points):
+        self.points = points
+        self.block_max = [max(block, default=0) for block in points]
+        self.max_live = max(self.block_max, default=0)
+
+    def hotspots(self, k):
+        '''
+            (block, MaxLive) of the blocks needing more than k registers, highest pressure first.
+        '''
+        hot = [(blk_id, size) for blk_id, size in enumerate(self.block_max) if size > k]
+        return sorted(hot, key=lambda item: -item[1])
+
+    def to_dict(self):
+        return {'max_live': self.max_live, 'block_max': self.block_max}
+
+
+def il_live_points(il):
+    '''
+        Yields (block number, instruction, number of registers live before it, live) for every instruction of an
+        IntermediateLanguage with dead flags, e.g. from register_allocation.compute_liveness, walking it forward like
+        register_allocation.build_graph. live holds the registers live across the instruction and is only valid until
+        the next one.
+    '''
+    blk_id = -1
+    live = {}  # register ==> number of live definitions, as in build_graph
+    for instruction in il.instructions:
+        if instruction.opcode == 'bb':
+            blk_id += 1
+            live = {}
+            for dec in instruction.dec:
+                if not dec.dead:
+                    live[dec.reg] = live.get(dec.reg, 0) + 1
+            continue
+        if blk_id < 0:
+            blk_id = 0
+
+        before = len(live)
+        for use in instruction.use:
+            if use.dead and use.reg in live:
+                live[use.reg] -= 1
+                if live[use.reg] == 0:
+                    live.pop(use.reg)
+        yield blk_id, instruction, before, live
+        for dec in instruction.dec:
+            if not dec.dead:
+                live[dec.reg] = live.get(dec.reg, 0) + 1
+
+
+def il_pressure(il):
+    '''
+        The PressureReport of an IntermediateLanguage with dead flags. Blocks are numbered in the order of their 'bb'
+        instructions, as in register_allocation.compute_liveness.
+    '''
+    points = []
+    for blk_id, instruction, before, live in il_live_points(il):
+        while len(points) <= blk_id:
+            points.append([])
+        across = len(live) + len({dec.reg for dec in instruction.dec if dec.reg not in live})
+        points[blk_id].append(max(before, across))
+    return PressureReport(points)
+
+
+def cfg_pressure(cfg_analyzer):
+    '''
+        The PressureReport of a CFGAnalyzer after perform_liveness_analysis(), each block walked backward from its
+        live_out set.
+    '''
+    points = []
+    for block in cfg_analyzer.basic_blocks:
+        live = set(block.live_out)
+        sizes = []
+        for instr in reversed(block.instructions):
+            across = len(live | instr.defs)
+            live -= instr.defs
+            live |= instr.uses
+            sizes.append(max(len(live), across))
+        points.append(sizes[::-1])
+    return PressureReport(points)
+
+
+def pressure_spills(il, k, cost, precolored=()):
+    '''
+        Registers to spill before the first coloring attempt so that no instruction needs more than k registers.
+        Spilling only helps where a value is live across an instruction without being used or defined by it, so at
+        every instruction above k the cheapest such values are chosen, highest pressure first.
+    '''
+    points = []
+    for _, instruction, _, live in il_live_points(il):
+        needed = live.keys() | {dec.reg for dec in instruction.dec}
+        if len(needed) > k:
+            points.append((needed, instruction))
+    points.sort(key=lambda point: -len(point[0]))
+
+    spilled = set()
+    for needed, instruction in points:
+        touched = {dec.reg for dec in instruction.dec} | {use.reg for use in instruction.use}
+        candidates = sorted((reg for reg in needed - touched - spilled if reg not in precolored),
+                            key=lambda reg: (cost.get(reg, 0), reg))
+        excess = len(needed - spilled) - k
+        spilled.update(candidates[:max(excess, 0)])
+    return spilled
+
+
+if __name__ == '__main__':
+    import sys
+    from asm_cfg_builder import AsmCFGBuilder
+    from cfg_analyzer import CFGAnalyzer
+    from clike_cfg_builder import ClikeCFGBuilder
+
+    # per-block MaxLive of a C-like or RV32 assembly function and its blocks above k registers
+    path = sys.argv[1] if len(sys.argv) > 1 else './data/foo.c'
+    k = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    with open(path, 'r') as f:
+        builder = ClikeCFGBuilder if path.endswith('.c') else AsmCFGBuilder
+        cfg_analyzer = CFGAnalyzer(builder(f, bb_enabled=True))
+    cfg_analyzer.perform_liveness_analysis()
+    report = cfg_pressure(cfg_analyzer)
+    for blk_id, size in enumerate(report.block_max):
+        print(f'block {blk_id}: MaxLive {size}')
+    print(f'MaxLive {report.max_live}, hotspots above {k}: {report.hotspots(k)}')
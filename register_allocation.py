@@ -1,9 +1,11 @@
 import copy
 from random import choice
-from instr_type import List, Set, Collection, Dict, Optional, Tuple
+from typing import List, Set, Collection, Dict, Optional, Tuple
 
-import matplotlib.pyplot as plt
-import networkx as nx
+from pressure import il_pressure, pressure_spills
+
+# run() spills by register pressure before coloring when MaxLive exceeds this many times the number of colors
+PRESPILL_FACTOR = 1.5
 
 
 class Dec:
@@ -19,11 +21,13 @@ class Use:
 
 
 class Instruction:
-    def __init__(self, opcode: str, dec: List[Dec], use: List[Use], frequency=1):
+    def __init__(self, opcode: str, dec: List[Dec], use: List[Use], frequency=1, clobbers: Collection[str] = ()):
         self.opcode = opcode
         self.dec = dec
         self.use = use
         self.frequency = frequency
+        # precolored registers overwritten by the instruction, e.g. caller-saved ones of a call
+        self.clobbers = clobbers
 
 
 class IntermediateLanguage:
@@ -41,7 +45,9 @@ class IntermediateLanguage:
         self.instructions = [Instruction(
             instruction.opcode,
             [Dec(f.get(dec.reg, dec.reg), dec.dead) for dec in instruction.dec],
-            [Use(f.get(use.reg, use.reg), use.dead) for use in instruction.use]
+            [Use(f.get(use.reg, use.reg), use.dead) for use in instruction.use],
+            instruction.frequency,
+            instruction.clobbers
         ) for instruction in self.instructions]
 
     def registers(self) -> Set[str]:
@@ -55,6 +61,20 @@ class IntermediateLanguage:
 
         return reg
 
+    def blocks(self) -> List[List[Instruction]]:
+        """
+        Splits the instructions into basic blocks. Every block except possibly the first one starts with a 'bb'
+        instruction.
+        """
+        blocks = []
+
+        for instruction in self.instructions:
+            if instruction.opcode == 'bb' or len(blocks) == 0:
+                blocks.append([])
+            blocks[-1].append(instruction)
+
+        return blocks
+
 
 class Graph:
     """
@@ -88,15 +108,32 @@ class Graph:
             y_list.append(x)
         self._adjacency_list[y] = y_list
 
+    def add_node(self, x):
+        """
+        Add a node to the graph. Nodes without any interference are otherwise not part of the graph.
+        """
+        self._adjacency_list.setdefault(x, [])
+
+    def nodes(self):
+        return list(self._adjacency_list.keys())
+
     def contains_edge(self, x, y):
         return y in self._adjacency_list.get(x, [])
 
     def remove_node(self, node):
-        if node in self._adjacency_list:
-            self._adjacency_list.pop(node)
-        for key in self._adjacency_list.keys():
-            if node in self._adjacency_list.get(key):
-                self._adjacency_list.get(key).remove(node)
+        # edges are stored in both directions, so only the neighbors' lists mention node
+        for neighbor in self._adjacency_list.pop(node, []):
+            self._adjacency_list[neighbor].remove(node)
+
+    def subgraph(self, nodes: Collection[str]) -> 'Graph':
+        """
+        The subgraph induced by nodes, with its own adjacency lists.
+        """
+        nodes = set(nodes)
+        new_graph = Graph()
+        new_graph._adjacency_list = {node: [neighbor for neighbor in self._adjacency_list.get(node, [])
+                                            if neighbor in nodes] for node in nodes}
+        return new_graph
 
     def rename_node(self, from_label, to_label):
         from_list = self._adjacency_list.pop(from_label, [])
@@ -111,51 +148,242 @@ class Graph:
     def neighbors(self, x):
         return self._adjacency_list.get(x, [])
 
-    def plot(self, coloring, title):
-        G = nx.Graph()
-
-        # Sorting to get repeatable graphs
-        nodes = sorted(self._adjacency_list.keys())
-        ordered_coloring = [coloring.get(node, 'grey') for node in nodes]
-        G.add_nodes_from(nodes)
-
-        for key in self._adjacency_list.keys():
-            for value in self._adjacency_list[key]:
-                G.add_edge(key, value)
-
-        plt.title(title)
-        nx.draw(G, pos=nx.circular_layout(G), node_color=ordered_coloring, with_labels=True, font_weight='bold')
-        plt.show()
-
+    def size(self) -> Tuple[int, int]:
+        """
+        The number of nodes and the number of edges.
+        """
+        return len(self._adjacency_list), sum(len(neighbors) for neighbors in self._adjacency_list.values()) // 2
 
-def run(il: IntermediateLanguage, colors: List[str]) -> Tuple[Optional[Graph], Optional[Dict[str, str]]]:
-    graph, coloring = color_il(il, colors)
+    def plot(self, coloring, title):
+        # matplotlib and networkx are only loaded when plotting
+        from visualization import plot_graph
+        plot_graph(self, coloring, title)
+
+
+def run(il: IntermediateLanguage, colors: List[str], precolored: Optional[Dict[str, str]] = None,
+        allowed: Optional[Dict[str, Collection[str]]] = None, plot: bool = True,
+        prespill_factor: Optional[float] = PRESPILL_FACTOR,
+        cleanup: bool = True,
+        cleanup_report: Optional[Dict[str, int]] = None) -> Tuple[Optional[Graph], Optional[Dict[str, str]]]:
+    # the cleanup first, so the pressure check does not count copies and dead definitions it removes
+    if cleanup:
+        cleanup_il(il, precolored, allowed, cleanup_report)
+    if prespill_factor is not None:
+        prespill(il, len(colors), prespill_factor, precolored)
+    graph, coloring = color_il(il, colors, precolored, allowed, plot)
     if coloring is None:
-        graph.plot({}, 'Initial')
+        if plot:
+            graph.plot({}, 'Initial')
         cost = estimate_spill_costs(il)
-        spilled = decide_spills(il, graph, colors, cost)
+        spilled = decide_spills(il, graph, colors, cost, precolored=precolored, allowed=allowed)
         insert_spill_code(il, spilled)
-        graph, coloring = color_il(il, colors)
-        graph.plot({}, 'After Spilling')
-        graph.plot(coloring, 'Colored')
+        graph, coloring = color_il(il, colors, precolored, allowed, plot)
+        if plot:
+            graph.plot({}, 'After Spilling')
+            graph.plot(coloring, 'Colored')
 
     return graph, coloring
 
 
-def color_il(il: IntermediateLanguage, colors: List[str]) -> Tuple[Optional[Graph], Optional[Dict[str, str]]]:
+def prespill(il: IntermediateLanguage, k: int, factor: float = PRESPILL_FACTOR,
+             precolored: Optional[Dict[str, str]] = None) -> Set[str]:
+    """
+    Spills registers before the first coloring attempt when the function needs far more registers than there are:
+    coloring it would only fail. The spilled registers bring every instruction down to k registers where possible.
+
+    :param il: The intermediate language, with dead flags
+    :param k: The number of colors
+    :param factor: Spill only if MaxLive is above factor * k
+    :param precolored: Nodes with a fixed color, they are never spilled
+    :return: The spilled symbolic registers
+    """
+    if il_pressure(il).max_live <= factor * k:
+        return set()
+    spilled = pressure_spills(il, k, estimate_spill_costs(il), precolored or {})
+    insert_spill_code(il, spilled)
+    return spilled
+
+
+def color_il(il: IntermediateLanguage, colors: List[str], precolored: Optional[Dict[str, str]] = None,
+             allowed: Optional[Dict[str, Collection[str]]] = None,
+             plot: bool = True) -> Tuple[Optional[Graph], Optional[Dict[str, str]]]:
+    precolored = precolored or {}
     graph = build_graph(il)
-    graph.plot({}, 'Initial')
-    coalesce_nodes(il, graph)
+    if plot:
+        graph.plot({}, 'Initial')
+    coalesce_nodes(il, graph, precolored)
     # graph.plot({}, 'After Coalescing')
-    coloring = color_graph(graph, il.registers(), colors)
+    coloring = color_graph(graph, il.registers() - precolored.keys(), colors, precolored, allowed)
 
     if coloring is None:
         return graph, None
 
-    graph.plot(coloring, 'Colored')
+    if plot:
+        graph.plot(coloring, 'Colored')
     return graph, coloring
 
 
+def compute_liveness(il: IntermediateLanguage, successors: Optional[Dict[int, List[int]]] = None) -> List[Set[str]]:
+    """
+    Computes the dead flags of every Dec and Use and the live-in set of every basic block from the plain definitions
+    and uses of the intermediate language, so producers do not have to set them by hand.
+
+    Blocks are numbered in the order of their 'bb' instructions. Each 'bb' instruction's dec list is replaced by the
+    live-in set of its block. A Use is dead if its value is not live after the instruction and a Dec is dead if the
+    defined value is never used.
+
+    :param il: The intermediate language to annotate
+    :param successors: The successor block numbers of each block. Defaults to every block falling through to the next.
+    :return: The live-in set of each block
+    """
+    blocks = il.blocks()
+
+    if successors is None:
+        successors = {i: [i + 1] for i in range(len(blocks) - 1)}
+
+    # Upward exposed uses (gen) and definitions (kill) of each block
+    gen = []
+    kill = []
+    for block in blocks:
+        used = set()
+        defined = set()
+        for instruction in block:
+            if instruction.opcode == 'bb':
+                continue
+            for use in instruction.use:
+                if use.reg not in defined:
+                    used.add(use.reg)
+            for dec in instruction.dec:
+                defined.add(dec.reg)
+        gen.append(used)
+        kill.append(defined)
+
+    # Without back edges a single sweep in reverse block order reaches the fixed point
+    acyclic = all(s > i for i, succ in successors.items() for s in succ)
+
+    live_in = [set() for _ in blocks]
+    live_out = [set() for _ in blocks]
+    changed = True
+    while changed:
+        changed = False
+        for i in reversed(range(len(blocks))):
+            out = set()
+            for s in successors.get(i, []):
+                out |= live_in[s]
+            new_in = gen[i] | (out - kill[i])
+
+            if new_in != live_in[i] or out != live_out[i]:
+                changed = not acyclic
+            live_in[i] = new_in
+            live_out[i] = out
+
+    # Walk each block backward from its live-out set to set the dead flags
+    for i, block in enumerate(blocks):
+        live = set(live_out[i])
+
+        for instruction in reversed(block):
+            if instruction.opcode == 'bb':
+                instruction.dec = [Dec(reg, False) for reg in sorted(live_in[i])]
+                continue
+
+            defined = set()
+            for dec in instruction.dec:
+                # A register defined twice by one instruction is only counted live once
+                dec.dead = dec.reg not in live or dec.reg in defined
+                defined.add(dec.reg)
+            live -= defined
+
+            for use in instruction.use:
+                # Only the first of several uses of the same register kills it
+                use.dead = use.reg not in live
+                live.add(use.reg)
+
+    return live_in
+
+
+def cleanup_il(il: IntermediateLanguage, precolored: Optional[Dict[str, str]] = None,
+               allowed: Optional[Dict[str, Collection[str]]] = None, report: Optional[Dict[str, int]] = None) -> int:
+    """
+    Pre-allocation cleanup within each basic block, so that fewer registers and interferences reach build_graph.
+
+    Copies are propagated: after 'copy' d := s, later uses of d read s as long as neither is redefined, so chains of
+    copies resolve to their first source. Copies from or to precolored registers, or registers with allowed colors,
+    are kept as they are, so no color constraint is lost. Then instructions whose definitions are all dead are
+    deleted, except those with clobbers, the only other effect an instruction defining registers has. Dead flags and
+    live-in sets are recomputed from the live-out set of each block, which neither transformation changes.
+
+    :param il: The intermediate language, with dead flags
+    :param precolored: Nodes with a fixed color
+    :param allowed: The colors each node may take, nodes without an entry may take any
+    :param report: If given, gets the number of deleted instructions and of interference graph nodes and edges
+        saved, which costs building the graph before and after the cleanup
+    :return: The number of deleted instructions
+    """
+    precolored = precolored or {}
+    fixed = precolored.keys() | (allowed or {}).keys()
+    if report is not None:
+        nodes, edges = build_graph(il).size()
+    new_il = []
+    removed = 0
+
+    for block in il.blocks():
+        head = block[0] if block[0].opcode == 'bb' else None
+        body = block[1:] if head is not None else block
+
+        # Forward: live-out set from the dead flags, and copy propagation
+        live = {dec.reg for dec in head.dec if not dec.dead} if head is not None else set()
+        copies = {}  # register ==> register holding the same value
+        copied_to = {}  # register ==> registers copies maps to it
+        propagated = []
+        for instruction in body:
+            for use in instruction.use:
+                if use.dead:
+                    live.discard(use.reg)
+            live.update(dec.reg for dec in instruction.dec if not dec.dead)
+
+            uses = [Use(copies.get(use.reg, use.reg), use.dead) for use in instruction.use]
+            for reg in [dec.reg for dec in instruction.dec] + list(instruction.clobbers):
+                copies.pop(reg, None)
+                for target in copied_to.pop(reg, ()):
+                    copies.pop(target, None)
+            if instruction.opcode == 'copy' and len(instruction.dec) == 1 and len(uses) == 1:
+                target, source = instruction.dec[0].reg, uses[0].reg
+                if target != source and target not in fixed and source not in fixed:
+                    copies[target] = source
+                    copied_to.setdefault(source, set()).add(target)
+            propagated.append(Instruction(instruction.opcode, instruction.dec, uses, instruction.frequency,
+                                          instruction.clobbers))
+
+        # Backward: dead code elimination and dead flags, with the rules of compute_liveness
+        kept = []
+        for instruction in reversed(propagated):
+            if instruction.dec and not instruction.clobbers and all(dec.reg not in live for dec in instruction.dec):
+                removed += 1
+                continue
+            defined = set()
+            decs = []
+            for dec in instruction.dec:
+                decs.append(Dec(dec.reg, dec.reg not in live or dec.reg in defined))
+                defined.add(dec.reg)
+            live -= defined
+            uses = []
+            for use in instruction.use:
+                uses.append(Use(use.reg, use.reg not in live))
+                live.add(use.reg)
+            kept.append(Instruction(instruction.opcode, decs, uses, instruction.frequency, instruction.clobbers))
+
+        if head is not None:
+            new_il.append(Instruction('bb', [Dec(reg, False) for reg in sorted(live)], head.use.copy(),
+                                      head.frequency))
+        new_il.extend(reversed(kept))
+
+    il.overwrite_il(new_il)
+    if report is not None:
+        nodes_after, edges_after = build_graph(il).size()
+        report.update(removed=removed, nodes_saved=nodes - nodes_after, edges_saved=edges - edges_after)
+    return removed
+
+
 def build_graph(il: IntermediateLanguage) -> Graph:
     graph = Graph()
     liveness = None
@@ -172,6 +400,12 @@ def build_graph(il: IntermediateLanguage) -> Graph:
                 liveness[use.reg] -= 1
                 if liveness[use.reg] == 0:
                     liveness.pop(use.reg)
+            # Everything live across the instruction interferes with the registers it clobbers
+            for reg in instruction.clobbers:
+                graph.add_node(reg)
+                for key in liveness.keys():
+                    if key != reg:
+                        graph.add_edge(reg, key)
             for dec in instruction.dec:
                 for key, value in liveness.items():
                     if key != dec.reg:
@@ -182,26 +416,33 @@ def build_graph(il: IntermediateLanguage) -> Graph:
     return graph
 
 
-def is_unnecessary_copy(instruction: Instruction, graph: Graph) -> bool:
+def is_unnecessary_copy(instruction: Instruction, graph: Graph, precolored: Optional[Dict[str, str]] = None) -> bool:
     if len(instruction.dec) == 0 or len(instruction.use) == 0:
         return False
 
     source = instruction.dec[0].reg
     target = instruction.use[0].reg
+    precolored = precolored or {}
 
     return (instruction.opcode == 'copy' and
             source != target and
+            not (source in precolored and target in precolored) and
             not graph.contains_edge(source, target))
 
 
-def coalesce_nodes(il: IntermediateLanguage, graph: Graph) -> None:
+def coalesce_nodes(il: IntermediateLanguage, graph: Graph, precolored: Optional[Dict[str, str]] = None) -> None:
     modified = True
+    precolored = precolored or {}
 
     while modified:
-        found = next((instruction for instruction in il.instructions if is_unnecessary_copy(instruction, graph)), None)
+        found = next((instruction for instruction in il.instructions
+                      if is_unnecessary_copy(instruction, graph, precolored)), None)
         if found is not None:
             source = found.dec[0].reg
             target = found.use[0].reg
+            if source in precolored:
+                # A precolored register keeps its name, the symbolic one is renamed
+                source, target = target, source
 
             f = {source: target}
 
@@ -211,22 +452,119 @@ def coalesce_nodes(il: IntermediateLanguage, graph: Graph) -> None:
             modified = False
 
 
-def color_graph(g: Graph, n: Collection[str], colors: List[str]) -> Optional[Dict[str, str]]:
-    if len(n) == 0:
-        return {}
+def allowed_colors(node: str, colors: List[str], allowed: Optional[Dict[str, Collection[str]]]) -> List[str]:
+    if allowed is None or node not in allowed:
+        return colors
+    return [color for color in colors if color in allowed[node]]
+
+
+def is_colorable(g: Graph, node: str, colors: List[str], precolored: Dict[str, str],
+                 allowed: Optional[Dict[str, Collection[str]]]) -> bool:
+    """
+    Whether node can always be colored, whatever colors its neighbors get: it has fewer constraining neighbors than
+    allowed colors. A precolored neighbor only constrains node if its color is one node may take.
+    """
+    node_colors = allowed_colors(node, colors, allowed)
+    degree = len([neighbor for neighbor in g.neighbors(node)
+                  if neighbor not in precolored or precolored[neighbor] in node_colors])
+    return degree < len(node_colors)
+
+
+def components(g: Graph, n: Collection[str], precolored: Optional[Dict[str, str]] = None) -> List[List[str]]:
+    """
+    Splits the nodes n into the connected components of the interference graph between them. Precolored nodes do not
+    connect their neighbors, since their color is fixed whatever the neighbors get.
+
+    :param g: The interference graph
+    :param n: The nodes to split
+    :param precolored: Nodes with a fixed color
+    :return: The nodes of each component, in the order of n
+    """
+    remaining = set(n) - (precolored or {}).keys()
+    result = []
+
+    for start in n:
+        if start not in remaining:
+            continue
+        remaining.remove(start)
+        component = [start]
+        for node in component:
+            for neighbor in g.neighbors(node):
+                if neighbor in remaining:
+                    remaining.remove(neighbor)
+                    component.append(neighbor)
+        result.append(component)
+
+    return result
+
+
+def neighborhood_graph(g: Graph, nodes: Collection[str]) -> Graph:
+    """
+    The subgraph of nodes and all their neighbors, which is all that coloring or spilling nodes looks at.
+    """
+    closed = set(nodes)
+    for node in nodes:
+        closed.update(g.neighbors(node))
+    return g.subgraph(closed)
+
+
+def color_graph(g: Graph, n: Collection[str], colors: List[str], precolored: Optional[Dict[str, str]] = None,
+                allowed: Optional[Dict[str, Collection[str]]] = None) -> Optional[Dict[str, str]]:
+    """
+    Colors the nodes n of the graph. Every connected component is colored on its own and the colorings are merged.
+
+    :param g: The interference graph
+    :param n: The nodes to color
+    :param colors: Possible colors
+    :param precolored: Nodes with a fixed color, e.g. physical registers. They are not in n but constrain their
+        neighbors.
+    :param allowed: The colors each node may take, all colors for nodes not listed
+    :return: The coloring of n and the precolored nodes, or None if no coloring was found
+    """
+    precolored = precolored or {}
+    coloring = dict(precolored)
+
+    for component in components(g, n, precolored):
+        component_coloring = color_component(neighborhood_graph(g, component), component, colors, precolored, allowed)
+        if component_coloring is None:
+            return None
+        coloring.update(component_coloring)
+
+    return coloring
 
-    node = next((node for node in n if len(g.neighbors(node)) < len(colors)), None)
-    if node is None:
-        return None
 
+def color_component(g: Graph, n: Collection[str], colors: List[str], precolored: Optional[Dict[str, str]] = None,
+                    allowed: Optional[Dict[str, Collection[str]]] = None) -> Optional[Dict[str, str]]:
+    """
+    Colors the nodes n of the graph by simplify and select: nodes that can always be colored are removed one by one,
+    then colored in reverse order of their removal.
+
+    :param g: The interference graph
+    :param n: The nodes to color
+    :param colors: Possible colors
+    :param precolored: Nodes with a fixed color
+    :param allowed: The colors each node may take, all colors for nodes not listed
+    :return: The coloring of n and the precolored nodes, or None if no coloring was found
+    """
+    precolored = precolored or {}
     g_copy = copy.copy(g)
-    g_copy.remove_node(node)
-    coloring = color_graph(g_copy, [n for n in n if n != node], colors)
-    if coloring is None:
-        return None
+    n = list(n)
+    stack = []
 
-    neighbor_colors = [coloring[neighbor] for neighbor in g.neighbors(node)]
-    coloring[node] = choice([color for color in colors if color not in neighbor_colors])
+    while len(n) != 0:
+        node = next((node for node in n if is_colorable(g_copy, node, colors, precolored, allowed)), None)
+        if node is None:
+            return None
+        g_copy.remove_node(node)
+        n.remove(node)
+        stack.append(node)
+
+    coloring = dict(precolored)
+    for node in reversed(stack):
+        # neighbors removed before node are not colored yet and do not constrain it
+        neighbor_colors = [coloring.get(neighbor) for neighbor in g.neighbors(node)]
+        coloring[node] = choice([color for color in allowed_colors(node, colors, allowed)
+                                 if color not in neighbor_colors])
 
     return coloring
 
@@ -257,7 +595,9 @@ def estimate_spill_costs(il: IntermediateLanguage) -> Dict[str, float]:
     return cost
 
 
-def decide_spills(il: IntermediateLanguage, graph: Graph, colors: List[str], cost: Dict[str, float]) -> Set[str]:
+def decide_spills(il: IntermediateLanguage, graph: Graph, colors: List[str], cost: Dict[str, float],
+                  nodes: Optional[Collection[str]] = None, precolored: Optional[Dict[str, str]] = None,
+                  allowed: Optional[Dict[str, Collection[str]]] = None) -> Set[str]:
     """
     Determines which symbolic registers to spill.
 
@@ -265,17 +605,44 @@ def decide_spills(il: IntermediateLanguage, graph: Graph, colors: List[str], cos
     :param graph: The interference graph
     :param colors: Possible colors
     :param cost: Estimated cost of spilling each symbolic register
+    :param nodes: The symbolic registers to consider. Defaults to all registers of the intermediate language.
+    :param precolored: Nodes with a fixed color, they are never spilled
+    :param allowed: The colors each node may take, all colors for nodes not listed
     :return: The set of spilled symbolic registers
     """
+    precolored = precolored or {}
+    n = set(nodes) if nodes is not None else il.registers()
+    n -= precolored.keys()
     spilled = set()
 
-    g = copy.copy(graph)
-    n = il.registers()
+    # spilling in one component does not make nodes of another one colorable
+    for component in components(graph, sorted(n), precolored):
+        spilled |= decide_component_spills(neighborhood_graph(graph, component), component, colors, cost, precolored,
+                                           allowed)
+
+    return spilled
+
+
+def decide_component_spills(g: Graph, n: Collection[str], colors: List[str], cost: Dict[str, float],
+                            precolored: Dict[str, str], allowed: Optional[Dict[str, Collection[str]]]) -> Set[str]:
+    """
+    Simplifies the graph, spilling the cheapest remaining node whenever no node can be removed.
+
+    :param g: The interference graph, which is modified
+    :param n: The symbolic registers to consider, none of them precolored
+    :param colors: Possible colors
+    :param cost: Estimated cost of spilling each symbolic register
+    :param precolored: Nodes with a fixed color
+    :param allowed: The colors each node may take, all colors for nodes not listed
+    :return: The set of spilled symbolic registers
+    """
+    spilled = set()
+    n = set(n)
 
     while len(n) != 0:
-        node = next((node for node in n if len(g.neighbors(node)) < len(colors)), None)
+        node = next((node for node in n if is_colorable(g, node, colors, precolored, allowed)), None)
         if node is None:
-            node = next(x for x in n if cost[x] == min([cost[y] for y in n]))
+            node = min(n, key=cost.get)
             spilled.add(node)
 
         g.remove_node(node)
@@ -293,7 +660,8 @@ def insert_spill_code(il: IntermediateLanguage, spilled: Set[str]) -> None:
                 Instruction(
                     'bb',
                     [dec for dec in instruction.dec if dec.reg not in spilled],
-                    instruction.use.copy()
+                    instruction.use.copy(),
+                    instruction.frequency
                 )
             )
         else:
@@ -323,6 +691,60 @@ def insert_spill_code(il: IntermediateLanguage, spilled: Set[str]) -> None:
                 else:
                     newdef.append(Dec(dec.reg, dec.dead))
 
-            new_il.extend(before + [Instruction(instruction.opcode, newdef, newuse)] + after)
+            new_il.extend(before + [Instruction(instruction.opcode, newdef, newuse, instruction.frequency,
+                                                instruction.clobbers)] + after)
+
+    il.overwrite_il(new_il)
+
+
+def peephole(il: IntermediateLanguage, coloring: Dict[str, str]) -> int:
+    """
+    Post-allocation cleanup, working on the colors the symbolic registers got. Within each basic block it deletes
+
+    - copies whose source and target got the same color,
+    - reloads of a spilled register whose color still holds the value loaded or stored before,
+    - spills of a value that was reloaded and not modified since.
 
+    :param il: The intermediate language, after spill code insertion and coloring
+    :param coloring: The color of each symbolic register, registers without one are their own color
+    :return: The number of deleted instructions
+    """
+    new_il = []
+    in_memory = {}  # color ==> spilled register whose memory copy the color currently holds
+
+    for instruction in il.instructions:
+        if instruction.opcode == 'bb':
+            in_memory = {}
+            new_il.append(instruction)
+            continue
+
+        if instruction.opcode == 'copy' and len(instruction.dec) == 1 and len(instruction.use) == 1:
+            if coloring.get(instruction.dec[0].reg, instruction.dec[0].reg) == \
+                    coloring.get(instruction.use[0].reg, instruction.use[0].reg):
+                continue
+        elif instruction.opcode == 'reload':
+            reg = instruction.dec[0].reg
+            color = coloring.get(reg, reg)
+            if in_memory.get(color) == reg:
+                continue
+            in_memory[color] = reg
+            new_il.append(instruction)
+            continue
+        elif instruction.opcode == 'spill':
+            reg = instruction.use[0].reg
+            color = coloring.get(reg, reg)
+            if in_memory.get(color) == reg:
+                continue
+            # The memory copy changes, other colors holding the old value are stale
+            in_memory = {key: value for key, value in in_memory.items() if value != reg}
+            in_memory[color] = reg
+            new_il.append(instruction)
+            continue
+
+        for reg in [dec.reg for dec in instruction.dec] + list(instruction.clobbers):
+            in_memory.pop(coloring.get(reg, reg), None)
+        new_il.append(instruction)
+
+    removed = len(il.instructions) - len(new_il)
     il.overwrite_il(new_il)
+    return removed
@@ -0,0 +1,369 @@
+import re
+import sys
+from time import perf_counter
+
+from asm_cfg_builder import AsmCFGBuilder
+from cfg_analyzer import CFGAnalyzer
+from register_allocation import color_graph, decide_spills
+from rv32_instruction import RV32Instructions
+from scheduling import schedule_rv32
+from instr_type import IS_INSTR, IS_JUMP, IS_RET
+
+WORD = 4
+STACK_ALIGN = 16
+
+# allocatable registers by default: temporaries and callee-saved registers, s0 is kept as frame pointer
+DEFAULT_REGISTERS = ['t0', 't1', 't2', 't3', 't4', 't5', 't6',
+                     's1', 's2', 's3', 's4', 's5', 's6', 's7', 's8', 's9', 's10', 's11']
+CALLEE_SAVED = {'s0', 'fp', 's1', 's2', 's3', 's4', 's5', 's6', 's7', 's8', 's9', 's10', 's11'}
+# callee-saved registers in ABI order, the order of their save slots
+CALLEE_SAVED_ORDER = ['s0', 's1', 's2', 's3', 's4', 's5', 's6', 's7', 's8', 's9', 's10', 's11']
+# ABI names of x0-x31
+ABI_NAMES = ['zero', 'ra', 'sp', 'gp', 'tp', 't0', 't1', 't2', 's0', 's1', 'a0', 'a1', 'a2', 'a3', 'a4', 'a5', 'a6',
+             'a7', 's2', 's3', 's4', 's5', 's6', 's7', 's8', 's9', 's10', 's11', 't3', 't4', 't5', 't6']
+# other names of the same physical register ==> its ABI name
+REGISTER_ALIASES = {'fp': 's0', **{f'x{i}': name for i, name in enumerate(ABI_NAMES)}}
+
+pat_virtual = re.compile(r'\bv[0-9]+\b')
+pat_sp_offset = re.compile(r'\s*(-?[0-9]+|spill[0-9]+)\s*\(\s*sp\s*\)$')   # offset(sp) or spill<slot>(sp)
+
+
+def is_virtual(reg):
+    return pat_virtual.fullmatch(reg) is not None
+
+
+def normalize_registers(registers):
+    '''
+        The allocatable registers with aliases replaced by their ABI names, each physical register once.
+    '''
+    result = []
+    for reg in registers:
+        reg = REGISTER_ALIASES.get(reg, reg)
+        if reg not in result:
+            result.append(reg)
+    return result
+
+
+def code_registers(instructions):
+    regs = set()
+    for instr in instructions:
+        regs |= instr.defs | instr.uses
+    return regs
+
+
+def format_instruction(opcode, operands):
+    return f'    {opcode} {", ".join(operands)}'.rstrip()
+
+
+def split_labels(lines):
+    '''
+        One label or one statement per line, so code can be inserted right before an instruction.
+    '''
+    result = []
+    for line in lines:
+        line = line.rstrip('\n')
+        label, colon, rest = line.partition(':')
+        if colon and rest.strip():
+            result.append(f'{label.strip()}:')
+            result.append(f'    {rest.strip()}')
+        else:
+            result.append(line)
+    return result
+
+
+class RV32Allocation:
+    '''
+        Result of allocate_rv32: the rewritten assembly lines, the physical register of every virtual register,
+        the stack offset of every spilled virtual register, the callee-saved registers saved by the new prologue
+        and the final frame size.
+    '''
+    def __init__(self, lines, coloring, spilled, saved, frame_size, rounds, removed=0, spill_cost=0):
+        self.lines = lines
+        self.coloring = coloring
+        self.spilled = spilled
+        self.spill_cost = spill_cost  # estimated cost of the spilled registers, weighted by block frequencies
+        self.saved = saved
+        self.frame_size = frame_size
+        self.rounds = rounds
+        self.removed = removed  # instructions deleted by the peephole pass
+
+    def text(self):
+        return '\n'.join(self.lines) + '\n'
+
+
+def frame_of(instructions):
+    # size allocated by an 'addi sp, sp, -N' prologue, 0 without one
+    if instructions and instructions[0].opcode == 'addi' and instructions[0].operands[:2] == ['sp', 'sp']:
+        operands = instructions[0].operands
+        if len(operands) != 3:
+            raise ValueError(f'malformed stack adjustment: addi {", ".join(operands)}')
+        size = -int(operands[2], 0)
+        if size > 0:
+            return size
+    return 0
+
+
+def sp_adjustment(instr):
+    # N of an 'addi sp, sp, N' in any integer notation, None for other instructions
+    if instr.opcode == 'addi' and len(instr.operands) == 3 and instr.operands[:2] == ['sp', 'sp']:
+        try:
+            return int(instr.operands[2], 0)
+        except ValueError:
+            return None  # a symbolic immediate
+    return None
+
+
+def color_virtual_registers(cfg_analyzer, registers, unspillable, color=color_graph, spill=decide_spills):
+    '''
+        Color the virtual registers with the given coloring and spilling functions. Physical registers of the code
+        are precolored, so a virtual register only gets one of them where it does not interfere, and values live
+        across calls stay out of caller-saved registers. Returns the coloring of the virtual registers, or None, the
+        virtual registers to spill and their cost.
+    '''
+    graph = cfg_analyzer.build_interference_graph()
+    virtual = {reg for reg in graph.nodes() if is_virtual(reg)}
+    precolored = {reg: REGISTER_ALIASES.get(reg, reg) for reg in graph.nodes() if not is_virtual(reg)}
+
+    coloring = color(graph, virtual, registers, precolored)
+    if coloring is not None:
+        return {reg: coloring[reg] for reg in virtual}, set(), 0
+
+    cost = cfg_analyzer.estimate_spill_costs()
+    for reg in unspillable:
+        cost[reg] = float('inf')
+    spilled = spill(cfg_analyzer, graph, registers, cost, virtual, precolored)
+    if spilled & unspillable:
+        raise ValueError(f'cannot allocate with {len(registers)} registers: {", ".join(registers)}')
+    return None, spilled, sum(cost[reg] for reg in spilled)
+
+
+def insert_spill_code(cfg_builder, lines, spilled, slots, temps):
+    '''
+        Reload spilled registers into fresh virtual registers before every use and store them after every definition.
+        Stack offsets are left symbolic (spill<slot>(sp)) until the frame layout is known.
+    '''
+    for reg in sorted(spilled):
+        slots[reg] = len(slots)
+    next_virtual = max(int(reg[1:]) for reg in code_registers(cfg_builder.instructions) if is_virtual(reg)) + 1
+
+    by_line = {instr.line_num: instr for instr in cfg_builder.instructions}
+    new_lines = []
+    for line_num, line in enumerate(lines):
+        instr = by_line.get(line_num)
+        touched = sorted((instr.defs | instr.uses) & spilled) if instr is not None else []
+        if not touched:
+            new_lines.append(line)
+            continue
+
+        renamed = {}
+        for reg in touched:
+            renamed[reg] = f'v{next_virtual}'
+            temps.add(renamed[reg])
+            next_virtual += 1
+
+        for reg in touched:
+            if reg in instr.uses:
+                new_lines.append(format_instruction('lw', [renamed[reg], f'spill{slots[reg]}(sp)']))
+        operands = [pat_virtual.sub(lambda m: renamed.get(m.group(0), m.group(0)), op) for op in instr.operands]
+        new_lines.append(format_instruction(instr.opcode, operands))
+        for reg in touched:
+            if reg in instr.defs:
+                new_lines.append(format_instruction('sw', [renamed[reg], f'spill{slots[reg]}(sp)']))
+
+    return new_lines
+
+
+def rewrite(cfg_builder, lines, coloring, slots, old_frame):
+    '''
+        Replace virtual registers by their colors and lay out the frame: spill slots and callee-saved registers at
+        the bottom, the original frame above them. Returns the new lines, the saved registers and the frame size.
+    '''
+    used = {REGISTER_ALIASES.get(reg, reg) for reg in code_registers(cfg_builder.instructions) if not is_virtual(reg)}
+    saved = sorted(set(coloring.values()) & CALLEE_SAVED - used, key=CALLEE_SAVED_ORDER.index)
+    extra = (len(slots) + len(saved)) * WORD
+    # the whole frame stays aligned, the padding goes between the save area and the original frame
+    if extra and (old_frame + extra) % STACK_ALIGN:
+        extra += STACK_ALIGN - (old_frame + extra) % STACK_ALIGN
+    save_offsets = {reg: (len(slots) + i) * WORD for i, reg in enumerate(saved)}
+
+    def resolve(operand):
+        operand = pat_virtual.sub(lambda m: coloring[m.group(0)], operand)
+        match = pat_sp_offset.match(operand)
+        if match is None or not extra:
+            return operand
+        offset = match.group(1)
+        if offset.startswith('spill'):
+            return f'{int(offset[5:]) * WORD}(sp)'
+        return f'{int(offset, 0) + extra}(sp)'  # the original frame moved up
+
+    saves = [format_instruction('sw', [reg, f'{offset}(sp)']) for reg, offset in save_offsets.items()]
+    restores = [format_instruction('lw', [reg, f'{offset}(sp)']) for reg, offset in save_offsets.items()]
+
+    by_line = {instr.line_num: instr for instr in cfg_builder.instructions}
+    first_instr = cfg_builder.instructions[0] if cfg_builder.instructions else None
+    new_lines = []
+    for line_num, line in enumerate(lines):
+        instr = by_line.get(line_num)
+        if instr is None:
+            new_lines.append(line)
+            continue
+
+        operands = [resolve(operand) for operand in instr.operands]
+        before = []
+        after = []
+        if extra and instr is first_instr:
+            if old_frame:
+                operands[2] = str(-(old_frame + extra))
+                after = saves
+            else:
+                before = [format_instruction('addi', ['sp', 'sp', str(-extra)])] + saves
+        elif extra and old_frame and sp_adjustment(instr) == old_frame:
+            before = restores
+            operands[2] = str(old_frame + extra)
+        elif extra and instr.opcode == 'addi' and operands[1] == 'sp' and operands[0] != 'sp':
+            operands[2] = str(int(operands[2], 0) + extra)  # address of a local in the original frame
+
+        if extra and not old_frame and instr.mask & IS_RET:
+            before = before + restores + [format_instruction('addi', ['sp', 'sp', str(extra)])]
+
+        new_lines.extend(before)
+        new_lines.append(format_instruction(instr.opcode, operands))
+        new_lines.extend(after)
+
+    return new_lines, saved, old_frame + extra
+
+
+def stack_slot(operand):
+    match = pat_sp_offset.match(operand)
+    if match is None or match.group(1).startswith('spill'):
+        return None
+    return int(match.group(1), 0)
+
+
+def peephole(lines):
+    '''
+        Post-allocation cleanup of straight-line RV32 code. Deletes moves between the same register, turns a lw of a
+        stack slot into a mv from a register still holding that slot (or deletes it, if it is the same register) and
+        deletes a sw of a value the slot already holds. Returns the new lines and the number of deleted instructions.
+    '''
+    new_lines = []
+    removed = 0
+    in_memory = {}  # register ==> sp offset of the stack slot whose value it currently holds
+
+    for line_num, line in enumerate(lines):
+        instr = RV32Instructions(line_num, line)
+        if instr.label is not None:
+            in_memory = {}  # other paths join here
+        if not instr.mask & IS_INSTR:
+            new_lines.append(line)
+            continue
+
+        operands = instr.operands
+        slot = stack_slot(operands[1]) if instr.opcode in {'lw', 'sw'} and len(operands) == 2 else None
+
+        if instr.opcode == 'lw' and slot is not None:
+            holder = next((reg for reg, value in in_memory.items() if value == slot), None)
+            if holder == operands[0]:
+                removed += 1
+                continue
+            if holder is not None:
+                line = format_instruction('mv', [operands[0], holder])
+                instr = RV32Instructions(line_num, line)
+                operands = instr.operands
+        elif instr.opcode == 'sw' and slot is not None:
+            if in_memory.get(operands[0]) == slot:
+                removed += 1
+                continue
+            in_memory = {reg: value for reg, value in in_memory.items() if value != slot}
+            in_memory[operands[0]] = slot
+            new_lines.append(line)
+            continue
+        elif instr.opcode == 'mv' and len(operands) == 2 and operands[0] == operands[1]:
+            removed += 1
+            continue
+
+        # other stores may alias the stack, calls and control flow leave straight-line code
+        if (instr.opcode in {'sb', 'sh', 'sw'} or 'sp' in instr.defs or instr.clobbers
+                or instr.mask & (IS_JUMP | IS_RET)):
+            in_memory = {}
+        for reg in instr.defs:
+            in_memory.pop(reg, None)
+        if instr.opcode == 'lw' and slot is not None:
+            in_memory[operands[0]] = slot
+        elif instr.opcode == 'mv' and operands[1] in in_memory:
+            in_memory[operands[0]] = in_memory[operands[1]]
+        new_lines.append(line)
+
+    return new_lines, removed
+
+
+def allocate_rv32(lines, registers=DEFAULT_REGISTERS, max_rounds=8, cleanup=True, color=color_graph,
+                  spill=decide_spills, timings=None, schedule=False):
+    '''
+        Allocate the virtual registers (v0, v1, ...) of one RV32 function to physical registers.
+
+        Virtual registers that do not fit are spilled to stack slots with real lw/sw instructions, and allocation is
+        repeated on the rewritten code until everything is colored. Physical registers used by the code are
+        precolored and calls clobber the caller-saved registers, so values live across a call end up in callee-saved
+        registers or on the stack. The frame of an 'addi sp, sp, -N' prologue and its epilogues grows
+        by the spill slots and the callee-saved registers the allocation uses; a function without one gets a new
+        prologue and an epilogue before every return. With cleanup, the peephole pass runs on the result.
+
+        color is the graph coloring function, see register_allocation.color_graph, and spill the function deciding
+        the spills, see register_allocation.decide_spills. A timings dict, if given, collects the seconds spent in each
+        phase (schedule, cfg, liveness, color, spill, rewrite, peephole) over all rounds. With schedule, the
+        instructions of every basic block are first reordered to lower the register pressure, see
+        scheduling.schedule_rv32.
+    '''
+    clock = [perf_counter()]
+
+    def phase(name):
+        now = perf_counter()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + now - clock[0]
+        clock[0] = now
+
+    registers = normalize_registers(registers)
+    lines = split_labels(lines)
+    if schedule:
+        lines, _, _ = schedule_rv32(lines)
+        phase('schedule')
+    old_frame = None
+    slots = {}  # spilled virtual register ==> slot number
+    temps = set()  # short-lived reload/store registers, never spilled again
+    spill_cost = 0
+
+    for rounds in range(1, max_rounds + 1):
+        cfg_builder = AsmCFGBuilder(lines, bb_enabled=True)
+        if old_frame is None:
+            old_frame = frame_of(cfg_builder.instructions)
+        phase('cfg')
+
+        cfg_analyzer = CFGAnalyzer(cfg_builder)
+        cfg_analyzer.perform_liveness_analysis()
+        phase('liveness')
+        coloring, spilled, cost = color_virtual_registers(cfg_analyzer, registers, temps, color, spill)
+        phase('color')
+        if coloring is not None:
+            break
+        spill_cost += cost
+        lines = insert_spill_code(cfg_builder, lines, spilled, slots, temps)
+        phase('spill')
+    else:
+        raise ValueError(f'no allocation found after {max_rounds} rounds of spilling')
+
+    new_lines, saved, frame_size = rewrite(cfg_builder, lines, coloring, slots, old_frame)
+    phase('rewrite')
+    removed = 0
+    if cleanup:
+        new_lines, removed = peephole(new_lines)
+        phase('peephole')
+    spilled = {reg: slot * WORD for reg, slot in slots.items()}
+    return RV32Allocation(new_lines, coloring, spilled, saved, frame_size, rounds, removed, spill_cost)
+
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else './data/foo.il'
+    with open(path, 'r') as f:
+        allocation = allocate_rv32(f)
+    print(allocation.text(), end='')
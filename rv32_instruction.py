@@ -1,5 +1,61 @@
 import re
-from instr_type import InstrType
+from instr_type import InstrType, IS_INSTR, IS_BRANCH, IS_JUMP, IS_RET
+
+BRANCH_OPCODES = {'beq', 'bne', 'blt', 'bge', 'bltu', 'bgeu',
+                  'beqz', 'bnez', 'blez', 'bgez', 'bltz', 'bgtz', 'bgt', 'ble', 'bgtu', 'bleu'}
+
+# rv32i register names (x0-x31 and their ABI names) plus virtual registers v0, v1, ...
+pat_register = re.compile(r'(?:x(?:[12]?[0-9]|3[01])|zero|ra|sp|gp|tp|fp|t[0-6]|s(?:1[01]|[0-9])|a[0-7]|v[0-9]+)$')
+pat_mem_operand = re.compile(r'[^(]*\(\s*([^)\s]+)\s*\)')   # offset(base)
+is_register = pat_register.match
+
+# Operand roles of each instruction format: 'rd' is defined, 'rs1'/'rs2' are used, 'mem' is an offset(base) operand
+# whose base is used, 'imm' and 'label' are ignored.
+R_TYPE = ('rd', 'rs1', 'rs2')
+I_TYPE = ('rd', 'rs1', 'imm')
+LOAD = ('rd', 'mem')
+S_TYPE = ('rs2', 'mem')
+B_TYPE = ('rs1', 'rs2', 'label')
+U_TYPE = ('rd', 'imm')
+J_TYPE = ('rd', 'label')
+
+FORMATS = {
+    R_TYPE: ('add', 'sub', 'sll', 'slt', 'sltu', 'xor', 'srl', 'sra', 'or', 'and',
+             'mul', 'mulh', 'mulhsu', 'mulhu', 'div', 'divu', 'rem', 'remu'),
+    I_TYPE: ('addi', 'slti', 'sltiu', 'xori', 'ori', 'andi', 'slli', 'srli', 'srai', 'jalr'),
+    LOAD: ('lb', 'lh', 'lw', 'lbu', 'lhu'),
+    S_TYPE: ('sb', 'sh', 'sw'),
+    B_TYPE: ('beq', 'bne', 'blt', 'bge', 'bltu', 'bgeu', 'bgt', 'ble', 'bgtu', 'bleu'),
+    U_TYPE: ('lui', 'auipc', 'li', 'la'),
+    J_TYPE: ('jal',),
+    # pseudo-instructions
+    ('rd', 'rs1'): ('mv', 'not', 'neg', 'seqz', 'snez', 'sltz', 'sgtz'),
+    ('rs1', 'label'): ('beqz', 'bnez', 'blez', 'bgez', 'bltz', 'bgtz'),
+    ('rs1',): ('jr',),
+    ('label',): ('j', 'call', 'tail'),
+    (): ('ret', 'nop'),
+}
+
+# opcode ==> (operand roles, implicit defs, implicit uses)
+OPCODES = {opcode: (roles, (), ()) for roles, opcodes in FORMATS.items() for opcode in opcodes}
+OPCODES['ret'] = ((), (), ('ra',))
+OPCODES['call'] = (('label',), ('ra',), ())
+
+# registers a call may overwrite under the standard calling convention
+CALLER_SAVED = frozenset({'ra', 't0', 't1', 't2', 't3', 't4', 't5', 't6',
+                          'a0', 'a1', 'a2', 'a3', 'a4', 'a5', 'a6', 'a7'})
+
+# one-operand forms link through ra: jal label, jalr rs
+SHORT_FORMS = {
+    'jal': (('label',), ('ra',), ()),
+    'jalr': (('rs1',), ('ra',), ()),
+}
+# two-operand jalr: jalr rd, offset(rs) or jalr rd, rs
+JALR_MEM = ('rd', 'mem')
+JALR_REG = ('rd', 'rs1')
+
+# writes to these are discarded: jal and jalr with such an rd do not link, so they are plain jumps and returns
+ZERO_REGISTERS = {'x0', 'zero'}
 
 class RV32Instructions(InstrType):
 
@@ -17,105 +73,81 @@ class RV32Instructions(InstrType):
 
     def parse_instruction(self):
         # Check for label
-        if ':' in self.text:
-            parts = self.text.split(':')
-            self.label = parts[0].strip()
-            rest = ':'.join(parts[1:]).strip()
+        label, colon, rest = self.text.partition(':')
+        if colon:
+            self.label = label.strip()
         else:
-            rest = self.text
+            rest = label
 
         # Parse opcode and operands
-        if rest:
-            tokens = rest.strip().split(None, 1)
+        tokens = rest.split(None, 1)
+        if tokens:
             self.opcode = tokens[0]
             if len(tokens) > 1:
-                operands = tokens[1]
-                self.operands = [operand.strip() for operand in operands.split(',')]
+                self.operands = [operand.strip() for operand in tokens[1].split(',')]
+
+        # Classify control flow; assembler directives are not instructions
+        if self.opcode and not self.opcode.startswith('.'):
+            self.mask |= IS_INSTR
+            if self.opcode in BRANCH_OPCODES:
+                self.mask |= IS_BRANCH
+            elif self.opcode == 'j' or (self.opcode == 'jal' and len(self.operands) == 2
+                                        and self.operands[0] in ZERO_REGISTERS):
+                self.mask |= IS_JUMP
+            elif self.opcode in {'jr', 'ret'} or (self.opcode == 'jalr' and len(self.operands) > 1
+                                                  and self.operands[0] in ZERO_REGISTERS):
+                self.mask |= IS_RET
+
+    def branch_target(self):
+        # label operand of a branch or jump
+        if self.mask & (IS_BRANCH | IS_JUMP) and self.operands:
+            return self.operands[-1]
+        return None
 
     def analyze_defs_uses(self):
         if not self.opcode:
             return
-        opcode = self.opcode
         operands = self.operands
 
-        # Pattern to match registers (including virtual ones)
-        # todo> update this to match only rv32i valid register names
-        reg_pattern = re.compile(r'^(x[0-9]+|[a-z]+[0-9]*|v[0-9]+)$')
-
-        def is_register(s):
-            return reg_pattern.match(s) is not None
-
-        # Update instruction parsing to recognize virtual registers
-        # Handle R-type instructions
-        if opcode in {'add', 'sub', 'mul', 'sll', 'srl', 'sra', 'or', 'and', 'xor', 'slt', 'sltu'}:
-            if len(operands) >= 3:
-                rd, rs1, rs2 = operands[:3]
-                if is_register(rd):
-                    self.defs.add(rd)
-                if is_register(rs1):
-                    self.uses.add(rs1)
-                if is_register(rs2):
-                    self.uses.add(rs2)
-        # Handle I-type instructions
-        elif opcode in {'addi', 'andi', 'ori', 'xori', 'slli', 'srli', 'srai', 'slti', 'sltiu', 'li', 'lui'}:
-            if len(operands) >= 2:
-                rd, rs1 = operands[:2]
-                if is_register(rd):
-                    self.defs.add(rd)
-                if is_register(rs1) and opcode != 'li':
-                    self.uses.add(rs1)
-        # Handle load and store instructions
-        elif opcode in {'lw', 'lb', 'lh', 'lbu', 'lhu'}:
-            if len(operands) >= 2:
-                rd, mem_operand = operands[:2]
-                if is_register(rd):
-                    self.defs.add(rd)
-                base_reg = self.extract_base_reg(mem_operand)
-                if is_register(base_reg):
-                    self.uses.add(base_reg)
-        elif opcode in {'sw', 'sb', 'sh'}:
-            if len(operands) >= 2:
-                rs2, mem_operand = operands[:2]
-                if is_register(rs2):
-                    self.uses.add(rs2)
-                base_reg = self.extract_base_reg(mem_operand)
-                if is_register(base_reg):
+        entry = OPCODES.get(self.opcode)
+        if entry is None:
+            return # unknown opcode or assembler directive
+        roles, implicit_defs, implicit_uses = entry
+        if len(operands) == 1 and self.opcode in SHORT_FORMS:
+            roles, implicit_defs, implicit_uses = SHORT_FORMS[self.opcode]
+        elif len(operands) == 2 and self.opcode == 'jalr':
+            roles = JALR_MEM if '(' in operands[1] else JALR_REG
+
+        # fast path for the register-register and register-immediate arithmetic forms
+        if (roles is R_TYPE or roles is I_TYPE) and len(operands) == 3:
+            rd, rs1, rs2 = operands
+            if is_register(rd):
+                self.defs.add(rd)
+            if is_register(rs1):
+                self.uses.add(rs1)
+            if roles is R_TYPE and is_register(rs2):
+                self.uses.add(rs2)
+            return
+
+        for role, operand in zip(roles, operands):
+            if role == 'rd':
+                if is_register(operand):
+                    self.defs.add(operand)
+            elif role == 'rs1' or role == 'rs2':
+                if is_register(operand):
+                    self.uses.add(operand)
+            elif role == 'mem':
+                base_reg = self.extract_base_reg(operand)
+                if base_reg is not None and is_register(base_reg):
                     self.uses.add(base_reg)
-        # Handle branch instructions
-        elif opcode in {'beq', 'bne', 'blt', 'bge', 'bltu', 'bgeu'}:
-            if len(operands) >= 2:
-                rs1, rs2 = operands[:2]
-                if is_register(rs1):
-                    self.uses.add(rs1)
-                if is_register(rs2):
-                    self.uses.add(rs2)
-        # Handle jump and move instructions
-        elif opcode == 'mv':
-            if len(operands) >= 2:
-                rd, rs = operands[:2]
-                if is_register(rd):
-                    self.defs.add(rd)
-                if is_register(rs):
-                    self.uses.add(rs)
-        elif opcode == 'jr':
-            if len(operands) >= 1:
-                rs = operands[0]
-                if is_register(rs):
-                    self.uses.add(rs)
-        elif opcode == 'j':
-            pass  # No defs or uses
-        elif opcode == 'jal' or opcode == 'jalr':
-            if len(operands) >= 1:
-                rd = operands[0]
-                if is_register(rd):
-                    self.defs.add(rd)
-        elif opcode == 'ret':
-            self.uses.add('ra')
-        # Add more instructions as needed
+        self.defs.update(implicit_defs)
+        self.uses.update(implicit_uses)
+
+        # a linking jump is a call
+        if self.opcode in {'call', 'jal', 'jalr'} and 'ra' in self.defs:
+            self.clobbers = set(CALLER_SAVED)
 
     def extract_base_reg(self, mem_operand):
         # Extracts the base register from memory operand like offset(reg)
-        if '(' in mem_operand and ')' in mem_operand:
-            base_reg = mem_operand[mem_operand.find('(')+1:mem_operand.find(')')]
-            return base_reg.strip()
-        return None
\ No newline at end of file
+        match = pat_mem_operand.match(mem_operand)
+        return match.group(1) if match else None
@@ -0,0 +1,185 @@
+'''
+    Register pressure aware scheduling of the instructions inside basic blocks, before allocation.
+
+    Blocks are cut into regions at barriers, instructions that stay in place: anything that is not a plain register
+    computation (stores, calls, branches, returns, spills, instructions without definitions). Inside a region,
+    instructions only move past each other when they have no register dependency (read after write, write after read,
+    write after write), so loads may pass loads but nothing passes a store. Each region is list scheduled bottom-up,
+    always picking the ready instruction that leaves the fewest registers live, and the new order is kept only if it
+    lowers the region's MaxLive.
+'''
+from asm_cfg_builder import AsmCFGBuilder
+from cfg_analyzer import CFGAnalyzer
+from instr_type import IS_BRANCH, IS_JUMP, IS_RET
+from pressure import cfg_pressure, il_live_points, il_pressure
+
+# RV32 opcodes that are barriers although they define a register: control transfers, memory writes, and auipc whose
+# result depends on its address
+RV32_BARRIERS = {'jal', 'jalr', 'call', 'tail', 'sb', 'sh', 'sw', 'auipc'}
+
+
+def region_max_live(order, defs, uses, live_out):
+    '''
+        MaxLive of the instructions of a region in the given order, measured like pressure.cfg_pressure.
+    '''
+    live = set(live_out)
+    max_live = len(live)
+    for i in reversed(order):
+        across = len(live | defs[i])
+        live = (live - defs[i]) | uses[i]
+        max_live = max(max_live, across, len(live))
+    return max_live
+
+
+def schedule_region(defs, uses, live_out):
+    '''
+        Reorder a region given the registers each instruction defines and uses and the registers live after it.
+        Returns the new order as a list of indices, the original one unless it lowers MaxLive.
+    '''
+    n = len(defs)
+    successors = [set() for _ in range(n)]
+    last_def = {}
+    readers = {}  # register ==> instructions reading its current value
+    for i in range(n):
+        for reg in uses[i]:
+            if reg in last_def:
+                successors[last_def[reg]].add(i)
+        for reg in defs[i]:
+            if reg in last_def:
+                successors[last_def[reg]].add(i)
+            for reader in readers.get(reg, ()):
+                if reader != i:
+                    successors[reader].add(i)
+            readers[reg] = []
+            last_def[reg] = i
+        for reg in uses[i] - defs[i]:
+            readers.setdefault(reg, []).append(i)
+
+    waiting = [len(succ) for succ in successors]  # unscheduled successors
+    predecessors = [[] for _ in range(n)]
+    for i, succ in enumerate(successors):
+        for j in succ:
+            predecessors[j].append(i)
+
+    ready = {i for i in range(n) if waiting[i] == 0}
+    live = set(live_out)
+    order = []
+    while ready:
+        # the fewest live registers above the instruction, then the fewest across it, then the original order
+        i = min(ready, key=lambda i: (len((live - defs[i]) | uses[i]), len(live | defs[i]), -i))
+        ready.remove(i)
+        order.append(i)
+        live = (live - defs[i]) | uses[i]
+        for j in predecessors[i]:
+            waiting[j] -= 1
+            if waiting[j] == 0:
+                ready.add(j)
+    order.reverse()
+
+    original = list(range(n))
+    if region_max_live(order, defs, uses, live_out) < region_max_live(original, defs, uses, live_out):
+        return order
+    return original
+
+
+def is_il_barrier(instruction):
+    return instruction.opcode == 'bb' or not instruction.dec or bool(instruction.clobbers)
+
+
+def schedule_il(il):
+    '''
+        Schedule the instructions inside every basic block of an IntermediateLanguage with dead flags, e.g. from
+        register_allocation.compute_liveness, and update the dead flags of the scheduled regions. Returns the
+        PressureReport before and after.
+    '''
+    before = il_pressure(il)
+
+    # registers live after every instruction, from the dead flags
+    live_after = {}
+    for _, instruction, _, live in il_live_points(il):
+        live_after[id(instruction)] = set(live) | {dec.reg for dec in instruction.dec if not dec.dead}
+
+    new_instructions = []
+    region = []
+    for instruction in il.instructions + [None]:
+        if instruction is not None and not is_il_barrier(instruction):
+            region.append(instruction)
+            continue
+        if region:
+            new_instructions.extend(schedule_il_region(region, live_after[id(region[-1])]))
+            region = []
+        if instruction is not None:
+            new_instructions.append(instruction)
+
+    il.overwrite_il(new_instructions)
+    return before, il_pressure(il)
+
+
+def schedule_il_region(instructions, live_out):
+    defs = [{dec.reg for dec in instruction.dec} for instruction in instructions]
+    uses = [{use.reg for use in instruction.use} for instruction in instructions]
+    order = schedule_region(defs, uses, live_out)
+    if order == list(range(len(instructions))):
+        return instructions
+
+    # dead flags of the new order, with the rules of register_allocation.compute_liveness
+    scheduled = [instructions[i] for i in order]
+    live = set(live_out)
+    for instruction in reversed(scheduled):
+        defined = set()
+        for dec in instruction.dec:
+            dec.dead = dec.reg not in live or dec.reg in defined
+            defined.add(dec.reg)
+        live -= defined
+        for use in instruction.use:
+            use.dead = use.reg not in live
+            live.add(use.reg)
+    return scheduled
+
+
+def is_rv32_barrier(instr):
+    return (instr.label is not None or not instr.defs or bool(instr.clobbers) or instr.opcode in RV32_BARRIERS or
+            bool(instr.mask & (IS_BRANCH | IS_JUMP | IS_RET)))
+
+
+def analyze_rv32(lines):
+    cfg_analyzer = CFGAnalyzer(AsmCFGBuilder(lines, bb_enabled=True))
+    cfg_analyzer.perform_liveness_analysis()
+    return cfg_analyzer
+
+
+def schedule_rv32(lines):
+    '''
+        Schedule the instructions inside every basic block of an RV32 function. Instruction lines are permuted among
+        the lines of their region; labels, directives and comments stay where they are. Returns the new lines and the
+        PressureReport before and after.
+    '''
+    lines = [line.rstrip('\n') for line in lines]
+    cfg_analyzer = analyze_rv32(lines)
+    before = cfg_pressure(cfg_analyzer)
+
+    new_lines = list(lines)
+    for block in cfg_analyzer.basic_blocks:
+        # registers live after every instruction of the block
+        live = set(block.live_out)
+        live_after = []
+        for instr in reversed(block.instructions):
+            live_after.append(set(live))
+            live = (live - instr.defs) | instr.uses
+        live_after.reverse()
+
+        region = []
+        for idx, instr in enumerate(block.instructions + [None]):
+            if instr is not None and not is_rv32_barrier(instr):
+                region.append(idx)
+                continue
+            if len(region) > 1:
+                instructions = [block.instructions[i] for i in region]
+                order = schedule_region([instr.defs for instr in instructions], [instr.uses for instr in instructions],
+                                        live_after[region[-1]])
+                for instr_slot, i in zip(instructions, order):
+                    new_lines[instr_slot.line_num] = lines[instructions[i].line_num]
+            region = []
+
+    after = cfg_pressure(analyze_rv32(new_lines)) if new_lines != lines else before
+    return new_lines, before, after
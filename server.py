@@ -0,0 +1,256 @@
+'''
+    Long-running allocation server on a local Unix socket, so callers pay the interpreter start-up and imports once.
+
+    Clients send one JSON request per line and get one JSON response per request, in completion order:
+
+        {"id": 1, "format": "asm", "payload": "foo:\n    li v1, 1\n ...", "registers": "t0,t1", "engine": "chaitin"}
+        {"id": 1, "results": [{"function": "foo", "coloring": {...}, "spilled": [...], ...}]}
+
+    payload is source text (C-like, RV32 assembly or the JSON text of IL) or, for IL, the JSON object itself. Functions
+    of concurrent requests, from any number of connections, are batched onto a worker pool; results are kept in an LRU
+    cache keyed by the request content. Records answered from the cache are marked "cached" and have no timings.
+
+        python server.py --socket /tmp/reg-alloc.sock --workers 4
+'''
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import socket
+from collections import OrderedDict
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor, ThreadPoolExecutor
+
+import cli
+
+
+def allocate_batch(jobs):
+    '''
+        Allocate a batch of functions. Runs in worker processes, which stay warm between batches.
+    '''
+    return [allocate_job(job) for job in jobs]
+
+
+def allocate_job(job):
+    '''
+        cli.allocate_function, with any failure as the error record of the job, so one bad function of a batch does
+        not fail the functions of other requests.
+    '''
+    try:
+        return cli.allocate_function(job)
+    except Exception as error:
+        path, (fmt, name, _, _), _, engine, _, _ = job
+        return {'input': path, 'function': name, 'format': fmt, 'engine': engine,
+                'error': f'{type(error).__name__}: {error}'}
+
+
+def request_jobs(request):
+    '''
+        The cli jobs of the functions of a request.
+    '''
+    fmt = request.get('format', 'auto')
+    payload = request['payload']
+    registers = request.get('registers')
+    if isinstance(registers, list):
+        registers = ','.join(registers)
+    elif registers is not None:
+        registers = str(registers)
+    engine = request.get('engine', 'chaitin')
+    path = request.get('name', '<request>')
+
+    if isinstance(payload, str):
+        functions = cli.split_input(path, payload.splitlines(True), fmt)
+    else:
+        functions = cli.il_functions(payload)
+    return [(path, function, registers, engine, bool(request.get('emit_asm')), bool(request.get('cleanup_stats')))
+            for function in functions]
+
+
+def job_key(job):
+    return hashlib.sha256(json.dumps(job, sort_keys=True).encode()).hexdigest()
+
+
+class AllocationServer:
+    '''
+        workers is the number of worker processes, all cores by default; 0 allocates in a thread of the server process,
+        which has the least overhead for small functions.
+
+        A function is sent off right away while a worker is idle. Functions arriving while all workers are busy wait
+        and go out together, up to batch_size per batch, as soon as a worker is free: batches grow with the load
+        instead of adding a fixed delay to every request.
+    '''
+    def __init__(self, path, workers=None, batch_size=64, cache_size=4096):
+        self.path = path
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self.cache = OrderedDict()  # job key ==> record, least recently used first
+        self.pending = []  # (job, future) waiting for the next batch
+        self.running = 0  # batches in the pool
+        self.flush_scheduled = False
+        self.executor = None
+        self.server = None
+        self.clients = set()  # handler tasks of open connections
+
+    def new_executor(self):
+        if self.workers:
+            return ProcessPoolExecutor(max_workers=self.workers)
+        return ThreadPoolExecutor(max_workers=1)
+
+    async def start(self):
+        self.executor = self.new_executor()
+        if os.path.exists(self.path):
+            os.unlink(self.path)  # stale socket of a previous run
+        self.server = await asyncio.start_unix_server(self.handle_client, path=self.path)
+
+    async def serve_forever(self):
+        await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            for client in self.clients:
+                client.cancel()
+            await asyncio.gather(*self.clients, return_exceptions=True)
+            await self.server.wait_closed()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    async def handle_client(self, reader, writer):
+        self.clients.add(asyncio.current_task())
+        tasks = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                task = asyncio.ensure_future(self.answer(line, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        finally:
+            self.clients.discard(asyncio.current_task())
+            writer.close()
+
+    async def answer(self, line, writer):
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get('id')
+            results = await asyncio.gather(*[self.allocate(job) for job in request_jobs(request)])
+            response = {'id': request_id, 'results': results}
+        except Exception as error:  # every request gets a response
+            response = {'id': request_id, 'error': f'{type(error).__name__}: {error}'}
+        writer.write(json.dumps(response, sort_keys=True).encode() + b'\n')
+        await writer.drain()
+
+    def allocate(self, job):
+        key = job_key(job)
+        future = asyncio.get_running_loop().create_future()
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            record = {name: value for name, value in self.cache[key].items() if name != 'timings'}
+            record['cached'] = True
+            future.set_result(record)
+            return future
+
+        future.add_done_callback(lambda done: self.remember(key, done))
+        self.pending.append((job, future))
+        if self.running < max(self.workers, 1) and not self.flush_scheduled:
+            # after the current loop iteration, so the functions of requests read together share a batch
+            self.flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self.flush)
+        return future
+
+    def remember(self, key, future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        self.cache[key] = future.result()
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def flush(self):
+        self.flush_scheduled = False
+        while self.pending and self.running < max(self.workers, 1):
+            batch, self.pending = self.pending[:self.batch_size], self.pending[self.batch_size:]
+            self.running += 1
+            asyncio.ensure_future(self.run_batch(batch))
+
+    async def run_batch(self, batch):
+        loop = asyncio.get_running_loop()
+        executor = self.executor
+        try:
+            records = await loop.run_in_executor(executor, allocate_batch, [job for job, _ in batch])
+        except Exception as error:  # e.g. a worker process died
+            records = None
+            if isinstance(error, BrokenExecutor) and self.executor is executor:
+                # a dead worker breaks the whole pool, later batches go to a new one
+                executor.shutdown(wait=False)
+                self.executor = self.new_executor()
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+        finally:
+            self.running -= 1
+            self.flush()
+
+        for (_, future), record in zip(batch, records or []):
+            if not future.done():
+                future.set_result(record)
+
+
+class AllocationClient:
+    '''
+        Blocking client, one request at a time.
+    '''
+    def __init__(self, path):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.file = self.sock.makefile('rwb')
+        self.next_id = 0
+
+    def allocate(self, payload, fmt='auto', registers=None, engine='chaitin', emit_asm=False):
+        self.next_id += 1
+        request = {'id': self.next_id, 'format': fmt, 'payload': payload, 'registers': registers,
+                   'engine': engine, 'emit_asm': emit_asm}
+        self.file.write(json.dumps(request).encode() + b'\n')
+        self.file.flush()
+        response = json.loads(self.file.readline())
+        if 'error' in response:
+            raise ValueError(response['error'])
+        return response['results']
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Register allocation server on a Unix socket.')
+    parser.add_argument('-s', '--socket', default='/tmp/reg-alloc.sock', help='path of the Unix socket')
+    parser.add_argument('-w', '--workers', type=int, help='worker processes, 0 for none (default: all cores)')
+    parser.add_argument('--batch-size', type=int, default=64, help='most functions per batch')
+    parser.add_argument('--cache-size', type=int, default=4096, help='cached results')
+    args = parser.parse_args(argv)
+
+    server = AllocationServer(args.socket, args.workers, args.batch_size, args.cache_size)
+
+    async def serve():
+        try:
+            await server.serve_forever()
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,48 @@
 # test_liveness.py
+import gc
+import io
+import os
+import tracemalloc
 import pytest
-from cfg_builder import CFGBuilder
+from asm_cfg_builder import AsmCFGBuilder
+from rv32_instruction import RV32Instructions
+from instr_type import IS_BRANCH, IS_JUMP, IS_RET
+from rv32_backend import allocate_rv32, is_virtual, peephole
+from clike_cfg_builder import ClikeCFGBuilder
+from clike_instruction import CStyleInstruction
+from cfg_analyzer import CFGAnalyzer
+import register_allocation
+from block_profile import BlockProfile
+from cfg_cache import CFGCache
+from pressure import cfg_pressure
+from scheduling import schedule_rv32
+from translation_unit import analyze_translation_unit, iter_translation_unit
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data')
+
+
+def analyze_c_file(name):
+    with open(os.path.join(DATA_DIR, name), 'r') as f:
+        c_instructions = f.readlines()
+
+    cfg_builder = ClikeCFGBuilder(c_instructions)
+    cfg_builder.merge_basic_blocks()
+    cfg_analyzer = CFGAnalyzer(cfg_builder)
+    cfg_analyzer.perform_liveness_analysis()
+    return cfg_analyzer
 
 
 def test_liveness_analysis_foo():
     # Load the assembly code from foo.il
-    with open('../data/foo.il', 'r') as f:
-        assembly_code = f.readlines()
+    with open(os.path.join(DATA_DIR, 'foo.il'), 'r') as f:
+        cfg_builder = AsmCFGBuilder(f, bb_enabled=True)
 
-    # Initialize the CFGBuilder
-    cfg_builder = CFGBuilder(assembly_code)
+    cfg_analyzer = CFGAnalyzer(cfg_builder)
+    cfg_analyzer.perform_liveness_analysis()
     print(f'\n')
-    cfg_builder.print_liveness()
+    cfg_analyzer.print_liveness()
+
+    assert cfg_builder.cfg.E == [(0, 1), (1, 3), (1, 2), (2, 4), (3, 1)]
 
     # Expected liveness results
     expected_liveness = {
@@ -24,21 +55,534 @@ def test_liveness_analysis_foo():
             'live_out': {'a0', 'v1', 'v2', 'sp', 'ra'}
         },
         2: {
+            'live_in': {'v2', 'sp', 'ra'},
+            'live_out': {'v2', 'sp', 'ra'}
+        },
+        3: {
             'live_in': {'a0', 'v1', 'v2', 'sp', 'ra'},
             'live_out': {'a0', 'v1', 'v2', 'sp', 'ra'}
         },
-        3: {
+        4: {
             'live_in': {'v2', 'sp', 'ra'},
             'live_out': set()
         }
     }
 
     # Compare actual and expected liveness
-    # for idx, block in enumerate(cfg_builder.basic_blocks):
-    #     actual_live_in = block.live_in
-    #     actual_live_out = block.live_out
-    #     expected_live_in = expected_liveness[idx]['live_in']
-    #     expected_live_out = expected_liveness[idx]['live_out']
-    #
-    #     assert actual_live_in == expected_live_in, f"Block v{idx} live_in mismatch"
-    #     assert actual_live_out == expected_live_out, f"Block v{idx} live_out mismatch"
+    assert len(cfg_builder.basic_blocks) == len(expected_liveness)
+    for idx, block in enumerate(cfg_builder.basic_blocks):
+        actual_live_in = block.live_in
+        actual_live_out = block.live_out
+        expected_live_in = expected_liveness[idx]['live_in']
+        expected_live_out = expected_liveness[idx]['live_out']
+
+        assert actual_live_in == expected_live_in, f"Block v{idx} live_in mismatch"
+        assert actual_live_out == expected_live_out, f"Block v{idx} live_out mismatch"
+
+
+def test_asm_merge_basic_blocks_foo():
+    with open(os.path.join(DATA_DIR, 'foo.il'), 'r') as f:
+        assembly_code = f.readlines()
+
+    merged = AsmCFGBuilder(assembly_code)
+    assert len(merged.basic_blocks) == 20
+    merged.merge_basic_blocks()
+    one_pass = AsmCFGBuilder(assembly_code, bb_enabled=True)
+
+    assert merged.cfg.E == one_pass.cfg.E
+    assert merged.labels == {'foo': 0, 'loop_start': 7, 'loop_body': 9, 'loop_end': 14}
+    for block, one_pass_block in zip(merged.basic_blocks, one_pass.basic_blocks):
+        assert [instr.line_num for instr in block.instructions] == \
+               [instr.line_num for instr in one_pass_block.instructions]
+        assert (block.defs, block.uses) == (one_pass_block.defs, one_pass_block.uses)
+
+
+def test_interference_graph_foo():
+    cfg_analyzer = analyze_c_file('foo.c')
+
+    graph = cfg_analyzer.build_interference_graph()
+
+    assert set(graph.nodes()) == {'n', 'x', 'y', 'z'}
+    for x, y in [('x', 'y'), ('x', 'n'), ('y', 'n'), ('z', 'x'), ('z', 'n')]:
+        assert graph.contains_edge(x, y)
+
+    coloring = register_allocation.color_graph(graph, cfg_analyzer.registers(), ['r0', 'r1', 'r2', 'r3'])
+    assert coloring is not None
+    assert register_allocation.color_graph(graph, cfg_analyzer.registers(), ['r0', 'r1', 'r2']) is None
+
+
+def test_loop_frequencies_foo1():
+    cfg_analyzer = analyze_c_file('foo1.c')
+
+    loop_forest = cfg_analyzer.estimate_block_frequencies()
+
+    assert loop_forest.idom == [0, 0, 1, 2, 3, 4, 4, 2]
+    assert [loop.header for loop in loop_forest.roots] == [2]
+    assert loop_forest.roots[0].blocks == {2, 3, 4, 6}
+    assert [block.frequency for block in cfg_analyzer.basic_blocks] == [1, 1, 10, 10, 10, 1, 10, 1]
+
+
+def test_allocate_with_loop_frequencies():
+    cfg_analyzer = analyze_c_file('foo.c')
+
+    cost = cfg_analyzer.estimate_spill_costs()
+    assert cost == {'n': 11, 'x': 41, 'y': 22, 'z': 21}
+
+    graph, coloring, spilled = cfg_analyzer.allocate(['r0', 'r1', 'r2'])
+
+    assert spilled == {'n'}
+    assert set(coloring) == cfg_analyzer.registers() - spilled
+
+
+def test_block_profile_foo():
+    cfg_analyzer = analyze_c_file('foo.c')
+
+    # v0 by block id, the loop body by one of its source lines, everything else unprofiled
+    profile = BlockProfile.load(io.StringIO('v0 1\n8 1000\n'))
+    profile.apply_to_blocks(cfg_analyzer.basic_blocks)
+
+    assert [block.frequency for block in cfg_analyzer.basic_blocks] == [1, None, None, 1000, None]
+
+    cost = cfg_analyzer.estimate_spill_costs()
+    assert [block.frequency for block in cfg_analyzer.basic_blocks] == [1, 1, 10, 1000, 1]
+    assert cost['z'] == 2001
+
+
+def test_block_leader_index_foo1():
+    cfg_analyzer = analyze_c_file('foo1.c')
+    cfg_builder = cfg_analyzer.cfg_builder
+
+    for blk_id, instr_id in enumerate(cfg_builder.blk_2_instr_id):
+        assert cfg_builder.basic_blocks[blk_id].instructions[0] is cfg_builder.instructions[instr_id]
+        assert cfg_builder.instr_2_blk_id[instr_id] == blk_id
+    assert cfg_builder.cfg.E == [(0, 1), (1, 2), (2, 3), (6, 2), (2, 7), (3, 4), (4, 5), (4, 6)]
+
+
+@pytest.mark.parametrize('name', ['foo.c', 'foo1.c'])
+def test_merge_basic_blocks(name):
+    with open(os.path.join(DATA_DIR, name), 'r') as f:
+        c_instructions = f.readlines()
+
+    # merging per-instruction blocks in place, building merged blocks in one pass and a full rebuild agree
+    merged = ClikeCFGBuilder(c_instructions)
+    merged.merge_basic_blocks()
+    one_pass = ClikeCFGBuilder(c_instructions, bb_enabled=True)
+    rebuilt = ClikeCFGBuilder(c_instructions)
+    rebuilt.cleanup()
+    rebuilt.identify_leaders(bb_enabled=True)
+    rebuilt.build_basic_blocks()
+    rebuilt.build_cfg_edges()
+
+    for cfg_builder in [one_pass, rebuilt]:
+        assert cfg_builder.cfg.E == merged.cfg.E
+        assert cfg_builder.instr_2_blk_id == merged.instr_2_blk_id
+        assert cfg_builder.blk_2_instr_id == merged.blk_2_instr_id
+        for block, merged_block in zip(cfg_builder.basic_blocks, merged.basic_blocks):
+            assert block.id == merged_block.id
+            assert [instr.line_num for instr in block.instructions] == \
+                   [instr.line_num for instr in merged_block.instructions]
+            assert (block.pred, block.succ) == (merged_block.pred, merged_block.succ)
+            assert (block.defs, block.uses) == (merged_block.defs, merged_block.uses)
+            assert block.is_end_blk == merged_block.is_end_blk
+
+
+def test_clike_instruction_defs_uses():
+    cases = [
+        ('int z = 10;', 'assign', set(), {'z'}),
+        ('x++;', 'assign', {'x'}, {'x'}),
+        ('total += x * 2;', 'assign', {'total', 'x'}, {'total'}),
+        ('x == y;', 'expression', {'x', 'y'}, set()),
+        ('while(x < n) {', 'while', {'x', 'n'}, set()),
+        ('return y;', 'return', {'y'}, set()),
+        ('int *bar(int a, char *b) {', 'func', {'a', 'b'}, set()),
+    ]
+    for line_num, (text, operation, uses, defs) in enumerate(cases):
+        instr = CStyleInstruction(line_num, text)
+        assert instr.operation == operation
+        assert instr.uses == uses
+        assert instr.defs == defs
+        # analyzing again is harmless
+        instr.analyze_defs_uses()
+        assert (instr.defs, instr.uses) == (defs, uses)
+
+
+def test_translation_unit_per_function_cfgs():
+    with open(os.path.join(DATA_DIR, 'foo.c'), 'r') as f:
+        foo = f.read().splitlines()
+    with open(os.path.join(DATA_DIR, 'foo1.c'), 'r') as f:
+        foo1 = f.read().splitlines()
+    lines = ['int bar(int n);', ''] + foo + [''] + [line.replace('foo', 'foo1') for line in foo1]
+
+    serial = analyze_translation_unit(lines, jobs=1)
+    parallel = analyze_translation_unit(lines, jobs=2)
+
+    assert [name for name, _ in serial] == ['foo', 'foo1']
+    assert [name for name, _ in parallel] == ['foo', 'foo1']
+    for (_, serial_analyzer), (_, parallel_analyzer) in zip(serial, parallel):
+        assert [(block.live_in, block.live_out) for block in serial_analyzer.basic_blocks] == \
+               [(block.live_in, block.live_out) for block in parallel_analyzer.basic_blocks]
+
+    foo_analyzer = serial[0][1]
+    assert len(foo_analyzer.basic_blocks) == 5
+    assert foo_analyzer.basic_blocks[0].instructions[0].line_num == 2
+    foo1_analyzer = serial[1][1]
+    assert len(foo1_analyzer.basic_blocks) == 8
+    assert foo1_analyzer.basic_blocks[-1].instructions[0].text == 'return y;'
+    assert foo1_analyzer.basic_blocks[-1].instructions[0].line_num == len(foo) + 3 + 14
+
+
+def test_streaming_source_input():
+    with open(os.path.join(DATA_DIR, 'foo1.c'), 'r') as f:
+        cfg_builder = ClikeCFGBuilder(f, bb_enabled=True)
+    assert cfg_builder.lines is None
+    assert len(cfg_builder.basic_blocks) == 8
+
+    with open(os.path.join(DATA_DIR, 'foo.c'), 'r') as f:
+        source = f.read()
+    functions = iter_translation_unit(io.StringIO('\n'.join([source, source.replace('foo', 'bar')])), jobs=2)
+    assert next(functions)[0] == 'foo'
+    name, cfg_analyzer = next(functions)
+    assert name == 'bar'
+    assert cfg_analyzer.cfg_builder.lines is None
+    assert next(functions, None) is None
+
+
+@pytest.mark.parametrize('name', ['foo.c', 'foo1.c'])
+def test_compact_cfg_liveness(name):
+    expected = analyze_c_file(name)
+
+    with open(os.path.join(DATA_DIR, name), 'r') as f:
+        cfg_analyzer = CFGAnalyzer(ClikeCFGBuilder(f, bb_enabled=True), compact=True)
+    cfg_analyzer.perform_liveness_analysis()
+
+    assert list(cfg_analyzer.cfg.edges()) == sorted(expected.cfg.E)
+    for blk_id, block in enumerate(expected.basic_blocks):
+        assert set(cfg_analyzer.cfg.successors(blk_id)) == block.succ
+        assert set(cfg_analyzer.cfg.predecessors(blk_id)) == block.pred
+        assert cfg_analyzer.basic_blocks[blk_id].live_in == block.live_in
+        assert cfg_analyzer.basic_blocks[blk_id].live_out == block.live_out
+
+    assert cfg_analyzer.estimate_spill_costs() == expected.estimate_spill_costs()
+    # the CSR arrays replace the edge list and the pred/succ sets
+    assert cfg_analyzer.cfg_builder.cfg is cfg_analyzer.cfg
+    assert all(block.pred is None and block.succ is None for block in cfg_analyzer.basic_blocks)
+
+    # a builder of per-instruction blocks can still be merged and analyzed again
+    with open(os.path.join(DATA_DIR, name), 'r') as f:
+        cfg_builder = ClikeCFGBuilder(f)
+    CFGAnalyzer(cfg_builder, compact=True).perform_liveness_analysis()
+    cfg_builder.merge_basic_blocks()
+    cfg_analyzer = CFGAnalyzer(cfg_builder)
+    cfg_analyzer.perform_liveness_analysis()
+    assert sorted(cfg_builder.cfg.E) == sorted(expected.cfg.E)
+    assert [block.live_in for block in cfg_analyzer.basic_blocks] == [block.live_in for block in expected.basic_blocks]
+
+
+def test_compact_cfg_memory():
+    body = ''.join(f'    if (x{i} < n) {{\n        x{i + 1} = x{i} + {i};\n    }}\n' for i in range(500))
+    lines = ['int f(int n) {\n', '    int x0 = 0;\n'] + body.splitlines(True) + ['    return x500;\n', '}\n']
+
+    def retained(compact):
+        gc.collect()
+        tracemalloc.start()
+        cfg_analyzer = CFGAnalyzer(ClikeCFGBuilder(lines, bb_enabled=True), compact=compact)
+        gc.collect()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        assert len(cfg_analyzer.basic_blocks) == 1003
+        return size
+
+    # the blocks' instructions dominate both; the CFG itself shrinks by well over 100 bytes per block
+    assert retained(False) - retained(True) > 100 * 1003
+
+
+def test_cfg_cache(tmp_path):
+    with open(os.path.join(DATA_DIR, 'foo.c'), 'r') as f:
+        foo = f.read().splitlines()
+    with open(os.path.join(DATA_DIR, 'foo1.c'), 'r') as f:
+        foo1 = [line.replace('foo', 'foo1') for line in f.read().splitlines()]
+
+    cache = CFGCache(str(tmp_path))
+    expected = analyze_translation_unit(foo + foo1, jobs=2, cache=cache)
+    assert (cache.hits, cache.misses) == (0, 2)
+
+    # a new function in front, foo and foo1 are unchanged but moved down
+    edited = ['int bar(int n) {', '    return n;', '}'] + ['', ''] + foo + foo1
+    cache = CFGCache(str(tmp_path))
+    results = analyze_translation_unit(edited, jobs=1, cache=cache)
+    assert (cache.hits, cache.misses) == (2, 1)
+
+    _, foo1_analyzer = results[2]
+    _, expected_analyzer = expected[1]
+    assert [block.live_in for block in foo1_analyzer.basic_blocks] == \
+           [block.live_in for block in expected_analyzer.basic_blocks]
+    assert [instr.line_num for instr in foo1_analyzer.cfg_builder.instructions] == \
+           [instr.line_num + 5 for instr in expected_analyzer.cfg_builder.instructions]
+
+    # overwriting an entry replaces its size
+    cache = CFGCache(str(tmp_path))
+    total = cache.total_bytes
+    cache.put(CFGCache.key(foo), 0, expected[0])
+    assert cache.total_bytes == total
+
+    # a failed write leaves no temporary file behind
+    with pytest.raises(Exception):
+        cache.put(CFGCache.key(['int baz() {', '}']), 0, lambda: None)
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.tmp')]
+    assert cache.total_bytes == total
+
+    # size bounded
+    cache = CFGCache(str(tmp_path), max_bytes=1)
+    cache.put(CFGCache.key(['int bar() {', '}']), 0, results[0])
+    assert cache.total_bytes <= 1
+    assert len(cache.entries()) == 0
+
+
+@pytest.mark.parametrize('text, defs, uses', [
+    ('add v3, v4, v2', {'v3'}, {'v4', 'v2'}),
+    ('addi sp, sp, -12', {'sp'}, {'sp'}),
+    ('slli v4, v1, 1', {'v4'}, {'v1'}),
+    ('li v3, 10', {'v3'}, set()),
+    ('lw v3, 0(sp)', {'v3'}, {'sp'}),
+    ('sw v1, 8( sp )', set(), {'v1', 'sp'}),
+    ('blt v1, a0, loop_body', set(), {'v1', 'a0'}),
+    ('bnez t0, done', set(), {'t0'}),
+    ('mv a0, v2', {'a0'}, {'v2'}),
+    ('j loop_end', set(), set()),
+    ('jal helper', {'ra'}, set()),
+    ('jalr t1', {'ra'}, {'t1'}),
+    ('jalr ra, 4(t1)', {'ra'}, {'t1'}),
+    ('jalr x0, 0(ra)', {'x0'}, {'ra'}),
+    ('jalr t0, t1', {'t0'}, {'t1'}),
+    ('jalr ra, t1, 0', {'ra'}, {'t1'}),
+    ('jal x0, loop', {'x0'}, set()),
+    ('jr ra', set(), {'ra'}),
+    ('ret', set(), {'ra'}),
+    ('add foo, bar, s12', set(), set()),   # not register names
+    ('.text', set(), set()),
+])
+def test_rv32_decode_defs_uses(text, defs, uses):
+    instr = RV32Instructions(0, text)
+    assert (instr.defs, instr.uses) == (defs, uses)
+
+
+def allocate_foo_il(registers):
+    with open(os.path.join(DATA_DIR, 'foo.il'), 'r') as f:
+        return allocate_rv32(f, registers)
+
+
+def assert_valid_allocation(allocation):
+    # the output is plain RV32 again: no virtual registers left, and it still builds a CFG
+    rewritten = AsmCFGBuilder(allocation.lines, bb_enabled=True)
+    for instr in rewritten.instructions:
+        assert not any(is_virtual(reg) for reg in instr.defs | instr.uses), instr.text
+    return rewritten
+
+
+@pytest.mark.parametrize('text, mask, calls', [
+    ('jalr x0, 0(ra)', IS_RET, False),
+    ('jalr zero, ra, 0', IS_RET, False),
+    ('jal x0, loop', IS_JUMP, False),
+    ('jal ra, helper', 0, True),
+    ('jalr ra, 0(t1)', 0, True),
+    ('jalr t1', 0, True),
+])
+def test_rv32_jump_forms(text, mask, calls):
+    instr = RV32Instructions(0, text)
+    assert instr.mask & (IS_BRANCH | IS_JUMP | IS_RET) == mask
+    assert bool(instr.clobbers) == calls
+    if mask == IS_JUMP:
+        assert instr.branch_target() == 'loop'
+
+
+def test_allocate_rv32_foo():
+    allocation = allocate_foo_il(['t0', 't1', 't2', 't3'])
+    assert allocation.rounds == 1
+    assert (allocation.spilled, allocation.saved, allocation.frame_size) == ({}, [], 12)
+
+    # the coloring respects the interference of the virtual registers
+    with open(os.path.join(DATA_DIR, 'foo.il'), 'r') as f:
+        cfg_analyzer = CFGAnalyzer(AsmCFGBuilder(f, bb_enabled=True))
+    cfg_analyzer.perform_liveness_analysis()
+    graph = cfg_analyzer.build_interference_graph()
+    assert set(allocation.coloring) == {'v1', 'v2', 'v3', 'v4'}
+    for reg, color in allocation.coloring.items():
+        assert all(allocation.coloring.get(other) != color for other in graph.neighbors(reg))
+
+    rewritten = assert_valid_allocation(allocation)
+    assert [instr.text for instr in rewritten.instructions][0] == 'addi sp, sp, -12'
+
+
+def test_allocate_rv32_spills():
+    allocation = allocate_foo_il(['t0', 't1'])
+    assert allocation.rounds > 1
+    assert set(allocation.spilled) <= {'v1', 'v2', 'v3', 'v4'} and allocation.spilled
+    # spill slots below the original 12 byte frame, the whole frame rounded up to the stack alignment
+    assert allocation.frame_size == 32
+    assert sorted(allocation.spilled.values()) == list(range(0, 4 * len(allocation.spilled), 4))
+
+    texts = [instr.text for instr in assert_valid_allocation(allocation).instructions]
+    assert texts[0] == 'addi sp, sp, -32'
+    assert texts[-2:] == ['addi sp, sp, 32', 'jr ra']
+    assert 'addi sp, sp, -12' not in texts
+    # the saves of the original frame moved up by 20 bytes
+    assert any(text.startswith('sw') and text.endswith(', 28(sp)') for text in texts)
+
+
+def test_allocate_rv32_hex_frame():
+    with open(os.path.join(DATA_DIR, 'foo.il'), 'r') as f:
+        lines = f.read().replace('sp, sp, -12', 'sp, sp, -0xc').replace('sp, sp, 12', 'sp, sp, 0xc')
+    allocation = allocate_rv32(lines.splitlines(), ['t0', 't1'])
+    # the epilogue in hex is found and grows with the frame, so sp is balanced
+    texts = [instr.text for instr in assert_valid_allocation(allocation).instructions]
+    assert texts[0] == 'addi sp, sp, -32'
+    assert texts[-2:] == ['addi sp, sp, 32', 'jr ra']
+
+
+def test_allocate_rv32_callee_saved():
+    allocation = allocate_foo_il(['s1', 's2', 's3', 's4'])
+    assert allocation.spilled == {}
+    assert allocation.saved == sorted(set(allocation.coloring.values()), key=lambda reg: int(reg[1:]))
+    assert allocation.frame_size == 32
+
+    texts = [instr.text for instr in assert_valid_allocation(allocation).instructions]
+    saves = [f'sw {reg}, {4 * i}(sp)' for i, reg in enumerate(allocation.saved)]
+    restores = [f'lw {reg}, {4 * i}(sp)' for i, reg in enumerate(allocation.saved)]
+    assert texts[:1 + len(saves)] == ['addi sp, sp, -32'] + saves
+    assert texts[-2 - len(restores):] == restores + ['addi sp, sp, 32', 'jr ra']
+
+
+def test_allocate_rv32_frame_pointer():
+    # fp is another name of s0, so the two only count once; 12 bytes of saves padded to a 32 byte frame
+    allocation = allocate_foo_il(['s0', 'fp', 's1', 's2'])
+    assert allocation.spilled == {} and allocation.saved == ['s0', 's1', 's2']
+    assert allocation.frame_size == 32
+    texts = [instr.text for instr in assert_valid_allocation(allocation).instructions]
+    assert texts[:4] == ['addi sp, sp, -32', 'sw s0, 0(sp)', 'sw s1, 4(sp)', 'sw s2, 8(sp)']
+
+    allocation = allocate_foo_il(['s0', 'fp', 's1'])
+    assert allocation.spilled and set(allocation.coloring.values()) == {'s0', 's1'}
+    assert allocation.frame_size % 16 == 0
+
+
+def test_allocate_rv32_numeric_names():
+    # x5 is t0 and x9 is s1: v1 interferes with both, and the code's own use of s1 is not saved
+    allocation = allocate_rv32(['f:', '    li x5, 7', '    li x9, 1', '    li v1, 1', '    add a0, v1, x5',
+                                '    add a0, a0, x9', '    ret'], ['x5', 's1', 's2'])
+    assert allocation.coloring == {'v1': 's2'}
+    assert allocation.saved == ['s2']
+
+
+def test_allocate_rv32_too_few_registers():
+    with pytest.raises(ValueError):
+        allocate_foo_il(['t0'])
+
+
+CALLER_ASM = '''bar:
+    addi sp, sp, -16
+    sw ra, 12(sp)
+    li v1, 7
+    mv a0, v1
+    call baz
+    add v2, a0, v1
+    mv a0, v2
+    lw ra, 12(sp)
+    addi sp, sp, 16
+    ret
+'''
+
+
+def test_allocate_rv32_across_calls():
+    cfg_builder = AsmCFGBuilder(io.StringIO(CALLER_ASM), bb_enabled=True)
+    cfg_analyzer = CFGAnalyzer(cfg_builder)
+    cfg_analyzer.perform_liveness_analysis()
+    graph = cfg_analyzer.build_interference_graph()
+    assert cfg_builder.instructions[4].clobbers >= {'ra', 'a0', 't0'}
+    assert graph.contains_edge('v1', 'a0') and graph.contains_edge('v1', 't0')
+    assert not graph.contains_edge('v2', 'a0')
+
+    # v1 is live across the call, so it needs a callee-saved register, which the prologue saves
+    allocation = allocate_rv32(io.StringIO(CALLER_ASM), ['t0', 'a0', 's1'])
+    assert allocation.coloring['v1'] == 's1'
+    assert allocation.saved == ['s1']
+    texts = [instr.text for instr in assert_valid_allocation(allocation).instructions]
+    assert texts[:3] == ['addi sp, sp, -32', 'sw s1, 0(sp)', 'sw ra, 28(sp)']
+
+    # ... or a spill when only caller-saved registers are available
+    allocation = allocate_rv32(io.StringIO(CALLER_ASM), ['t0', 't1'])
+    assert 'v1' in allocation.spilled
+    assert allocation.saved == []
+
+
+def test_rv32_peephole():
+    lines = [
+        'f:',
+        '    mv t0, t0',
+        '    lw t0, 4(sp)',
+        '    lw t1, 4(sp)',
+        '    sw t0, 4(sp)',
+        '    addi t0, t0, 1',
+        '    lw t0, 4(sp)',
+        '    sw t0, 8(sp)',
+        '    lw t2, 8(sp)',
+        '    sw a0, 0(a1)',
+        '    lw t2, 4(sp)',
+        'loop:',
+        '    lw t2, 4(sp)',
+        '    ret',
+    ]
+    new_lines, removed = peephole(lines)
+    assert removed == 2
+    assert new_lines == [
+        'f:',
+        '    lw t0, 4(sp)',
+        '    mv t1, t0',
+        '    addi t0, t0, 1',
+        '    mv t0, t1',
+        '    sw t0, 8(sp)',
+        '    mv t2, t0',
+        '    sw a0, 0(a1)',
+        '    lw t2, 4(sp)',
+        'loop:',
+        '    lw t2, 4(sp)',
+        '    ret',
+    ]
+
+
+def test_register_pressure_foo():
+    with open(os.path.join(DATA_DIR, 'foo.il'), 'r') as f:
+        cfg_analyzer = CFGAnalyzer(AsmCFGBuilder(f, bb_enabled=True))
+    cfg_analyzer.perform_liveness_analysis()
+    report = cfg_pressure(cfg_analyzer)
+
+    # block 0 starts with a0, v1, v2, v3, sp and ra live
+    assert report.block_max == [6, 5, 3, 6, 3]
+    assert report.max_live == 6
+    assert report.hotspots(4) == [(0, 6), (3, 6), (1, 5)]
+    assert [len(sizes) for sizes in report.points] == [len(block.instructions) for block in cfg_analyzer.basic_blocks]
+
+
+SCHEDULE_ASM = """sum4:
+    lw v1, 0(a0)
+    lw v2, 4(a0)
+    lw v3, 8(a0)
+    lw v4, 12(a0)
+    add v5, v1, v2
+    add v6, v3, v4
+    sw v1, 16(a0)
+    add a0, v5, v6
+    ret
+"""
+
+
+def test_schedule_rv32():
+    lines, before, after = schedule_rv32(SCHEDULE_ASM.splitlines())
+    assert (before.max_live, after.max_live) == (6, 5)
+    # v1 stays live until its store, so v3 + v4 goes first; the store does not move
+    assert [line.strip() for line in lines] == [
+        'sum4:', 'lw v3, 8(a0)', 'lw v4, 12(a0)', 'add v6, v3, v4', 'lw v1, 0(a0)', 'lw v2, 4(a0)',
+        'add v5, v1, v2', 'sw v1, 16(a0)', 'add a0, v5, v6', 'ret']
+
+    allocation = allocate_rv32(io.StringIO(SCHEDULE_ASM), ['t0', 't1', 't2'], schedule=True)
+    assert not allocation.spilled
+    assert len(allocate_rv32(io.StringIO(SCHEDULE_ASM), ['t0', 't1', 't2']).spilled) > 0
@@ -0,0 +1,133 @@
+# test_cli.py
+import io
+import json
+import os
+import sys
+
+import cli
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data')
+
+EXAMPLE_IL = {
+    'name': 'example',
+    'instructions': [
+        {'opcode': 'bb'},
+        {'opcode': 'b = a + 2', 'dec': ['b'], 'use': ['a']},
+        {'opcode': 'c = b * b', 'dec': ['c'], 'use': ['b']},
+        {'opcode': 'b = c + 1', 'dec': ['b'], 'use': ['c']},
+        {'opcode': 'return b * a', 'use': ['b', 'a']},
+    ],
+}
+
+
+def run_cli(tmp_path, *args):
+    output = tmp_path / 'out.jsonl'
+    status = cli.main(list(args) + ['-o', str(output)])
+    return status, [json.loads(line) for line in output.read_text().splitlines()]
+
+
+def test_cli_c_glob(tmp_path):
+    status, records = run_cli(tmp_path, os.path.join(DATA_DIR, 'foo*.c'), '-r', '3')
+
+    assert status == 0
+    assert [os.path.basename(record['input']) for record in records] == ['foo.c', 'foo1.c']
+    foo, foo1 = records
+    assert foo['function'] == 'foo' and foo['format'] == 'c' and foo['engine'] == 'chaitin'
+    assert foo['registers'] == ['r0', 'r1', 'r2']
+    assert (foo['spilled'], foo['spill_cost']) == (['n'], 11)
+    assert set(foo['coloring']) == {'x', 'y', 'z'}
+    assert foo1['spilled'] == []
+    assert {'cfg', 'liveness', 'color', 'total'} <= set(foo['timings'])
+
+
+def test_cli_asm(tmp_path):
+    status, records = run_cli(tmp_path, os.path.join(DATA_DIR, 'foo.il'), '-r', 't0,t1,t2,t3', '--emit-asm')
+
+    assert status == 0
+    record, = records
+    assert (record['format'], record['function']) == ('asm', 'foo')
+    assert set(record['coloring']) == {'v1', 'v2', 'v3', 'v4'}
+    assert record['spilled'] == [] and record['frame_size'] == 12
+    assert record['assembly'][:2] == ['foo:', '    addi sp, sp, -12']
+
+
+def test_cli_asm_functions(tmp_path):
+    # f's branch target stays in f, g starts after f's return
+    path = tmp_path / 'two.s'
+    path.write_text('    .text\n'
+                    'f:\n    li v1, 1\n    beqz a0, skip\n    li v1, 2\nskip:\n    mv a0, v1\n    ret\n\n'
+                    '    .globl g\n'
+                    'g:\n    li v1, 3\n    li v2, 4\n    add a0, v1, v2\n    ret\n')
+    status, records = run_cli(tmp_path, str(path), '-r', 't0,t1', '--emit-asm')
+
+    assert status == 0
+    assert [record['function'] for record in records] == ['f', 'g']
+    assert set(records[0]['coloring']) == {'v1'} and set(records[1]['coloring']) == {'v1', 'v2'}
+    assert records[1]['assembly'][:3] == ['', '    .globl g', 'g:']
+
+
+def test_cli_il_stdin(tmp_path, monkeypatch):
+    monkeypatch.setattr(sys, 'stdin', io.StringIO(json.dumps([EXAMPLE_IL, dict(EXAMPLE_IL, name='other')])))
+    status, records = run_cli(tmp_path, '-r', '2', '--jobs', '2')
+
+    assert status == 0
+    assert [(record['format'], record['function']) for record in records] == [('il', 'example'), ('il', 'other')]
+    coloring = records[0]['coloring']
+    assert coloring['a'] != coloring['b'] and coloring['a'] != coloring['c']
+
+
+def test_cli_il_cleanup(tmp_path):
+    il = {'instructions': [
+        {'opcode': 'bb'},
+        {'opcode': 'a = load', 'dec': ['a']},
+        {'opcode': 'copy', 'dec': ['b'], 'use': ['a']},
+        {'opcode': 'c = b + 1', 'dec': ['c'], 'use': ['b']},
+        {'opcode': 'd = a * 2', 'dec': ['d'], 'use': ['a']},
+        {'opcode': 'return c', 'use': ['c']},
+    ]}
+    path = tmp_path / 'copies.json'
+    path.write_text(json.dumps(il))
+    status, records = run_cli(tmp_path, str(path))
+    assert status == 0 and records[0]['cleanup'] == {'removed': 2}
+
+    status, records = run_cli(tmp_path, str(path), '--cleanup-stats')
+    assert status == 0
+    # a-b, a-c and c-d interfere before; c = a + 1 has nothing live across it after
+    assert records[0]['cleanup'] == {'removed': 2, 'nodes_saved': 4, 'edges_saved': 3}
+    assert set(records[0]['coloring']) == {'a', 'c'}
+
+
+def test_cli_uncolorable(tmp_path):
+    # a and b interfere, and neither can take the precolored r0's only register
+    il = {'name': 'tight', 'precolored': {'r0': 'r0'}, 'instructions': [
+        {'opcode': 'bb'},
+        {'opcode': 'r0 = arg', 'dec': ['r0']},
+        {'opcode': 'a = r0 + 1', 'dec': ['a'], 'use': ['r0']},
+        {'opcode': 'b = r0 + 2', 'dec': ['b'], 'use': ['r0']},
+        {'opcode': 'return a + b + r0', 'use': ['a', 'b', 'r0']},
+    ]}
+    path = tmp_path / 'tight.json'
+    path.write_text(json.dumps(il))
+    status, records = run_cli(tmp_path, str(path), '-r', 'r0')
+
+    assert status == 1
+    assert records[0]['coloring'] is None
+    assert records[0]['error'] == 'no coloring with 1 registers after spilling'
+
+
+def test_cli_error(tmp_path):
+    status, records = run_cli(tmp_path, os.path.join(DATA_DIR, 'foo.il'), '-r', 't0')
+
+    assert status == 1
+    assert records[0]['error'].startswith('ValueError')
+
+
+def test_cli_bad_function(tmp_path):
+    bad = tmp_path / 'bad.s'
+    bad.write_text('bad:\n    addi sp, sp\n    ret\n')
+    status, records = run_cli(tmp_path, str(bad), os.path.join(DATA_DIR, 'foo.c'), '-r', '3')
+
+    # the error is reported and the following inputs are still allocated
+    assert status == 1
+    assert records[0]['error'] == 'ValueError: malformed stack adjustment: addi sp, sp'
+    assert [record['function'] for record in records[1:]] == ['foo'] and 'error' not in records[1]
@@ -0,0 +1,56 @@
+# test_import_time.py
+import json
+import os
+import subprocess
+import sys
+
+ROOT_DIR = os.path.join(os.path.dirname(__file__), '..')
+
+CORE_MODULES = ('register_allocation', 'cfg_builder', 'clike_cfg_builder', 'asm_cfg_builder', 'cfg_analyzer',
+                'rv32_backend')
+DRIVER_MODULES = ('cli', 'server')
+
+# seconds of cumulative import time in a fresh interpreter, generous for slow machines; about 0.05 and 0.15 here
+CORE_IMPORT_BUDGET = 0.25
+DRIVER_IMPORT_BUDGET = 0.5
+
+PROBE = '''
+import {modules}
+import json
+import sys
+print(json.dumps(sorted({{name.split('.')[0] for name in sys.modules}})))
+'''
+
+
+def import_modules(modules):
+    '''
+        Import modules in a fresh interpreter with -X importtime. Returns the top level packages loaded and the
+        cumulative import seconds of the modules.
+    '''
+    code = PROBE.format(modules=', '.join(modules))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT_DIR,
+                            env=dict(os.environ, PYTHONPATH=os.path.abspath(ROOT_DIR)),
+                            capture_output=True, text=True, check=True)
+
+    # lines of stderr: "import time: self [us] | cumulative | imported package", nested imports are indented
+    cumulative = 0
+    for line in result.stderr.splitlines():
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].startswith(' ') and not fields[2].startswith('  ') \
+                and fields[1].strip().isdigit():
+            cumulative += int(fields[1])
+    return set(json.loads(result.stdout)), cumulative / 1e6
+
+
+def test_core_modules_import_only_the_standard_library():
+    loaded, seconds = import_modules(CORE_MODULES)
+
+    assert not loaded & {'matplotlib', 'networkx', 'numpy'}
+    assert seconds < CORE_IMPORT_BUDGET
+
+
+def test_driver_modules_import_time():
+    loaded, seconds = import_modules(DRIVER_MODULES)
+
+    assert not loaded & {'matplotlib', 'networkx', 'numpy'}
+    assert seconds < DRIVER_IMPORT_BUDGET
@@ -0,0 +1,127 @@
+# test_server.py
+import asyncio
+import json
+import os
+import threading
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from server import AllocationServer, AllocationClient
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data')
+
+SMALL_IL = {
+    'name': 'small',
+    'instructions': [
+        {'opcode': 'bb'},
+        {'opcode': 'a := 1', 'dec': ['a']},
+        {'opcode': 'b := a + 1', 'dec': ['b'], 'use': ['a']},
+        {'opcode': 'return a + b', 'use': ['a', 'b']},
+    ],
+}
+
+
+@pytest.fixture(params=[0, 1], ids=['in-process', 'worker-pool'])
+def server(request, tmp_path):
+    server = AllocationServer(str(tmp_path / 'reg-alloc.sock'), workers=request.param)
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+
+    def serve():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(server.start())
+        started.set()
+        loop.run_forever()
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    started.wait()
+    yield server
+
+    asyncio.run_coroutine_threadsafe(server.close(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+
+
+def test_server_allocates(server):
+    client = AllocationClient(server.path)
+    with open(os.path.join(DATA_DIR, 'foo.il'), 'r') as f:
+        source = f.read()
+
+    record, = client.allocate(source, 'asm', ['t0', 't1', 't2', 't3'], emit_asm=True)
+    assert record['function'] == 'foo'
+    assert set(record['coloring']) == {'v1', 'v2', 'v3', 'v4'}
+    assert record['assembly'][1] == '    addi sp, sp, -12'
+
+    record, = client.allocate(SMALL_IL, 'il', 2)
+    assert record['coloring']['a'] != record['coloring']['b']
+
+    # the same request again is answered from the cache, without the timings of the first run
+    cached, = client.allocate(SMALL_IL, 'il', 2)
+    assert cached.pop('cached') is True and 'timings' not in cached
+    assert cached == {name: value for name, value in record.items() if name != 'timings'}
+    assert len(server.cache) == 2
+
+    with open(os.path.join(DATA_DIR, 'foo.c'), 'r') as f:
+        records = client.allocate(f.read(), 'c', 3)
+    assert [record['spilled'] for record in records] == [['n']]
+    client.close()
+
+
+def test_server_batches_pipelined_requests(server):
+    client = AllocationClient(server.path)
+    # many requests in flight on one connection, answered by id in completion order
+    for i in range(20):
+        request = {'id': i, 'format': 'il', 'payload': dict(SMALL_IL, name=f'f{i}'), 'registers': 2}
+        client.file.write(json.dumps(request).encode() + b'\n')
+    client.file.write(b'not json\n')
+    client.file.flush()
+
+    responses = [json.loads(client.file.readline()) for _ in range(21)]
+    errors = [response for response in responses if 'error' in response]
+    assert len(errors) == 1 and errors[0]['id'] is None
+    results = {response['id']: response['results'] for response in responses if 'results' in response}
+    assert sorted(results) == list(range(20))
+    assert all(result[0]['function'] == f'f{i}' for i, result in results.items())
+    client.close()
+
+
+def test_server_answers_bad_functions(server, monkeypatch):
+    first, second = AllocationClient(server.path), AllocationClient(server.path)
+    with open(os.path.join(DATA_DIR, 'foo.il'), 'r') as f:
+        good = {'id': 1, 'format': 'asm', 'payload': f.read(), 'registers': 't0,t1,t2,t3'}
+    bad = {'id': 2, 'format': 'asm', 'payload': 'bad:\n    addi sp, sp\n    ret\n', 'registers': 't0,t1'}
+    # both requests share a batch
+    first.file.write(json.dumps(bad).encode() + b'\n')
+    second.file.write(json.dumps(good).encode() + b'\n')
+    first.file.flush()
+    second.file.flush()
+
+    record, = json.loads(first.file.readline())['results']
+    assert record['function'] == 'bad' and 'error' in record
+    record, = json.loads(second.file.readline())['results']
+    assert record['function'] == 'foo' and 'error' not in record
+
+    # unexpected failures of a request are still answered
+    monkeypatch.setattr('server.request_jobs', lambda request: 1 / 0)
+    with pytest.raises(ValueError, match='ZeroDivisionError'):
+        first.allocate(SMALL_IL, 'il', 2)
+    first.close()
+    second.close()
+
+
+def test_server_recovers_from_worker_crash(server):
+    if not server.workers:
+        pytest.skip('no worker processes')
+    # a worker process dies, which breaks the pool
+    with pytest.raises(BrokenProcessPool):
+        server.executor.submit(os._exit, 1).result()
+
+    client = AllocationClient(server.path)
+    with pytest.raises(ValueError, match='BrokenProcessPool'):
+        client.allocate(SMALL_IL, 'il', 2)
+    # the next request runs on a new pool
+    record, = client.allocate(SMALL_IL, 'il', 2)
+    assert record['coloring']['a'] != record['coloring']['b']
+    client.close()
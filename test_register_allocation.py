@@ -1,5 +1,14 @@
+import copy
+import io
+
 import register_allocation
 from register_allocation import Dec, Use, Instruction, IntermediateLanguage, Graph
+from block_profile import BlockProfile
+from exact_coloring import color_exact, decide_spills_exact
+from graph_decomposition import clique_separator_atoms, color_decomposed, decide_spills_decomposed
+from portfolio import CONFIGURATIONS, Configuration, coalesce_conservative, run_portfolio
+from pressure import il_pressure
+from scheduling import schedule_il
 
 
 def test_build_graph():
@@ -357,3 +366,377 @@ def test_color_il_with_spills_and_frequency():
     graph, coloring = register_allocation.run(il, colors)
 
     assert coloring is not None
+
+
+def test_compute_liveness():
+    # Same program as test_color_il_with_multiple_bb, but without any hand-set liveness information
+    il = IntermediateLanguage([
+        Instruction('bb', [], []),
+        Instruction('a := b + c', [Dec('a', False)], [Use('b', False), Use('c', False)]),
+        Instruction('d := a', [Dec('d', False)], [Use('a', False)]),
+        Instruction('e := d + f', [Dec('e', False)], [Use('d', False), Use('f', False)]),
+
+        Instruction('bb', [], []),
+        Instruction('f := 2 + e', [Dec('f', False)], [Use('e', False)]),
+
+        Instruction('bb', [], []),
+        Instruction('b := d + e', [Dec('b', False)], [Use('d', False), Use('e', False)]),
+        Instruction('e := e - 1', [Dec('e', False)], [Use('e', False)]),
+
+        Instruction('bb', [], []),
+        Instruction('b := f + c', [Dec('b', False)], [Use('c', False), Use('f', False)]),
+    ])
+
+    live_in = register_allocation.compute_liveness(il, {0: [1, 2], 1: [3], 2: [3]})
+
+    assert live_in == [{'b', 'c', 'f'}, {'c', 'e'}, {'c', 'd', 'e', 'f'}, {'c', 'f'}]
+    assert [dec.reg for dec in il.instructions[4].dec] == ['c', 'e']
+    assert [use.dead for use in il.instructions[1].use] == [True, False]
+    assert [use.dead for use in il.instructions[3].use] == [False, False]
+    assert il.instructions[10].dec[0].dead
+
+    graph = register_allocation.build_graph(il)
+
+    for x, y in [('a', 'c'), ('a', 'f'), ('d', 'c'), ('d', 'f'), ('e', 'c'), ('e', 'd'), ('e', 'f'), ('b', 'c')]:
+        assert graph.contains_edge(x, y)
+    assert not graph.contains_edge('a', 'b')
+
+
+def test_compute_liveness_with_loop():
+    il = IntermediateLanguage([
+        Instruction('bb', [], []),
+        Instruction('i := 0', [Dec('i', False)], []),
+
+        Instruction('bb', [], []),
+        Instruction('i := i + n', [Dec('i', False)], [Use('i', False), Use('n', False)]),
+
+        Instruction('bb', [], []),
+        Instruction('return i', [], [Use('i', False)]),
+    ])
+
+    live_in = register_allocation.compute_liveness(il, {0: [1], 1: [1, 2]})
+
+    assert live_in == [{'n'}, {'i', 'n'}, {'i'}]
+    assert not il.instructions[3].use[1].dead
+    assert il.instructions[5].use[0].dead
+
+
+def test_block_profile_frequencies():
+    il = IntermediateLanguage([
+        Instruction('bb', [Dec('a', False)], []),
+        Instruction('b = a + 1', [Dec('b', False)], [Use('a', False)]),
+        Instruction('bb', [Dec('a', False), Dec('b', False)], []),
+        Instruction('copy', [Dec('c', False)], [Use('b', True)]),
+        Instruction('return a + c', [], [Use('a', True), Use('c', True)]),
+    ])
+
+    profile = BlockProfile.load(io.StringIO('# block counts\nv0 3\nv1: 120\nv1, 80\n'))
+    profile.apply_to_il(il)
+
+    assert [instruction.frequency for instruction in il.instructions if instruction.opcode == 'bb'] == [3, 200]
+
+    # counts in any float notation, integral ones as ints
+    profile = BlockProfile.load(io.StringIO('v0 1E3\nv1 2.5\nv2 4.0\nv3 1e-1\n'))
+    assert profile.blocks == {0: 1000, 1: 2.5, 2: 4, 3: 0.1}
+    assert isinstance(profile.blocks[0], int)
+
+    # Frequencies survive coalescing
+    register_allocation.coalesce_nodes(il, register_allocation.build_graph(il))
+    assert register_allocation.estimate_spill_costs(il) == {'a': 203, 'b': 403}
+
+
+def test_precolored_registers_and_clobbers():
+    il = IntermediateLanguage([
+        Instruction('bb', [], []),
+        Instruction('x := 1', [Dec('x', False)], []),
+        Instruction('call f', [Dec('r0', False)], [], clobbers=('r0', 'r1')),
+        Instruction('y := x + r0', [Dec('y', False)], [Use('x', False), Use('r0', False)]),
+        Instruction('return y', [], [Use('y', False)]),
+    ])
+    register_allocation.compute_liveness(il)
+    graph = register_allocation.build_graph(il)
+
+    # x is live across the call, so it interferes with everything the call clobbers
+    assert graph.contains_edge('x', 'r0') and graph.contains_edge('x', 'r1')
+    assert not graph.contains_edge('y', 'r0')
+
+    precolored = {'r0': 'red', 'r1': 'green'}
+    allowed = {'y': ['green']}
+    coloring = register_allocation.color_graph(graph, ['x', 'y'], ['red', 'green', 'blue'], precolored, allowed)
+    assert coloring == {'r0': 'red', 'r1': 'green', 'x': 'blue', 'y': 'green'}
+
+    # Without a color outside the clobbered ones x has to be spilled, never the precolored registers
+    assert register_allocation.color_graph(graph, ['x', 'y'], ['red', 'green'], precolored) is None
+    cost = register_allocation.estimate_spill_costs(il)
+    spilled = register_allocation.decide_spills(il, graph, ['red', 'green'], cost, precolored=precolored)
+    assert spilled == {'x'}
+
+
+def test_peephole():
+    il = IntermediateLanguage([
+        Instruction('bb', [Dec('a', False)], []),
+        Instruction('copy', [Dec('b', False)], [Use('a', False)]),
+        Instruction('reload', [Dec('s', False)], []),
+        Instruction('op1', [Dec('c', False)], [Use('s', True), Use('b', False)]),
+        Instruction('reload', [Dec('s', False)], []),
+        Instruction('spill', [], [Use('s', True)]),
+        Instruction('op2', [Dec('s', False)], [Use('s', True), Use('c', True)]),
+        Instruction('spill', [], [Use('s', True)]),
+        Instruction('op3', [Dec('d', False)], [Use('b', True)]),
+        Instruction('reload', [Dec('s', False)], []),
+        Instruction('bb', [Dec('s', False)], []),
+        Instruction('reload', [Dec('s', False)], []),
+    ])
+    coloring = {'a': 'red', 'b': 'red', 'c': 'green', 's': 'blue', 'd': 'green'}
+
+    assert register_allocation.peephole(il, coloring) == 4
+    # The copy between the same color, the second reload and the spill of the unchanged value are gone, the
+    # reload after op2 is not needed since its result was just spilled. A new block starts without known values.
+    assert [instruction.opcode for instruction in il.instructions] == \
+           ['bb', 'reload', 'op1', 'op2', 'spill', 'op3', 'bb', 'reload']
+
+
+def test_graph_decomposition():
+    graph = Graph()
+    # two triangles sharing the edge b-c, and a separate path x-y-z only joined to them through precolored r0
+    for x, y in [('a', 'b'), ('a', 'c'), ('b', 'c'), ('b', 'd'), ('c', 'd'), ('x', 'y'), ('y', 'z'),
+                 ('r0', 'a'), ('r0', 'x')]:
+        graph.add_edge(x, y)
+    nodes = ['a', 'b', 'c', 'd', 'x', 'y', 'z']
+    precolored = {'r0': 'red'}
+
+    assert register_allocation.components(graph, nodes, precolored) == [['a', 'b', 'c', 'd'], ['x', 'y', 'z']]
+    assert sorted(map(sorted, clique_separator_atoms(graph, ['a', 'b', 'c', 'd']))) == [['a', 'b', 'c'],
+                                                                                         ['b', 'c', 'd']]
+
+    for coloring in [register_allocation.color_graph(graph, nodes, ['red', 'green', 'blue'], precolored),
+                     color_decomposed(graph, nodes, ['red', 'green', 'blue'], precolored, jobs=1)]:
+        assert set(coloring) == set(nodes) | {'r0'}
+        assert all(coloring[x] != coloring[y] for x in coloring for y in graph.neighbors(x))
+        assert coloring['a'] != 'red' and coloring['x'] != 'red'
+
+    # with two colors each triangle needs a spill, the path does not
+    cost = {'a': 1, 'b': 5, 'c': 5, 'd': 2, 'x': 1, 'y': 1, 'z': 1}
+    assert register_allocation.decide_spills(None, graph, ['red', 'green'], cost, nodes, precolored) == {'a', 'd'}
+    assert decide_spills_decomposed(None, graph, ['red', 'green'], cost, nodes, precolored, jobs=1) == {'a', 'd'}
+
+
+def test_exact_coloring():
+    graph = Graph()
+    # a 4-cycle is 2-colorable, but every node has 2 neighbors so simplify gets stuck
+    for x, y in [('a', 'b'), ('b', 'c'), ('c', 'd'), ('d', 'a')]:
+        graph.add_edge(x, y)
+    nodes = ['a', 'b', 'c', 'd']
+    cost = {'a': 1, 'b': 2, 'c': 3, 'd': 4}
+
+    assert register_allocation.color_graph(graph, nodes, ['red', 'green']) is None
+    assert register_allocation.decide_spills(None, graph, ['red', 'green'], cost, nodes) == {'a'}
+    coloring = color_exact(graph, nodes, ['red', 'green'])
+    assert coloring['a'] == coloring['c'] != coloring['b'] == coloring['d']
+    assert decide_spills_exact(None, graph, ['red', 'green'], cost, nodes) == set()
+
+    # with one color, the cheaper of the two independent pairs is spilled
+    assert decide_spills_exact(None, graph, ['red'], cost, nodes) == {'a', 'c'}
+    # above the node cap the heuristics decide
+    assert color_exact(graph, nodes, ['red', 'green'], max_nodes=3) is None
+    assert decide_spills_exact(None, graph, ['red', 'green'], cost, nodes, max_nodes=3) == {'a'}
+
+    # a precolored neighbor leaves green to both a and b
+    graph.add_edge('r0', 'a')
+    graph.add_edge('r0', 'b')
+    assert color_exact(graph, nodes, ['red', 'green'], {'r0': 'red'}) is None
+    assert decide_spills_exact(None, graph, ['red', 'green'], cost, nodes, {'r0': 'red'}) == {'a'}
+
+
+def spill_example_il():
+    # http://web.cecs.pdx.edu/~mperkows/temp/register-allocation.pdf
+    il = IntermediateLanguage([
+        Instruction('bb', [], []),
+        Instruction('a := b + c', [Dec('a', False)], [Use('b', False), Use('c', False)]),
+        Instruction('d := a', [Dec('d', False)], [Use('a', False)]),
+        Instruction('e := d + f', [Dec('e', False)], [Use('d', False), Use('f', False)]),
+        Instruction('bb', [], [], frequency=10),
+        Instruction('f := 2 + e', [Dec('f', False)], [Use('e', False)]),
+        Instruction('bb', [], [], frequency=10),
+        Instruction('b := d + e', [Dec('b', False)], [Use('d', False), Use('e', False)]),
+        Instruction('e := e - 1', [Dec('e', False)], [Use('e', False)]),
+        Instruction('bb', [], []),
+        Instruction('b := f + c', [Dec('b', False)], [Use('c', False), Use('f', False)]),
+    ])
+    register_allocation.compute_liveness(il, {0: [1, 2], 1: [3], 2: [3]})
+    return il
+
+
+def test_portfolio():
+    il = spill_example_il()
+    result = run_portfolio(il, ['red', 'blue'], jobs=1, deadline=60)
+
+    assert len(result.scores) == len(CONFIGURATIONS)
+    assert result.spill_cost == min(result.scores.values()) < float('inf')
+    assert result.scores[result.configuration] == result.spill_cost
+    # il is rewritten to the winning allocation
+    graph = register_allocation.build_graph(il)
+    assert set(result.coloring) == il.registers()
+    assert all(result.coloring[x] != result.coloring[y] for x in graph.nodes() for y in graph.neighbors(x))
+
+    # in worker processes, with the same result for the same configurations
+    configurations = [result.configuration, Configuration('cost', 'none', False, 'first')]
+    pooled = run_portfolio(spill_example_il(), ['red', 'blue'], configurations=configurations, jobs=2, deadline=60)
+    assert (pooled.configuration, pooled.spill_cost) == (result.configuration, result.spill_cost)
+
+    # nothing finishes without time
+    assert run_portfolio(spill_example_il(), ['red', 'blue'], jobs=1, deadline=0) is None
+
+
+def test_coalesce_conservative_allowed():
+    def copy_il():
+        il = IntermediateLanguage([
+            Instruction('bb', [], []),
+            Instruction('a := load', [Dec('a', False)], []),
+            Instruction('copy', [Dec('b', False)], [Use('a', False)]),
+            Instruction('return b', [], [Use('b', False)]),
+        ])
+        register_allocation.compute_liveness(il)
+        return il
+
+    colors = ['red', 'blue']
+    # no color both may take: the copy stays
+    il = copy_il()
+    graph = register_allocation.build_graph(il)
+    assert coalesce_conservative(il, graph, colors, {}, {'a': ['red'], 'b': ['blue']}) == {'a': ['red'], 'b': ['blue']}
+    assert il.registers() == {'a', 'b'}
+
+    # the merged register keeps the colors both could take
+    il = copy_il()
+    graph = register_allocation.build_graph(il)
+    allowed = coalesce_conservative(il, graph, colors, {}, {'a': ['red', 'blue'], 'b': ['blue']})
+    assert len(il.registers()) == 1 and allowed == {next(iter(il.registers())): {'blue'}}
+
+
+def test_register_pressure():
+    # six values defined up front and all live across 'op'
+    values = ['a', 'b', 'c', 'd', 'e', 'f']
+    il = IntermediateLanguage(
+        [Instruction('bb', [], [])] +
+        [Instruction(f'{reg} := load', [Dec(reg, False)], []) for reg in values] +
+        [Instruction('bb', [], [], frequency=10),
+         Instruction('g := a + b', [Dec('g', False)], [Use('a', False), Use('b', False)]),
+         Instruction('op', [], []),
+         Instruction('return', [], [Use(reg, False) for reg in values + ['g']])])
+    register_allocation.compute_liveness(il)
+
+    report = il_pressure(il)
+    assert report.points == [[1, 2, 3, 4, 5, 6], [7, 7, 7]]
+    assert report.max_live == 7 and report.hotspots(6) == [(1, 7)]
+
+    # far above 3 registers: values live across 'op' or the addition without being used there are spilled up front
+    assert register_allocation.prespill(il, 3, precolored={'f': 'red'}) == {'c', 'd', 'e', 'g'}
+    # 'g := a + b', the spill of g, then 'op' with a, b and f left
+    assert il_pressure(il).points[1][:3] == [4, 4, 3]
+    # not above 1.5 times the registers
+    assert register_allocation.prespill(spill_example_il(), 3) == set()
+
+
+def test_schedule_il():
+    # eight loads up front, then a tree of additions over them
+    il = IntermediateLanguage(
+        [Instruction('bb', [], [])] +
+        [Instruction(f'l{i} := load {i}', [Dec(f'l{i}', False)], []) for i in range(8)] +
+        [Instruction(f's{i} := l{2 * i} + l{2 * i + 1}', [Dec(f's{i}', False)],
+                     [Use(f'l{2 * i}', False), Use(f'l{2 * i + 1}', False)]) for i in range(4)] +
+        [Instruction('t0 := s0 + s1', [Dec('t0', False)], [Use('s0', False), Use('s1', False)]),
+         Instruction('t1 := s2 + s3', [Dec('t1', False)], [Use('s2', False), Use('s3', False)]),
+         Instruction('r := t0 + t1', [Dec('r', False)], [Use('t0', False), Use('t1', False)]),
+         Instruction('return r', [], [Use('r', False)])])
+    register_allocation.compute_liveness(il)
+
+    before, after = schedule_il(il)
+    assert (before.max_live, after.max_live) == (8, 5)
+    assert [instruction.opcode for instruction in il.instructions[1:7]] == [
+        'l0 := load 0', 'l1 := load 1', 's0 := l0 + l1', 'l2 := load 2', 'l3 := load 3', 's1 := l2 + l3']
+    assert il.instructions[-1].opcode == 'return r'
+
+    # the updated dead flags are the ones liveness analysis finds for the new order
+    flags = [[dec.dead for dec in instruction.dec] + [use.dead for use in instruction.use]
+             for instruction in il.instructions]
+    register_allocation.compute_liveness(il)
+    assert flags == [[dec.dead for dec in instruction.dec] + [use.dead for use in instruction.use]
+                     for instruction in il.instructions]
+
+    # nothing to gain: the order stays
+    il = spill_example_il()
+    opcodes = [instruction.opcode for instruction in il.instructions]
+    before, after = schedule_il(il)
+    assert [instruction.opcode for instruction in il.instructions] == opcodes
+    assert before.max_live == after.max_live
+
+
+def test_cleanup_il():
+    il = IntermediateLanguage([
+        Instruction('bb', [], []),
+        Instruction('a := load', [Dec('a', False)], []),
+        Instruction('copy', [Dec('b', False)], [Use('a', False)]),
+        Instruction('copy', [Dec('c', False)], [Use('b', False)]),
+        Instruction('copy', [Dec('g', False)], [Use('r0', False)]),
+        Instruction('d := c + g', [Dec('d', False)], [Use('c', False), Use('g', False)]),
+        Instruction('e := load', [Dec('e', False)], []),
+        Instruction('f := call', [Dec('f', False)], [], clobbers=('r0',)),
+        Instruction('bb', [], [], frequency=10),
+        Instruction('copy', [Dec('h', False)], [Use('d', False)]),
+        Instruction('return h + c', [], [Use('h', False), Use('c', False)]),
+    ])
+    register_allocation.compute_liveness(il)
+    original = copy.deepcopy(il)
+    nodes = len(register_allocation.build_graph(il).nodes())
+
+    # the chain b, c resolves to a; the copy of precolored r0, the call and copies live into the next block stay
+    report = {}
+    assert register_allocation.cleanup_il(il, {'r0': 'r0'}, report=report) == 3
+    assert report == {'removed': 3, 'nodes_saved': 3, 'edges_saved': 2}
+    assert [(instruction.opcode, [dec.reg for dec in instruction.dec], [use.reg for use in instruction.use])
+            for instruction in il.instructions] == [
+        ('bb', ['r0'], []),
+        ('a := load', ['a'], []),
+        ('copy', ['c'], ['a']),
+        ('copy', ['g'], ['r0']),
+        ('d := c + g', ['d'], ['a', 'g']),
+        ('f := call', ['f'], []),
+        ('bb', ['c', 'd'], []),
+        ('return h + c', [], ['d', 'c']),
+    ]
+    assert il.instructions[6].frequency == 10
+    assert len(register_allocation.build_graph(il).nodes()) < nodes
+
+    # the dead flags and live-in sets are the ones liveness analysis finds
+    def flags():
+        return [[(dec.reg, dec.dead) for dec in instruction.dec] + [(use.reg, use.dead) for use in instruction.use]
+                for instruction in il.instructions]
+
+    cleaned = flags()
+    register_allocation.compute_liveness(il)
+    assert cleaned == flags()
+
+    # a copy to or from a register with allowed colors keeps its constraint
+    il = copy.deepcopy(original)
+    assert register_allocation.cleanup_il(il, {'r0': 'r0'}, {'b': ['red']}) == 2
+    assert [instruction.opcode for instruction in il.instructions[:4]] == ['bb', 'a := load', 'copy', 'copy']
+    assert [use.reg for use in il.instructions[2].use] == ['a']
+    assert [dec.reg for dec in il.instructions[2].dec] == ['b']
+
+
+def test_cleanup_before_prespill():
+    # five copies of s, each added to x: MaxLive 5 before the cleanup, 2 after
+    il = IntermediateLanguage(
+        [Instruction('bb', [], []),
+         Instruction('s := load', [Dec('s', False)], []),
+         Instruction('x := 0', [Dec('x', False)], [])] +
+        [Instruction('copy', [Dec(f'd{i}', False)], [Use('s', False)]) for i in range(1, 6)] +
+        [Instruction(f'x := x + d{i}', [Dec('x', False)], [Use('x', False), Use(f'd{i}', False)])
+         for i in range(1, 6)] +
+        [Instruction('return x', [], [Use('x', False)])])
+    register_allocation.compute_liveness(il)
+    assert il_pressure(il).max_live == 6
+
+    graph, coloring = register_allocation.run(il, ['red', 'blue'], plot=False)
+    assert coloring is not None
+    assert not [instruction for instruction in il.instructions if instruction.opcode in ('spill', 'reload')]
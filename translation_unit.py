@@ -0,0 +1,161 @@
+import os
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import chain, islice
+
+from cfg_analyzer import CFGAnalyzer
+from clike_cfg_builder import ClikeCFGBuilder
+from clike_instruction import pat_func_sign
+from instr_type import IS_INSTR, IS_BRANCH, IS_JUMP, IS_RET
+from rv32_instruction import RV32Instructions
+
+
+def split_functions(lines):
+    '''
+        Split a C-like translation unit at function boundaries.
+
+        Yields (name, first_line, lines) for every function definition, first_line being the 0-based line number
+        of its signature. Lines outside of function bodies (declarations, prototypes, blank lines) belong to no
+        function and are dropped.
+    '''
+    name = None
+    for line_num, line in enumerate(lines):
+        if name is None:
+            match = pat_func_sign.match(line)
+            if match is None:
+                continue
+            name = match.group(2)
+            first_line = line_num
+            body = []
+            depth = 0
+            opened = False
+
+        body.append(line)
+        depth += line.count('{') - line.count('}')
+        opened = opened or depth > 0
+
+        if not opened and line.rstrip().endswith(';'):
+            name = None # a prototype, not a definition
+        elif opened and depth <= 0:
+            yield name, first_line, body
+            name = None
+
+    if name is not None and opened:
+        yield name, first_line, body # unterminated function at the end of the file
+
+
+def split_asm_functions(lines):
+    '''
+        Split an RV32 assembly file at function labels.
+
+        Yields (name, first_line, lines) for every function, name being its first label (None for code before any
+        label). A label starts a new function when the code before it does not fall through (a return or a jump)
+        and nothing of the current function can reach it: no conditional branch of the file and no earlier jump of
+        the current function targets it, and it is not a .L local label. Directives and blank lines between two
+        functions go with the next one. A tail call to a function defined later in the file keeps the two together.
+    '''
+    instructions = [RV32Instructions(line_num, line.strip()) for line_num, line in enumerate(lines)]
+    branch_targets = {instr.branch_target() for instr in instructions if instr.mask & IS_BRANCH}
+
+    name = None
+    first_line = 0
+    body = []
+    gap = []  # lines after the return or jump that ended the code so far
+    ended = False
+    jump_targets = set()
+    for line, instr in zip(lines, instructions):
+        label = instr.label
+        if (ended and label is not None and not label.startswith('.L') and label not in branch_targets
+                and label not in jump_targets):
+            yield name, first_line, body
+            name, first_line, body, gap = label, instr.line_num - len(gap), gap, []
+            ended = False
+            jump_targets = set()
+        elif ended and (label is not None or instr.mask & IS_INSTR):
+            # a local label or unreachable code, still the same function
+            body += gap
+            gap = []
+            ended = False
+
+        if name is None and label is not None:
+            name = label
+        (gap if ended else body).append(line)
+        if instr.mask & IS_INSTR:
+            ended = bool(instr.mask & (IS_JUMP | IS_RET))
+            if instr.mask & IS_JUMP:
+                jump_targets.add(instr.branch_target())
+
+    if body or gap:
+        yield name, first_line, body + gap
+
+
+def analyze_function(function):
+    '''
+        Build the CFG of one function and solve its liveness. Runs in worker processes.
+    '''
+    name, first_line, lines = function
+    cfg_builder = ClikeCFGBuilder(lines, bb_enabled=True, first_line=first_line)
+    cfg_analyzer = CFGAnalyzer(cfg_builder)
+    cfg_analyzer.perform_liveness_analysis()
+    return name, cfg_analyzer
+
+
+def iter_translation_unit(lines, jobs=None, cache=None):
+    '''
+        Build an independent CFG and liveness result for every function of a translation unit.
+
+        lines can be any iterable of source lines, e.g. an open file, and is read lazily: only the functions being
+        analyzed are held in memory. Functions are analyzed in a process pool of the given number of workers (all
+        cores by default, jobs=1 stays in this process). With a CFGCache, unchanged functions are loaded from the
+        cache instead of being analyzed again. Yields (name, CFGAnalyzer) in source order.
+    '''
+    functions = split_functions(lines)
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+
+    def lookup(function):
+        # (cache key, cached result or None)
+        if cache is None:
+            return None, None
+        key = cache.key(function[2])
+        return key, cache.get(key, function[1])
+
+    def store(key, function, result):
+        if cache is not None:
+            cache.put(key, function[1], result)
+        return result
+
+    head = list(islice(functions, 2))
+    if jobs == 1 or len(head) < 2:
+        for function in chain(head, functions):
+            key, result = lookup(function)
+            yield result if result is not None else store(key, function, analyze_function(function))
+        return
+
+    # keep a bounded number of functions in flight so memory follows the largest functions, not the file
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending = deque()
+        for function in chain(head, functions):
+            key, result = lookup(function)
+            if result is None:
+                result = executor.submit(analyze_function, function)
+            pending.append((key, function, result))
+
+            if len(pending) >= jobs * 2:
+                yield finish(pending.popleft(), store)
+        while pending:
+            yield finish(pending.popleft(), store)
+
+
+def finish(item, store):
+    key, function, result = item
+    if isinstance(result, Future):
+        result = store(key, function, result.result())
+    return result
+
+
+def analyze_translation_unit(lines, jobs=None, cache=None):
+    '''
+        Like iter_translation_unit, but returns the list of all (name, CFGAnalyzer) results in source order.
+    '''
+    return list(iter_translation_unit(lines, jobs, cache))
@@ -0,0 +1,65 @@
+'''
+    Plotting of interference graphs and CFGs. Needs matplotlib and networkx, which are only imported with this module,
+    so the allocator and the CFG modules load quickly without them.
+'''
+import matplotlib.pyplot as plt
+import networkx as nx
+
+
+def plot_graph(graph, coloring, title):
+    G = nx.Graph()
+
+    # Sorting to get repeatable graphs
+    nodes = sorted(graph.nodes())
+    ordered_coloring = [coloring.get(node, 'grey') for node in nodes]
+    G.add_nodes_from(nodes)
+
+    for node in nodes:
+        for neighbor in graph.neighbors(node):
+            G.add_edge(node, neighbor)
+
+    plt.title(title)
+    nx.draw(G, pos=nx.circular_layout(G), node_color=ordered_coloring, with_labels=True, font_weight='bold')
+    plt.show()
+
+
+def plot_cfg(basic_blocks, edges):
+    '''
+        Draw a CFG, with the instructions of each block below it.
+    '''
+    G = nx.DiGraph()
+    # Add nodes
+    for idx, block in enumerate(basic_blocks):
+        node_label = f'v{idx}'
+        # Optionally, add instructions to the node label
+        instr_texts = [instr.text.strip() for instr in block.instructions]
+        instr_summary = '\n'.join(instr_texts)
+        G.add_node(node_label, label=node_label, instr=instr_summary)
+    # Add edges
+    for edge in edges:
+        src_id, dest_id = edge
+        src_label = f'v{src_id}'
+        dest_label = f'v{dest_id}'
+        G.add_edge(src_label, dest_label)
+    # Use the graphviz 'dot' layout for vertical arrangement
+    try:
+        pos = nx.nx_pydot.graphviz_layout(G, prog='dot')
+    except:
+        # If pygraphviz is not installed, fall back to spring_layout
+        print("PyGraphviz is not installed. Please install it to get a better layout.")
+        pos = nx.spring_layout(G)
+    # Draw nodes
+    nx.draw_networkx_nodes(G, pos, node_color='lightblue', node_size=200)
+    # Draw edges
+    nx.draw_networkx_edges(G, pos, arrowstyle='->', arrowsize=20)
+    # Draw labels
+    labels = {node: node for node in G.nodes()}
+    nx.draw_networkx_labels(G, pos, labels, font_size=10)
+    # Optionally, display instruction summaries
+    node_instrs = nx.get_node_attributes(G, 'instr')
+    for node, (x, y) in pos.items():
+        instrs = node_instrs[node]
+        plt.text(x, y - 30, instrs, fontsize=8, ha='center', va='top')
+    plt.axis('off')
+    plt.show()
+